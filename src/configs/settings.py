@@ -33,6 +33,11 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        # Log trace: mỗi dòng là một object JSON
+        'json_line': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         # 1. Ghi ra File (Lưu trữ)
@@ -45,6 +50,16 @@ LOGGING = {
             'formatter': 'verbose',
             'encoding': 'utf-8',
         },
+        # Trace từng request (thời gian từng chặng) dạng JSON lines
+        'trace_file': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(LOG_DIR, 'trace.log'),
+            'maxBytes': 1024 * 1024 * 20,
+            'backupCount': 5,
+            'formatter': 'json_line',
+            'encoding': 'utf-8',
+        },
         # 2. Hiện ra Console (Để bạn debug trực tiếp)
         'console': {
             'level': 'DEBUG',
@@ -59,6 +74,12 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        # Trace request (locator/middleware.py), không đẩy lên logger 'locator'
+        'locator.trace': {
+            'handlers': ['trace_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         # Logger cho hệ thống Django (Chỉ ghi lỗi)
         'django': {
             'handlers': ['file', 'console'],
@@ -88,13 +109,18 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    # Đứng trước staticfiles để lệnh collectstatic của locator (chạy build_static trước) được dùng
     'locator',
+    'django.contrib.staticfiles',
 ]
 
 MIDDLEWARE = [
+    # Đo thời gian toàn request: đặt ngoài cùng để bao cả các middleware khác
+    'locator.middleware.tracing_middleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # File trong STATIC_ROOT (sau collectstatic): trả bản nén sẵn, cache immutable cho tên đã gắn hash
+    'locator.static_assets.static_assets_middleware',
+    'locator.middleware.TimedSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -133,6 +159,39 @@ DATABASES = {
 }
 
 
+# Cache
+# Kho kết quả tìm kiếm ('results') dùng Redis khi có REDIS_URL, không thì LocMem trong tiến trình (chạy 1 process)
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'locator-default',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'locator-results',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Cache ô POI dùng chung giữa các worker và lệnh warm_cache (khi POI_CACHE_BACKEND = 'django')
+    'pois': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR.parent / 'data' / 'cache' / 'pois',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Session chỉ còn result_id + vị trí người dùng -> lưu trong cookie ký số, không ghi SQLite mỗi request
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -171,8 +230,136 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+STATIC_ROOT = BASE_DIR.parent / 'data' / 'staticfiles'
+# Vendor + bundle do manage.py build_static sinh ra (locator/static_assets.py)
+STATIC_BUILD_DIR = BASE_DIR.parent / 'data' / 'static_build'
+# SHA-256 của từng file vendor (commit cùng code): bản tải về khác lock thì build_static báo lỗi
+STATIC_VENDOR_LOCK = BASE_DIR / 'static_vendor.lock.json'
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'locator.static_assets.BuildFinder',
+]
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'locator.static_assets.CompressedManifestStaticFilesStorage'},
+}
+# Cache-Control cho file static không gắn hash (file có hash luôn là immutable 1 năm)
+STATIC_MAX_AGE = 3600
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# --- LOCATOR ---
+
+# Cache kết quả Overpass theo ô geohash (locator/utils.py)
+POI_CACHE_PRECISION = 6          # ô ~1.2km x 0.6km
+POI_CACHE_TTL = 15 * 60          # giây
+POI_CACHE_MAX_ENTRIES = 2048
+# 'local': TTLCache trong tiến trình; 'django': alias POI_CACHE_ALIAS trong CACHES (chia sẻ, warm_cache ghi vào được)
+POI_CACHE_BACKEND = os.getenv('POI_CACHE_BACKEND', 'django' if REDIS_URL else 'local')
+POI_CACHE_ALIAS = 'pois'
+
+# Chỉ mục POI cục bộ (manage.py build_poi_index); có file thì Overpass chỉ còn là phương án dự phòng
+POI_INDEX_PATH = BASE_DIR.parent / 'data' / 'poi_index.sqlite3'
+
+# Mirror Overpass theo thứ tự ưu tiên (để trống = danh sách mặc định trong locator/utils.py)
+OVERPASS_URLS = [u for u in os.getenv('OVERPASS_URLS', '').split(',') if u]
+
+# Client Overpass: mirror thứ hai được bắn nếu mirror đầu chưa trả lời sau OVERPASS_HEDGE_DELAY giây
+OVERPASS_TIMEOUT = 15
+OVERPASS_HEDGE_DELAY = 1.5
+
+# Tìm kiếm hàng loạt (locator/batch.py): số query tối đa mỗi request, số ô geohash gom vào một query Overpass,
+# số quán tối đa được làm giàu (Gemini) mỗi request
+BATCH_MAX_QUERIES = 500
+BATCH_MAX_RADIUS = 5000
+BATCH_TILES_PER_QUERY = 25
+BATCH_ENRICH_LIMIT = 24
+BATCH_OVERPASS_WORKERS = 4
+
+# Chat pipeline: tìm kiếm đầu cơ song song với intent LLM, làm giàu dữ liệu song song với sinh câu trả lời
+CHAT_PIPELINE = True
+
+# Cache câu trả lời LLM (locator/llm_cache.py): 'local' = LRU trong tiến trình, 'django' = CACHES[LLM_CACHE_ALIAS]
+LLM_CACHE_BACKEND = 'local'
+LLM_CACHE_ALIAS = 'default'
+LLM_CACHE_TTL = 30 * 60
+LLM_CACHE_MAX_ENTRIES = 2000
+
+# Cổng gọi LLM (locator/llm_gateway.py): số lệnh gọi đồng thời mỗi provider, hàng đợi, hạn chót mỗi request (giây).
+# Hàng đợi Ollama dài từ LLM_FAILOVER_QUEUE_DEPTH trở lên thì chuyển sang Gemini (nếu có GEMINI_API_KEY)
+OLLAMA_MAX_CONCURRENCY = 4
+GEMINI_MAX_CONCURRENCY = 8
+LLM_MAX_QUEUE = 64
+LLM_FAILOVER_QUEUE_DEPTH = 8
+LLM_DEADLINE = 30
+
+# Làm nóng LLM khi worker khởi động (locator/warmup.py, /readyz): nạp + ghim model Ollama, kiểm tra lại định kỳ (giây).
+# Chỉ chạy trong runserver / gunicorn / uvicorn / daphne / hypercorn / uwsgi; server khác đặt LOCATOR_SERVING=1
+LLM_WARMUP = True
+LLM_WARMUP_CHECK_INTERVAL = 300
+OLLAMA_KEEP_ALIVE = -1
+# Cửa sổ ngữ cảnh Ollama, dùng chung cho mọi lệnh gọi (khác nhau là Ollama nạp lại model)
+OLLAMA_NUM_CTX = 4096
+
+# Hội thoại nhiều lượt (locator/conversation.py): lịch sử theo session trong cache, giới hạn token ước lượng của
+# lịch sử gửi kèm mỗi lượt (vượt thì bỏ lượt cũ), thời gian giữ hội thoại không hoạt động (giây)
+CONVERSATION_CACHE_ALIAS = 'results'
+CONVERSATION_TOKEN_BUDGET = 1500
+CONVERSATION_TTL = 30 * 60
+
+# Admission control (locator/admission.py): request đồng thời tối đa, hàng đợi, thời gian chờ slot (giây) cho
+# nhóm chat và nhóm tìm kiếm. Số request đang chờ từ *_DEGRADE_ENRICH_DEPTH thì bỏ làm giàu dữ liệu,
+# từ *_DEGRADE_TEMPLATE_DEPTH thì chat trả lời mẫu (không gọi LLM); hàng đầy / chờ quá hạn -> 503 + Retry-After
+CHAT_MAX_CONCURRENCY = 8
+CHAT_MAX_QUEUE = 32
+CHAT_QUEUE_TIMEOUT = 10
+CHAT_DEGRADE_ENRICH_DEPTH = 4
+CHAT_DEGRADE_TEMPLATE_DEPTH = 16
+SEARCH_MAX_CONCURRENCY = 16
+SEARCH_MAX_QUEUE = 64
+SEARCH_QUEUE_TIMEOUT = 5
+SEARCH_DEGRADE_ENRICH_DEPTH = 8
+SEARCH_DEGRADE_TEMPLATE_DEPTH = 32
+
+# Kho kết quả tìm kiếm (locator/result_store.py)
+RESULT_CACHE_ALIAS = 'results'
+RESULT_CACHE_TTL = 60 * 60
+
+# Trọng số điểm tổng hợp khi chọn top-k ứng viên POI (locator/ranking.py)
+RANKING_WEIGHTS = {'distance': 0.7, 'open_now': 0.1, 'category': 0.2}
+
+# API khung nhìn bản đồ (locator/viewport.py)
+VIEWPORT_TILE_DEG = 0.01
+VIEWPORT_MAX_SPAN_DEG = 0.3
+VIEWPORT_CLUSTER_MAX_ZOOM = 16
+VIEWPORT_CLUSTER_PX = 60
+VIEWPORT_PAGE_SIZE = 300
+
+# Tile POI GeoJSON (locator/tiles.py), cache trên đĩa cạnh chỉ mục POI
+TILE_CACHE_DIR = BASE_DIR.parent / 'data' / 'tiles'
+TILE_MIN_ZOOM = VIEWPORT_CLUSTER_MAX_ZOOM
+TILE_MAX_ZOOM = 19
+TILE_CACHE_TTL = 24 * 3600
+
+# Gợi ý vị trí (locator/geocoder.py): chỉ mục dựng bằng manage.py build_geocode_index
+GEOCODE_INDEX_PATH = BASE_DIR.parent / 'data' / 'geocode_index.sqlite3'
+GEOCODE_CACHE_TTL = 6 * 60 * 60
+GEOCODE_CACHE_MAX_ENTRIES = 5000
+# Tiền tố ngắn (<= GEOCODE_SHORT_PREFIX_LEN ký tự) dùng top-k tính sẵn lúc dựng chỉ mục; bằng giới hạn limit của /api/geocode/
+GEOCODE_SHORT_PREFIX_LEN = 2
+GEOCODE_SHORT_PREFIX_TOP = 10
+NOMINATIM_TIMEOUT = 4
+# Chính sách Nominatim công cộng: User-Agent ghi tên ứng dụng, kèm địa chỉ liên hệ (cũng gửi qua tham số email)
+NOMINATIM_APP_NAME = 'AI-Locator/1.0'
+NOMINATIM_CONTACT = os.getenv('NOMINATIM_CONTACT', '')
+# Nominatim công cộng cho phép tối đa 1 request/giây; chuỗi không có kết quả thì không hỏi lại trong NOMINATIM_NEGATIVE_TTL giây
+NOMINATIM_RATE = 1.0
+NOMINATIM_NEGATIVE_TTL = 10 * 60
+
+# /metrics: để trống = cho mọi IP scrape; đặt danh sách IP để giới hạn
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
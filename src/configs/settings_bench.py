@@ -0,0 +1,30 @@
+"""
+Settings cho app được đo bởi manage.py benchmark (DJANGO_SETTINGS_MODULE=configs.settings_bench).
+Overpass/Ollama trỏ về server giả, bỏ chỉ mục cục bộ và cache dùng chung để lần đo nào cũng bắt đầu
+từ cùng một trạng thái.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR.parent / 'data' / 'bench' / 'bench.sqlite3',
+    }
+}
+
+CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'bench-{alias}'}
+    for alias in ('default', 'results', 'pois')
+}
+
+OVERPASS_URLS = [os.environ['BENCH_OVERPASS_URL']]
+POI_CACHE_BACKEND = 'local'
+POI_INDEX_PATH = None
+GEOCODE_INDEX_PATH = None
+LLM_CACHE_BACKEND = 'local'
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PlaceEnrichment
+
+
+@admin.register(PlaceEnrichment)
+class PlaceEnrichmentAdmin(admin.ModelAdmin):
+    list_display = ('osm_id', 'name', 'category_key', 'rating', 'open_hour', 'updated_at')
+    list_filter = ('category_key',)
+    search_fields = ('name', 'osm_id')
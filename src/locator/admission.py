@@ -0,0 +1,259 @@
+"""
+Kiểm soát tải (admission control) cho chat và tìm kiếm: mỗi nhóm endpoint có ngân sách request đồng thời riêng
+và hàng đợi FIFO có giới hạn + hạn chờ, để Ollama chậm không giữ hết worker làm /api/search/ chết đói theo.
+Hàng đợi càng dài thì request được hạ cấp: bỏ làm giàu dữ liệu -> trả lời mẫu (không gọi LLM) -> 503 + Retry-After.
+"""
+import math
+import threading
+import time
+import weakref
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from .llm_gateway import DeadlineExceeded, QueueFull, SlotQueue
+from .tracing import ADMISSIONS, SHED
+
+# Bậc phục vụ của một request đã được nhận
+FULL, SKIP_ENRICH, TEMPLATE_REPLY = 0, 1, 2
+LEVEL_NAMES = ('full', 'skip_enrich', 'template_reply')
+
+# Coi là đang shed nếu vừa từ chối request trong khoảng này (giây)
+SHEDDING_WINDOW = 10.0
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Slot đã được cấp cho một request; release() gọi được nhiều lần.
+    """
+
+    def __init__(self, budget, level, waited):
+        self.budget = budget
+        self.level = level
+        self.waited = waited
+        self.started = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    @property
+    def enrich(self):
+        return self.level < SKIP_ENRICH
+
+    def release(self):
+        with self._lock:
+            if self._released: return
+            self._released = True
+        self.budget.finish(time.monotonic() - self.started)
+
+
+class Budget:
+    """
+    Ngân sách của một nhóm endpoint. Bậc hạ cấp tính theo số request đang chờ lúc vào hàng;
+    chờ quá nửa hạn thì hạ thêm một bậc (thời gian còn lại không đủ cho đường đầy đủ).
+    """
+
+    def __init__(self, name, limit, max_waiting, timeout, enrich_depth, template_depth):
+        self.name = name
+        self.slots = SlotQueue(limit, max_waiting)
+        self.timeout = timeout
+        self.enrich_depth = enrich_depth
+        self.template_depth = template_depth
+        # Thời gian phục vụ trung bình (EWMA), dùng ước lượng Retry-After
+        self.service_seconds = 1.0
+        self.last_shed = None
+        self._lock = threading.Lock()
+
+    def level_for(self, depth, waited):
+        level = TEMPLATE_REPLY if depth >= self.template_depth else SKIP_ENRICH if depth >= self.enrich_depth else FULL
+        if waited > self.timeout / 2:
+            level = min(level + 1, TEMPLATE_REPLY)
+        return level
+
+    def retry_after(self):
+        waves = (self.slots.depth + 1) / max(self.slots.limit, 1)
+        return min(max(math.ceil(waves * self.service_seconds), 1), 60)
+
+    def _reject(self, reason):
+        self.last_shed = time.monotonic()
+        SHED.inc(group=self.name, reason=reason)
+        return Rejected(reason, self.retry_after())
+
+    def _ticket(self, depth, started):
+        waited = time.monotonic() - started
+        ticket = Ticket(self, self.level_for(depth, waited), waited)
+        ADMISSIONS.inc(group=self.name, level=LEVEL_NAMES[ticket.level])
+        return ticket
+
+    def admit(self):
+        """
+        Chờ slot (tối đa self.timeout giây). Trả về Ticket, raise Rejected nếu hàng đầy hoặc quá hạn.
+        """
+        depth, started = self.slots.depth, time.monotonic()
+        try:
+            self.slots.acquire(self.timeout)
+        except QueueFull:
+            raise self._reject('queue_full')
+        except DeadlineExceeded:
+            raise self._reject('timeout')
+        return self._ticket(depth, started)
+
+    async def aadmit(self):
+        depth, started = self.slots.depth, time.monotonic()
+        try:
+            await self.slots.aacquire(self.timeout)
+        except QueueFull:
+            raise self._reject('queue_full')
+        except DeadlineExceeded:
+            raise self._reject('timeout')
+        return self._ticket(depth, started)
+
+    def finish(self, seconds):
+        with self._lock:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * seconds
+        self.slots.release()
+
+    def state(self):
+        if self.last_shed is not None and time.monotonic() - self.last_shed < SHEDDING_WINDOW:
+            return 'shedding'
+        return 'degraded' if self.slots.depth >= self.enrich_depth else 'normal'
+
+    def stats(self):
+        return {
+            'state': self.state(),
+            'active': self.slots.active,
+            'waiting': self.slots.depth,
+            'limit': self.slots.limit,
+            'max_waiting': self.slots.max_waiting,
+            'service_seconds': round(self.service_seconds, 3),
+        }
+
+
+def budget_from_settings(name, prefix, limit, max_waiting, timeout):
+    max_waiting = getattr(settings, f'{prefix}_MAX_QUEUE', max_waiting)
+    return Budget(
+        name,
+        limit=getattr(settings, f'{prefix}_MAX_CONCURRENCY', limit),
+        max_waiting=max_waiting,
+        timeout=getattr(settings, f'{prefix}_QUEUE_TIMEOUT', timeout),
+        enrich_depth=getattr(settings, f'{prefix}_DEGRADE_ENRICH_DEPTH', max(1, max_waiting // 4)),
+        template_depth=getattr(settings, f'{prefix}_DEGRADE_TEMPLATE_DEPTH', max(1, max_waiting // 2)),
+    )
+
+
+BUDGETS = {
+    'chat': budget_from_settings('chat', 'CHAT', limit=8, max_waiting=32, timeout=10.0),
+    'search': budget_from_settings('search', 'SEARCH', limit=16, max_waiting=64, timeout=5.0),
+}
+
+
+def overloaded_response(rejected):
+    response = JsonResponse({
+        'status': 'error',
+        'message': "Hệ thống đang quá tải, vui lòng thử lại sau.",
+        'retry_after': rejected.retry_after,
+    }, status=503)
+    response['Retry-After'] = str(rejected.retry_after)
+    # Quá tải có thể sinh hàng loạt 503: đã có counter SHED, không ghi từng cái thành log ERROR
+    response._has_been_logged = True
+    return response
+
+
+class _ReleasingContent:
+    """
+    Bọc nội dung stream: nhả slot khi hết dữ liệu / lỗi, khi Django đóng response (gọi close() của nội dung),
+    hoặc khi wrapper bị thu hồi (client ngắt: task bị hủy và Django không gọi response.close()).
+    """
+
+    def __init__(self, content, ticket):
+        self._content = content
+        self._ticket = ticket
+        weakref.finalize(self, ticket.release)
+
+    def close(self):
+        self._ticket.release()
+
+
+class _ReleasingIterator(_ReleasingContent):
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._content)
+        except BaseException:
+            self.close()
+            raise
+
+
+class _ReleasingAsyncIterator(_ReleasingContent):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self._content)
+        except BaseException:
+            self.close()
+            raise
+
+
+def _finish(response, ticket):
+    if response.streaming:
+        # Giữ slot tới khi stream gửi xong (hoặc client ngắt giữa chừng)
+        wrap = _ReleasingAsyncIterator if response.is_async else _ReleasingIterator
+        response.streaming_content = wrap(response.streaming_content, ticket)
+    else:
+        ticket.release()
+    return response
+
+
+def admit(group):
+    """
+    Decorator cho view (sync hoặc async): chờ slot của nhóm, gắn request.admission (Ticket), hết slot thì 503.
+    """
+    budget = BUDGETS[group]
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                try:
+                    ticket = await budget.aadmit()
+                except Rejected as e:
+                    return overloaded_response(e)
+                request.admission = ticket
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    ticket.release()
+                    raise
+                return _finish(response, ticket)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                try:
+                    ticket = budget.admit()
+                except Rejected as e:
+                    return overloaded_response(e)
+                request.admission = ticket
+                try:
+                    response = view(request, *args, **kwargs)
+                except BaseException:
+                    ticket.release()
+                    raise
+                return _finish(response, ticket)
+        return wrapper
+    return decorator
+
+
+def stats():
+    return {name: budget.stats() for name, budget in BUDGETS.items()}
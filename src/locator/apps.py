@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class LocatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'locator'
+
+    def ready(self):
+        # Nạp sẵn model LLM ngay khi worker khởi động thay vì để request đầu tiên chịu thời gian nạp
+        from . import warmup
+        if getattr(settings, 'LLM_WARMUP', True) and warmup.serving_process():
+            warmup.start()
@@ -0,0 +1,208 @@
+"""
+Phiên bản async của luồng tìm kiếm / chat để chạy trên ASGI (configs/asgi.py):
+Overpass qua httpx, Ollama qua AsyncClient, Gemini qua generate_content_async.
+Dựng prompt và parse kết quả dùng chung với utils.py.
+"""
+import json
+import logging
+
+from .llm_cache import LLM_CACHE
+from .llm_gateway import (
+    LLM_GATEWAY, OLLAMA_KEEP_ALIVE, OLLAMA_MODEL, OLLAMA_OPTIONS, LLMUnavailable, as_messages, as_text, failover_reason,
+    gemini_available, gemini_model, ollama_async_client, record_prompt_eval,
+)
+from .tracing import span, traced
+from .models import PlaceEnrichment
+from .utils import (
+    KEYWORD_MAX_RESULTS, OVERPASS_CLIENT, STREAM_BEST_ID_MARKER, apply_enrichment, apply_stored_enrichment, build_answer_prompt,
+    build_enrich_prompt, build_intent_prompt, build_keyword_stores, build_nearby_stores, busy_answer, enrichment_records,
+    fill_tile, generate_mock_data, lookup_nearby_elements, osm_ids, parse_answer, parse_enrichment, parse_json_reply,
+    record_answer, save_enrichment_kwargs, template_answer,
+)
+
+logger = logging.getLogger('locator')
+
+async def afetch_overpass_data(query):
+    return await OVERPASS_CLIENT.afetch(query)
+
+
+async def afind_nearby_elements(lat, lng, radius, keyword=None, limit=None):
+    hits, miss = lookup_nearby_elements(lat, lng, radius, keyword, limit)
+    if miss:
+        hits = fill_tile(miss, await afetch_overpass_data(miss.query))
+    return hits
+
+
+@traced('intent')
+async def adetect_intent_with_llama(user_message):
+    cache_key = LLM_CACHE.key('intent', user_message)
+    cached = LLM_CACHE.get(cache_key)
+    if cached is not None: return dict(cached)
+
+    try:
+        intent = await LLM_GATEWAY.acomplete(build_intent_prompt(user_message), parse=parse_json_reply, stage='intent')
+    except LLMUnavailable:
+        return {"action": "CHAT"}
+    LLM_CACHE.set(cache_key, intent)
+    return intent
+
+
+@traced('answer')
+async def agenerate_answer_with_llama(user_message, stores_context, conversation=None):
+    cacheable = conversation is None or conversation.empty
+    cache_key = LLM_CACHE.key('answer', user_message, stores_context)
+    cached = LLM_CACHE.get(cache_key) if cacheable else None
+    if cached is not None:
+        if conversation is not None:
+            record_answer(conversation, user_message, stores_context, json.dumps(cached, ensure_ascii=False))
+            await conversation.asave()
+        return dict(cached)
+
+    try:
+        content = await LLM_GATEWAY.acomplete(build_answer_prompt(user_message, stores_context, conversation), stage='answer')
+    except LLMUnavailable:
+        return busy_answer()
+
+    answer = parse_answer(content, stores_context)
+    if cacheable: LLM_CACHE.set(cache_key, answer)
+    if conversation is not None:
+        record_answer(conversation, user_message, stores_context, content)
+        await conversation.asave()
+    return answer
+
+
+class AnswerStream:
+    """
+    Tách lời thoại (được đẩy ra ngay) khỏi dòng "BEST_ID: ..." ở cuối câu trả lời stream.
+    Giữ lại vài ký tự cuối chưa đẩy để không cắt đôi marker.
+    """
+
+    def __init__(self, marker=STREAM_BEST_ID_MARKER):
+        self.marker = marker
+        self.buffer = ''
+        self.sent = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk or ''
+        idx = self.buffer.find(self.marker)
+        limit = idx if idx >= 0 else len(self.buffer) - len(self.marker) + 1
+        if limit <= self.sent:
+            return ''
+        text, self.sent = self.buffer[self.sent:limit], limit
+        return text
+
+    def finish(self):
+        """
+        Trả về (phần lời thoại còn lại, best_id, có_marker).
+        """
+        idx = self.buffer.find(self.marker)
+        if idx < 0:
+            return self.buffer[self.sent:], None, False
+        tail = self.buffer[self.sent:idx] if self.sent < idx else ''
+        value = self.buffer[idx + len(self.marker):].strip().split()
+        best_id = value[0].strip('"\'<>[](),.') if value else None
+        return tail, (None if best_id in (None, '', 'null', 'None') else best_id), True
+
+
+async def _ollama_chunks(prompt):
+    # Giữ slot Ollama của gateway suốt cả stream
+    async with LLM_GATEWAY.aslot('ollama'):
+        stream = await ollama_async_client().chat(model=OLLAMA_MODEL, messages=as_messages(prompt), stream=True,
+                                                  keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS)
+        async for part in stream:
+            if part.get('done'): record_prompt_eval(part)
+            yield part['message']['content']
+
+
+async def _gemini_chunks(prompt):
+    async with LLM_GATEWAY.aslot('gemini'):
+        response = await gemini_model().generate_content_async(as_text(prompt), stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+async def astream_answer_with_llama(user_message, stores_context, conversation=None):
+    """
+    Sinh câu trả lời dạng stream. Yield ('token', text) cho từng đoạn lời thoại, cuối cùng ('done', best_store_id).
+    """
+    cacheable = conversation is None or conversation.empty
+    cache_key = LLM_CACHE.key('answer', user_message, stores_context)
+    cached = LLM_CACHE.get(cache_key) if cacheable else None
+    # Bản cache do generate_answer_with_llama ghi là JSON AI trả về, có thể thiếu 'reply' -> coi như miss
+    if cached is not None and cached.get('reply'):
+        best_id = cached.get('best_store_id')
+        if conversation is not None:
+            record_answer(conversation, user_message, stores_context, f"{cached['reply']}\n{STREAM_BEST_ID_MARKER} {best_id}")
+            await conversation.asave()
+        yield 'token', cached['reply']
+        yield 'done', best_id
+        return
+
+    prompt = build_answer_prompt(user_message, stores_context, conversation, stream=True)
+    parser = AnswerStream()
+
+    for source, name in ((_ollama_chunks, 'ollama'), (_gemini_chunks, 'gemini')):
+        try:
+            with span(name, stream=True):
+                async for chunk in source(prompt):
+                    text = parser.feed(chunk)
+                    if text: yield 'token', text
+            break
+        except Exception as e:
+            if not isinstance(e, LLMUnavailable): logger.warning(f"Stream Answer Error ({source.__name__}): {e}")
+            # Đã đẩy một phần câu trả lời -> không đổi nguồn giữa chừng
+            if parser.buffer: break
+            if name == 'ollama': LLM_GATEWAY.count_failover(name, 'answer_stream', failover_reason(e))
+    else:
+        yield 'token', busy_answer()['reply']
+        yield 'done', None
+        return
+
+    tail, best_id, has_marker = parser.finish()
+    if tail.strip(): yield 'token', tail.rstrip()
+    if not has_marker:
+        # Giống parse_answer: AI không theo định dạng -> gợi ý quán gần nhất
+        best_id = template_answer(stores_context)['best_store_id']
+    reply = (parser.buffer[:parser.buffer.find(parser.marker)] if has_marker else parser.buffer).strip()
+    if cacheable: LLM_CACHE.set(cache_key, {'reply': reply, 'best_store_id': best_id})
+    if conversation is not None:
+        record_answer(conversation, user_message, stores_context, parser.buffer)
+        await conversation.asave()
+    yield 'done', best_id
+
+
+@traced('enrich')
+async def aenrich_data_with_ai(stores, limit=8):
+    if not stores: return stores
+    targets = stores[:limit]
+    try:
+        records = [r async for r in PlaceEnrichment.objects.filter(osm_id__in=osm_ids(targets))]
+        missing = apply_stored_enrichment(targets, records)
+        if missing and gemini_available():
+            ai_data = await LLM_GATEWAY.acomplete(build_enrich_prompt(missing, len(missing)), parse=parse_enrichment,
+                                                  providers=('gemini',), stage='enrich')
+            apply_enrichment(missing, ai_data)
+            await PlaceEnrichment.objects.abulk_create(enrichment_records(missing, ai_data), **save_enrichment_kwargs())
+    except Exception as e:
+        logger.warning(f"Enrichment Error: {e}")
+    return stores
+
+
+async def asearch_specific_stores(lat, lng, keyword, radius=3000, enrich=True):
+    try: lat, lng = float(lat), float(lng)
+    except: return []
+
+    hits = await afind_nearby_elements(lat, lng, radius, keyword, limit=KEYWORD_MAX_RESULTS)
+    if not hits: return []
+    stores = build_keyword_stores(hits, keyword)
+    return await aenrich_data_with_ai(stores) if enrich else stores
+
+
+async def aget_nearby_stores(lat, lng, radius=1500, max_results=12):
+    try: lat, lng = float(lat), float(lng)
+    except: return []
+
+    hits = await afind_nearby_elements(lat, lng, radius, limit=max_results)
+    if hits is None:
+        return generate_mock_data(lat, lng)
+    return await aenrich_data_with_ai(build_nearby_stores(hits, max_results), limit=8)
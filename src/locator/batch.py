@@ -0,0 +1,145 @@
+"""
+Tìm kiếm hàng loạt (/api/search/batch/): nhiều (lat, lng, keyword, radius) trong một request.
+Điểm nào có sẵn trong chỉ mục POI / cache ô geohash thì trả ngay; các ô còn thiếu được gom theo keyword thành
+ít query Overpass (hợp các vòng tròn của ô), kết quả tách lại vào cache từng ô rồi xếp hạng cho từng điểm.
+Làm giàu dữ liệu chạy một lần cho tập quán đã khử trùng lặp.
+"""
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .ranking import rank_elements
+from .tracing import span, submit_traced
+from .utils import (
+    KEYWORD_MAX_RESULTS, OVERPASS_CLIENT, POI_CACHE, POI_CACHE_FETCH_LIMIT, build_keyword_stores, build_nearby_stores,
+    build_overpass_union_query, enrich_data_with_ai, lookup_nearby_elements, named_elements, run_closing_connections,
+    tile_circle,
+)
+
+logger = logging.getLogger('locator')
+
+BATCH_MAX_QUERIES = getattr(settings, 'BATCH_MAX_QUERIES', 500)
+BATCH_MAX_RADIUS = getattr(settings, 'BATCH_MAX_RADIUS', 5000)
+BATCH_TILES_PER_QUERY = getattr(settings, 'BATCH_TILES_PER_QUERY', 25)
+BATCH_ENRICH_LIMIT = getattr(settings, 'BATCH_ENRICH_LIMIT', 24)
+
+# Mặc định giống /api/search/ (không keyword) và tìm theo keyword trong chat
+NEARBY_RADIUS, NEARBY_RESULTS = 1500, 12
+KEYWORD_RADIUS = 3000
+
+BatchQuery = namedtuple('BatchQuery', 'lat lng keyword radius limit')
+
+EXECUTOR = ThreadPoolExecutor(max_workers=getattr(settings, 'BATCH_OVERPASS_WORKERS', 4), thread_name_prefix='batch-overpass')
+
+
+def parse_queries(items):
+    """
+    list dict từ JSON -> list BatchQuery. Raise ValueError (thông báo cho client) nếu dữ liệu sai.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("Thiếu danh sách queries")
+    if len(items) > BATCH_MAX_QUERIES:
+        raise ValueError(f"Tối đa {BATCH_MAX_QUERIES} query mỗi request")
+    queries = []
+    for i, item in enumerate(items):
+        try:
+            lat, lng = float(item['lat']), float(item['lng'])
+            keyword = (item.get('keyword') or '').strip() or None
+            radius = int(item.get('radius') or (KEYWORD_RADIUS if keyword else NEARBY_RADIUS))
+            limit = int(item.get('limit') or (KEYWORD_MAX_RESULTS if keyword else NEARBY_RESULTS))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError(f"Query {i} không hợp lệ")
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or not 0 < radius <= BATCH_MAX_RADIUS or not 0 < limit <= 50:
+            raise ValueError(f"Query {i} ngoài giới hạn (radius <= {BATCH_MAX_RADIUS}m, limit <= 50)")
+        if keyword and any(c in keyword for c in '"\\'):
+            raise ValueError(f"Query {i}: keyword không hợp lệ")
+        queries.append(BatchQuery(lat, lng, keyword, radius, limit))
+    return queries
+
+
+def plan_fetches(misses):
+    """
+    Gom các ô còn thiếu (khử trùng lặp theo key) thành nhóm cùng keyword, mỗi nhóm <= BATCH_TILES_PER_QUERY ô.
+    Sắp theo geohash để các ô trong một nhóm nằm gần nhau.
+    """
+    tiles = {}
+    for miss in misses:
+        tiles.setdefault(miss.key, miss.keyword)
+    groups = []
+    by_keyword = {}
+    for key in sorted(tiles):
+        by_keyword.setdefault(key[2], []).append(key)
+    for keys in by_keyword.values():
+        for i in range(0, len(keys), BATCH_TILES_PER_QUERY):
+            groups.append((tiles[keys[0]], keys[i:i + BATCH_TILES_PER_QUERY]))
+    return groups
+
+
+def fetch_group(keyword, keys):
+    """
+    Một query Overpass cho cả nhóm ô (giới hạn riêng từng ô), tách element về từng ô và ghi cache ô. Trả về {key: elements}, rỗng nếu Overpass lỗi.
+    """
+    circles = [tile_circle(key) for key in keys]
+    query = build_overpass_union_query(circles, keyword, limit=POI_CACHE_FETCH_LIMIT, timeout=60)
+    data = OVERPASS_CLIENT.fetch_round_robin(query)
+    if not data or 'elements' not in data:
+        return {}
+    # Các ô gần nhau trả trùng node ở chỗ giao nhau
+    elements = list({e['id']: e for e in named_elements(data)}.values())
+    tiles = {}
+    for key, (lat, lng, radius) in zip(keys, circles):
+        tiles[key] = [item for _, item in rank_elements(lat, lng, radius, elements)]
+        POI_CACHE.set(key, tiles[key])
+    return tiles
+
+
+def build_stores(query, hits):
+    if query.keyword:
+        return build_keyword_stores(hits, query.keyword, max_results=query.limit)
+    return build_nearby_stores(hits, max_results=query.limit)
+
+
+def batch_search(queries, enrich=True):
+    """
+    list kết quả theo đúng thứ tự queries: {'stores': [StoreRecord...]} hoặc {'stores': [], 'error': ...}.
+    """
+    hits_by_query = [None] * len(queries)
+    misses = {}
+    for i, q in enumerate(queries):
+        hits, miss = lookup_nearby_elements(q.lat, q.lng, q.radius, q.keyword, q.limit)
+        if miss: misses[i] = miss
+        else: hits_by_query[i] = hits
+
+    if misses:
+        groups = plan_fetches(misses.values())
+        with span('batch_overpass', queries=len(misses), requests=len(groups)):
+            futures = [submit_traced(EXECUTOR, run_closing_connections, fetch_group, keyword, keys) for keyword, keys in groups]
+            tiles = {}
+            for future in futures:
+                tiles.update(future.result())
+        for i, miss in misses.items():
+            elements = tiles.get(miss.key)
+            if elements is not None:
+                hits_by_query[i] = rank_elements(miss.lat, miss.lng, miss.radius, elements, miss.limit, miss.keyword)
+        logger.info(f"Batch search: {len(queries)} queries, {len(misses)} misses, {len(groups)} Overpass requests")
+
+    # Một StoreRecord gốc cho mỗi POI: làm giàu một lần, các query trùng quán nhận bản sao với khoảng cách riêng
+    results, canonical = [], {}
+    for q, hits in zip(queries, hits_by_query):
+        if hits is None:
+            results.append(None)
+            continue
+        stores = build_stores(q, hits)
+        for s in stores: canonical.setdefault(s.id, s)
+        results.append([(s.id, s.distance) for s in stores])
+
+    if enrich and canonical:
+        enrich_data_with_ai(list(canonical.values()), limit=BATCH_ENRICH_LIMIT)
+
+    return [
+        {'stores': [], 'error': 'overpass_unavailable'} if refs is None else
+        {'stores': [canonical[store_id].copy(distance=distance) for store_id, distance in refs]}
+        for refs in results
+    ]
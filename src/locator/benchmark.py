@@ -0,0 +1,242 @@
+"""
+Server giả cho manage.py benchmark: Overpass phát lại response đã ghi (thiếu thì sinh dữ liệu giả cố định theo
+câu truy vấn) và Ollama trả lời theo độ trễ token đầu + tốc độ token cấu hình được.
+Cả hai chạy trong thread của tiến trình đo, app được đo chạy ở tiến trình riêng và trỏ về đây.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+AROUND_RE = re.compile(r'around:(\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)')
+BBOX_RE = re.compile(r'\((-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)')
+INTENT_RE = re.compile(r'User says: "(.*?)"', re.S)
+STORE_ID_RE = re.compile(r'ID:(\S+) \|')
+
+SYNTHETIC_TAGS = [
+    {'amenity': 'cafe'}, {'amenity': 'restaurant'}, {'amenity': 'fast_food'}, {'amenity': 'fuel'},
+    {'amenity': 'pharmacy'}, {'amenity': 'bank'}, {'shop': 'convenience'}, {'shop': 'mobile_phone'},
+]
+HOURS = [None, '24/7', '07:00-22:00', 'Mo-Su 08:00-21:00']
+
+# Từ khóa -> tag OSM cho intent giả (gần với những gì llama3 trả về cho các câu mẫu)
+INTENT_KEYWORDS = {
+    'cafe': ('cafe', 'cà phê'), 'fuel': ('xăng',), 'pharmacy': ('thuốc',), 'atm': ('atm',),
+    'restaurant': ('nhà hàng', 'quán ăn', 'ăn gì'), 'car_repair': ('sửa xe',), 'bank': ('ngân hàng',),
+}
+
+FILLER = ("Mình gợi ý bạn ghé quán này vì nó gần nhất và được nhiều người đánh giá tốt, không gian thoải mái "
+          "phù hợp để ngồi lâu. Bạn bấm vào thẻ bên dưới để xem đường đi nhé.").split()
+
+
+def query_key(query):
+    return hashlib.sha1(' '.join(query.split()).encode('utf-8')).hexdigest()
+
+
+def synthetic_elements(query):
+    """
+    Node giả trong vùng của câu truy vấn (từng vòng around, hoặc bbox). Mỗi vùng sinh cố định theo chính nó,
+    nên query gộp nhiều vòng (tìm kiếm hàng loạt) thấy cùng dữ liệu với từng query lẻ.
+    """
+    keyword = re.search(r'\["(?:shop|amenity)"~"([^"|]+)",i\]', query)
+    keyword = keyword.group(1) if keyword else None
+    areas = []
+    for radius, lat, lng in dict.fromkeys(AROUND_RE.findall(query)):
+        spread = float(radius) / 111000
+        areas.append((float(lat) - spread, float(lng) - spread, float(lat) + spread, float(lng) + spread))
+    if not areas:
+        areas = [tuple(float(g) for g in m) for m in BBOX_RE.findall(query)]
+    elements = []
+    for area in areas:
+        elements += area_elements(area, keyword)
+    return elements
+
+
+def area_elements(area, keyword):
+    south, west, north, east = area
+    rnd = random.Random(query_key(f"{keyword}|{south:.5f},{west:.5f},{north:.5f},{east:.5f}"))
+    elements = []
+    for i in range(rnd.randint(40, 160)):
+        tags = dict(rnd.choice(SYNTHETIC_TAGS))
+        if keyword and rnd.random() < 0.5: tags['amenity'] = keyword
+        tags['name'] = f"{tags.get('amenity') or tags.get('shop')} {rnd.randint(1, 9999)}"
+        hours = rnd.choice(HOURS)
+        if hours: tags['opening_hours'] = hours
+        elements.append({
+            'type': 'node', 'id': rnd.randint(10 ** 8, 10 ** 10),
+            'lat': rnd.uniform(south, north), 'lon': rnd.uniform(west, east), 'tags': tags,
+        })
+    return elements
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+
+class FakeOverpass(FakeServer):
+    """
+    Overpass giả: fixture_dir/<sha1 truy vấn>.json nếu đã ghi, không thì dữ liệu giả.
+    recorder (hàm query -> JSON hoặc None) được gọi cho truy vấn chưa có fixture và kết quả được lưu lại.
+    """
+
+    def __init__(self, fixture_dir, latency=0.0, recorder=None):
+        super().__init__(OverpassHandler)
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.recorder = recorder
+
+    def respond(self, query):
+        path = os.path.join(self.fixture_dir, f"{query_key(query)}.json")
+        if os.path.exists(path):
+            self.count('replayed')
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        if self.recorder:
+            data = self.recorder(query)
+            if data is not None:
+                os.makedirs(self.fixture_dir, exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                self.count('recorded')
+                return data
+        self.count('synthetic')
+        return {'elements': synthetic_elements(query)}
+
+
+class OverpassHandler(QuietHandler):
+    def do_GET(self):
+        self.handle_query(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        self.handle_query(parse_qs(self.read_body().decode('utf-8')))
+
+    def handle_query(self, params):
+        query = (params.get('data') or [''])[0]
+        if self.server.latency: time.sleep(self.server.latency)
+        self.send_json(self.server.respond(query))
+
+
+class FakeOllama(FakeServer):
+    """
+    Ollama giả (/api/chat, có stream NDJSON): chờ first_token giây rồi đẩy từng token theo tokens_per_sec.
+    """
+
+    def __init__(self, first_token=0.4, tokens_per_sec=40.0, reply_tokens=40):
+        super().__init__(OllamaHandler)
+        self.first_token = first_token
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+
+    def reply_for(self, messages):
+        """
+        messages: list nội dung message của request (system prompt, lịch sử hội thoại, câu hỏi mới).
+        """
+        prompt = '\n'.join(messages)
+        intent = INTENT_RE.search(prompt)
+        if intent:
+            self.count('intent')
+            message = intent.group(1).lower()
+            for tag, words in INTENT_KEYWORDS.items():
+                if any(w in message for w in words):
+                    return [json.dumps({'action': 'SEARCH', 'keyword': tag})]
+            return [json.dumps({'action': 'CHAT'})]
+
+        self.count('answer')
+        # Dữ liệu quán mới nhất (lượt hỏi tiếp có thể không gửi lại)
+        ids = next((found for found in map(STORE_ID_RE.findall, reversed(messages)) if found), [])
+        best = ids[0] if ids else None
+        words = [FILLER[i % len(FILLER)] for i in range(self.reply_tokens)]
+        if 'BEST_ID:' in prompt:
+            return [w + ' ' for w in words] + [f"\nBEST_ID: {best}"]
+        return [json.dumps({'reply': ' '.join(words), 'best_store_id': best}, ensure_ascii=False)]
+
+    def token_delay(self, tokens):
+        return tokens / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+
+class OllamaHandler(QuietHandler):
+    def do_GET(self):
+        if self.path.startswith('/api/version'):
+            self.send_json({'version': 'bench'})
+        else:
+            self.send_json({'models': [{'name': 'llama3', 'model': 'llama3'}]})
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.read_body() or b'{}')
+        messages = payload.get('messages') or [{'content': payload.get('prompt', '')}]
+        chunks = server.reply_for([m.get('content', '') for m in messages])
+        # Mỗi chunk JSON của intent/answer tính theo số từ để thời gian sinh tỉ lệ với độ dài câu trả lời
+        chunk_tokens = [max(1, len(c.split())) for c in chunks]
+        model = payload.get('model', 'llama3')
+        time.sleep(server.first_token)
+
+        if payload.get('stream', True) is False:
+            time.sleep(server.token_delay(sum(chunk_tokens)))
+            self.send_json({**self.message(model, ''.join(chunks), done=True), **self.prompt_eval(messages)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk, tokens in zip(chunks, chunk_tokens):
+            self.write_chunk(self.message(model, chunk, done=False))
+            time.sleep(server.token_delay(tokens))
+        self.write_chunk({**self.message(model, '', done=True), **self.prompt_eval(messages)})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def message(self, model, content, done):
+        return {'model': model, 'created_at': '2024-01-01T00:00:00Z',
+                'message': {'role': 'assistant', 'content': content}, 'done': done}
+
+    def prompt_eval(self, messages):
+        # Ollama thật chỉ tính phần prompt chưa có trong KV cache; ở đây tính cả prompt
+        tokens = sum(len(m.get('content', '').split()) for m in messages)
+        return {'prompt_eval_count': tokens, 'prompt_eval_duration': tokens * 1_000_000}
+
+    def write_chunk(self, payload):
+        line = json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+        self.wfile.flush()
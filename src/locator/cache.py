@@ -0,0 +1,106 @@
+"""
+Cache trong bộ nhớ tiến trình: TTL + LRU, an toàn đa luồng.
+DjangoTTLCache có cùng giao diện nhưng lưu vào một alias trong CACHES (Redis / file) để nhiều tiến trình dùng chung.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class TTLCache:
+    """
+    Mỗi entry hết hạn sau `ttl` giây; khi đầy sẽ loại entry ít dùng nhất (LRU).
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class DjangoTTLCache:
+    """
+    Giao diện giống TTLCache trên một alias của Django cache; key tuple được nối thành chuỗi.
+    """
+
+    def __init__(self, alias, ttl=600, prefix=''):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        parts = key if isinstance(key, tuple) else (key,)
+        return ':'.join(str(p) for p in (self.prefix,) + parts if p != '')
+
+    def get(self, key, default=None):
+        value = caches[self.alias].get(self._key(key))
+        with self._lock:
+            if value is None: self.misses += 1
+            else: self.hits += 1
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        caches[self.alias].set(self._key(key), value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        caches[self.alias].delete(self._key(key))
+
+    def clear(self):
+        caches[self.alias].clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
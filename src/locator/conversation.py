@@ -0,0 +1,132 @@
+"""
+Hội thoại nhiều lượt: lịch sử message (dữ liệu quán, câu hỏi, câu trả lời) của mỗi session nằm trong cache
+CACHES[CONVERSATION_CACHE_ALIAS], session (cookie) chỉ giữ conversation_id.
+Prompt = system prompt cố định + lịch sử + phần mới, nên phần đầu prompt giữa hai lượt giữ nguyên và Ollama dùng lại
+KV cache của prefix đó: lượt hỏi tiếp chỉ phải xử lý dữ liệu quán (khi danh sách đổi) và câu hỏi mới.
+Lịch sử vượt CONVERSATION_TOKEN_BUDGET thì bỏ các lượt cũ, cắt một lần xuống nửa ngân sách để prefix ổn định lâu.
+"""
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+
+CONTEXT, QUESTION, ANSWER = 'context', 'question', 'answer'
+
+
+def _cache():
+    return caches[getattr(settings, 'CONVERSATION_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'CONVERSATION_TTL', 30 * 60)
+
+
+def token_budget():
+    return getattr(settings, 'CONVERSATION_TOKEN_BUDGET', 1500)
+
+
+def estimate_tokens(text):
+    # Không có tokenizer của llama3 ở đây: tiếng Việt trung bình ~3 ký tự / token
+    return len(text) // 3 + 1
+
+
+def digest(message):
+    return hashlib.sha1(message['content'].encode('utf-8')).hexdigest()[:16]
+
+
+class Conversation:
+    """
+    history: list (kind, message) theo thứ tự gửi; kind là CONTEXT, QUESTION hoặc ANSWER.
+    """
+
+    def __init__(self, conversation_id, history=None, context_digest=None):
+        self.id = conversation_id
+        self.history = [tuple(item) for item in history or ()]
+        self.context_digest = context_digest
+
+    @property
+    def key(self):
+        return f"conversation:{self.id}"
+
+    @property
+    def empty(self):
+        return not self.history
+
+    @classmethod
+    def _from_state(cls, conversation_id, state):
+        state = state or {}
+        return cls(conversation_id, state.get('history'), state.get('context_digest'))
+
+    @classmethod
+    def load(cls, conversation_id):
+        return cls._from_state(conversation_id, _cache().get(f"conversation:{conversation_id}"))
+
+    @classmethod
+    async def aload(cls, conversation_id):
+        return cls._from_state(conversation_id, await _cache().aget(f"conversation:{conversation_id}"))
+
+    @classmethod
+    def for_session(cls, session):
+        conversation_id = session.get('conversation_id')
+        if not conversation_id:
+            session['conversation_id'] = conversation_id = secrets.token_urlsafe(12)
+            return cls(conversation_id)
+        return cls.load(conversation_id)
+
+    @classmethod
+    async def afor_session(cls, session):
+        conversation_id = await session.aget('conversation_id')
+        if not conversation_id:
+            conversation_id = secrets.token_urlsafe(12)
+            await session.aset('conversation_id', conversation_id)
+            return cls(conversation_id)
+        return await cls.aload(conversation_id)
+
+    def _state(self):
+        return {'history': self.history, 'context_digest': self.context_digest}
+
+    def save(self):
+        _cache().set(self.key, self._state(), _ttl())
+
+    async def asave(self):
+        await _cache().aset(self.key, self._state(), _ttl())
+
+    def messages(self, system, context, question):
+        """
+        list message cho lượt này; dữ liệu quán chỉ gửi lại khi khác lần trước.
+        """
+        pending = [] if digest(context) == self.context_digest else [context]
+        return [system, *(message for _, message in self.history), *pending, question]
+
+    def record(self, context, question, answer):
+        """
+        Ghi lượt vừa xong (answer là nội dung thô LLM trả về, để lượt sau gửi lại đúng prefix đã cache).
+        """
+        if digest(context) != self.context_digest:
+            self.history.append((CONTEXT, context))
+            self.context_digest = digest(context)
+        self.history.append((QUESTION, question))
+        self.history.append((ANSWER, {'role': 'assistant', 'content': answer}))
+        self.trim()
+
+    def tokens(self):
+        return sum(estimate_tokens(message['content']) for _, message in self.history)
+
+    def trim(self, budget=None):
+        """
+        Quá ngân sách thì giữ các lượt mới nhất trong nửa ngân sách (ít nhất một lượt) và dữ liệu quán đang dùng.
+        """
+        budget = budget or token_budget()
+        if self.tokens() <= budget: return
+        kept, used = [], 0
+        for i in range(len(self.history) - 1, -1, -1):
+            kind, message = self.history[i]
+            used += estimate_tokens(message['content'])
+            if kind == QUESTION:
+                if kept and used > budget // 2: break
+                kept = self.history[i:]
+        if not any(kind == CONTEXT for kind, _ in kept):
+            context = next((item for item in reversed(self.history) if item[0] == CONTEXT), None)
+            if context: kept = [context] + kept
+        self.history = kept
@@ -0,0 +1,72 @@
+"""
+Tiện ích địa lý dùng chung: geohash, khoảng cách haversine, bounding box.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_INDEX = {c: i for i, c in enumerate(_GEOHASH_BASE32)}
+
+
+def geohash_encode(lat, lng, precision=6):
+    """
+    Mã hóa tọa độ thành chuỗi geohash (precision 6 ~ ô 1.2km x 0.6km).
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bit, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, val = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_GEOHASH_BASE32[ch])
+            bit, ch = 0, 0
+    return ''.join(chars)
+
+
+def geohash_decode(geohash):
+    """
+    Giải mã geohash -> (lat tâm, lng tâm, nửa chiều cao, nửa chiều rộng) tính bằng độ.
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for c in geohash:
+        cd = _GEOHASH_INDEX[c]
+        for mask in (16, 8, 4, 2, 1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if cd & mask:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (
+        (lat_range[0] + lat_range[1]) / 2,
+        (lng_range[0] + lng_range[1]) / 2,
+        (lat_range[1] - lat_range[0]) / 2,
+        (lng_range[1] - lng_range[0]) / 2,
+    )
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bbox_around(lat, lng, radius_m):
+    """
+    Bounding box (south, west, north, east) bao trọn vòng tròn bán kính radius_m.
+    """
+    dlat = math.degrees(radius_m / 1000.0 / EARTH_RADIUS_KM)
+    dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
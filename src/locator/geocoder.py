@@ -0,0 +1,251 @@
+"""
+Gợi ý địa điểm cho ô tìm vị trí: chỉ mục tiền tố cục bộ (SQLite, khóa đã bỏ dấu, sắp xếp theo B-tree)
+dựng từ tên địa danh / đường phố / POI trong bản trích OSM, thêm LRU cho các tiền tố hay gõ.
+Chỉ gọi Nominatim khi chỉ mục không có kết quả, tối đa NOMINATIM_RATE request/giây (chính sách dùng Nominatim
+công cộng là 1 request/giây); chuỗi không có kết quả được nhớ để không hỏi lại theo từng phím gõ.
+Tiền tố 1-2 ký tự khớp gần như cả chỉ mục nên top-k của chúng được tính sẵn lúc dựng (bảng short_prefixes).
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+import requests
+from django.conf import settings
+
+from .cache import TTLCache
+from .overpass import RateLimiter
+from .text import fold_text
+from .tracing import span
+
+logger = logging.getLogger('locator')
+
+NOMINATIM_URL = getattr(settings, 'NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+GEOCODE_CACHE = TTLCache(
+    maxsize=getattr(settings, 'GEOCODE_CACHE_MAX_ENTRIES', 5000),
+    ttl=getattr(settings, 'GEOCODE_CACHE_TTL', 6 * 3600),
+)
+# Chuỗi Nominatim không trả kết quả (hoặc lỗi): giữ ngắn hơn để dữ liệu mới / mạng hồi phục vẫn được thấy
+NOMINATIM_MISSES = TTLCache(
+    maxsize=getattr(settings, 'GEOCODE_CACHE_MAX_ENTRIES', 5000),
+    ttl=getattr(settings, 'NOMINATIM_NEGATIVE_TTL', 10 * 60),
+)
+NOMINATIM_LIMITER = RateLimiter(getattr(settings, 'NOMINATIM_RATE', 1.0))
+# Chính sách Nominatim: User-Agent nêu đúng tên ứng dụng kèm địa chỉ liên hệ, không giả trình duyệt
+NOMINATIM_CONTACT = getattr(settings, 'NOMINATIM_CONTACT', '')
+NOMINATIM_HEADERS = {
+    'User-Agent': f"{getattr(settings, 'NOMINATIM_APP_NAME', 'AI-Locator/1.0')}"
+                  + (f" ({NOMINATIM_CONTACT})" if NOMINATIM_CONTACT else ''),
+}
+
+GEOCODE_SHORT_PREFIX_LEN = getattr(settings, 'GEOCODE_SHORT_PREFIX_LEN', 2)
+GEOCODE_SHORT_PREFIX_TOP = getattr(settings, 'GEOCODE_SHORT_PREFIX_TOP', 10)
+
+SCHEMA = """
+    CREATE TABLE places (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        display_name TEXT NOT NULL,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        kind TEXT NOT NULL,
+        rank INTEGER NOT NULL
+    );
+    CREATE TABLE prefixes (key TEXT NOT NULL, place_id INTEGER NOT NULL, rank INTEGER NOT NULL);
+    CREATE TABLE short_prefixes (key TEXT NOT NULL, pos INTEGER NOT NULL, place_id INTEGER NOT NULL, PRIMARY KEY (key, pos));
+"""
+
+# Xếp hạng trên toàn bộ khóa khớp rồi mới cắt: cắt trước theo thứ tự khóa sẽ bỏ sót kết quả tốt hơn
+TOP_PLACES_SQL = """
+    SELECT place_id, MIN(rank) AS r, MIN(LENGTH(key)) AS l FROM prefixes WHERE key >= ? AND key < ?
+    GROUP BY place_id ORDER BY r, l, place_id LIMIT ?
+"""
+
+# Hạng hiển thị: địa danh trước, rồi đường phố, rồi POI
+PLACE_RANKS = {'city': 0, 'town': 0, 'district': 1, 'suburb': 1, 'quarter': 2, 'village': 2, 'neighbourhood': 3, 'hamlet': 3}
+STREET_RANK = 4
+POI_RANK = 5
+STREET_HIGHWAYS = {'primary', 'secondary', 'tertiary', 'residential', 'unclassified', 'trunk', 'living_street', 'pedestrian', 'service'}
+
+
+def place_kind(tags):
+    """
+    (kind, rank) của element OSM có tên, hoặc None nếu không dùng cho gợi ý vị trí.
+    """
+    if not tags.get('name'): return None
+    if tags.get('place'):
+        return tags['place'], PLACE_RANKS.get(tags['place'], 3)
+    if tags.get('highway') in STREET_HIGHWAYS:
+        return 'street', STREET_RANK
+    if tags.get('shop') or tags.get('amenity') or tags.get('tourism') or (tags.get('building') == 'yes' and tags.get('addr:street')):
+        return 'poi', POI_RANK
+    return None
+
+
+def display_name(tags):
+    parts = [tags['name']]
+    for key in ('addr:street', 'addr:district', 'addr:city'):
+        if tags.get(key) and tags[key] not in parts: parts.append(tags[key])
+    return ', '.join(parts)
+
+
+def element_location(item):
+    # Node có lat/lon; way từ Overpass "out center" có center
+    if item.get('lat') is not None and item.get('lon') is not None:
+        return item['lat'], item['lon']
+    center = item.get('center') or {}
+    if center.get('lat') is not None:
+        return center['lat'], center['lon']
+    return None
+
+
+def prefix_keys(folded):
+    """
+    Khóa cho mọi vị trí bắt đầu từ: "pho hang bai" -> "pho hang bai", "hang bai", "bai",
+    để gõ "hang b" cũng ra "Phố Hàng Bài".
+    """
+    words = folded.split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def build_geocode_index(path, elements):
+    """
+    Ghi chỉ mục gợi ý mới (thay file cũ nguyên tử). Đường phố trùng tên gần nhau (nhiều đoạn way) chỉ giữ một.
+    Trả về số địa điểm đã ghi.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    seen = set()
+    places, keys = [], []
+    for item in elements:
+        tags = item.get('tags') or {}
+        kind = place_kind(tags)
+        location = element_location(item)
+        if not kind or not location: continue
+        folded = fold_text(tags['name'])
+        if not folded: continue
+        dedupe = (folded, kind[0], round(location[0], 2), round(location[1], 2))
+        if dedupe in seen: continue
+        seen.add(dedupe)
+        place_id = len(places) + 1
+        places.append((place_id, tags['name'], display_name(tags), location[0], location[1], kind[0], kind[1]))
+        keys.extend((key, place_id, kind[1]) for key in prefix_keys(folded))
+
+    conn.executemany("INSERT INTO places VALUES (?, ?, ?, ?, ?, ?, ?)", places)
+    conn.executemany("INSERT INTO prefixes VALUES (?, ?, ?)", keys)
+    conn.execute("CREATE INDEX prefixes_key ON prefixes (key, rank)")
+    # Top-k tính sẵn cho tiền tố ngắn: mỗi tiền tố quét đoạn khóa của nó một lần lúc dựng thay vì mỗi phím gõ
+    shorts = sorted({key[:n] for key, _, _ in keys for n in range(1, GEOCODE_SHORT_PREFIX_LEN + 1) if len(key) >= n})
+    for prefix in shorts:
+        top = conn.execute(TOP_PLACES_SQL, (prefix, prefix + '\uffff', GEOCODE_SHORT_PREFIX_TOP)).fetchall()
+        conn.executemany("INSERT INTO short_prefixes VALUES (?, ?, ?)", [(prefix, pos, row[0]) for pos, row in enumerate(top)])
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return len(places)
+
+
+class GeocodeIndex:
+    """
+    Đọc file chỉ mục; mỗi thread giữ một kết nối SQLite read-only riêng.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.mtime = os.path.getmtime(self.path)
+        self._local = threading.local()
+        # File dựng bởi bản cũ không có bảng short_prefixes
+        self.has_short_prefixes = self._conn().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'short_prefixes'").fetchone() is not None
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def search(self, query, limit=5):
+        folded = fold_text(query)
+        if not folded: return []
+        if self.has_short_prefixes and len(folded) <= GEOCODE_SHORT_PREFIX_LEN and limit <= GEOCODE_SHORT_PREFIX_TOP:
+            rows = self._conn().execute(
+                """SELECT p.display_name, p.lat, p.lon, p.kind FROM short_prefixes s JOIN places p ON p.id = s.place_id
+                   WHERE s.key = ? ORDER BY s.pos LIMIT ?""",
+                (folded, limit),
+            )
+        else:
+            # Quét đoạn khóa [folded, folded + '\uffff') trên index B-tree = tìm tiền tố trên mảng đã sắp xếp
+            rows = self._conn().execute(
+                f"""SELECT p.display_name, p.lat, p.lon, p.kind FROM ({TOP_PLACES_SQL}) x JOIN places p ON p.id = x.place_id
+                    ORDER BY x.r, x.l, x.place_id""",
+                (folded, folded + '\uffff', limit),
+            )
+        return [{'display_name': r[0], 'lat': r[1], 'lon': r[2], 'kind': r[3], 'source': 'local'} for r in rows]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_geocode_index():
+    """
+    Chỉ mục dùng chung cho tiến trình; tự nạp lại khi file được dựng lại. None nếu chưa có file.
+    """
+    global _index
+    path = getattr(settings, 'GEOCODE_INDEX_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    with _index_lock:
+        try:
+            if _index is None or _index.path != str(path) or _index.mtime != os.path.getmtime(path):
+                _index = GeocodeIndex(path)
+        except sqlite3.Error as e:
+            logger.error(f"Geocode Index Error: {e}")
+            _index = None
+    return _index
+
+
+_session = requests.Session()
+_session.headers.update(NOMINATIM_HEADERS)
+
+
+def nominatim_search(query, limit=5):
+    try:
+        params = {'format': 'json', 'q': query, 'countrycodes': 'vn', 'limit': limit}
+        if NOMINATIM_CONTACT: params['email'] = NOMINATIM_CONTACT
+        r = _session.get(NOMINATIM_URL, params=params,
+                         timeout=getattr(settings, 'NOMINATIM_TIMEOUT', 4))
+        r.raise_for_status()
+        return [{'display_name': p['display_name'], 'lat': float(p['lat']), 'lon': float(p['lon']),
+                 'kind': p.get('type') or 'place', 'source': 'nominatim'} for p in r.json()]
+    except Exception as e:
+        logger.warning(f"Nominatim Error: {e}")
+        return None
+
+
+def geocode(query, limit=5):
+    """
+    Gợi ý vị trí cho chuỗi đang gõ: LRU -> chỉ mục cục bộ -> Nominatim.
+    Nominatim rỗng / lỗi thì nhớ trong NOMINATIM_MISSES; chưa tới lượt gọi (giới hạn tốc độ) thì trả về [] không cache.
+    """
+    key = (fold_text(query), limit)
+    cached = GEOCODE_CACHE.get(key)
+    if cached is not None: return cached
+
+    index = get_geocode_index()
+    results = index.search(query, limit) if index else []
+    if not results:
+        if NOMINATIM_MISSES.get(key) or not NOMINATIM_LIMITER.try_acquire(): return []
+        with span('nominatim'):
+            results = nominatim_search(query, limit)
+        if not results:
+            NOMINATIM_MISSES.set(key, True)
+            return []
+    GEOCODE_CACHE.set(key, results)
+    return results
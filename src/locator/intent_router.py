@@ -0,0 +1,156 @@
+"""
+Bộ định tuyến intent dựa trên luật (tiếng Việt + tiếng Anh, không phân biệt dấu).
+Trả lời ngay các câu rõ ràng ("tìm cây xăng", "ATM gần đây", "cảm ơn") và chỉ đẩy các câu mơ hồ lên LLM.
+"""
+import logging
+import threading
+import time
+
+from .text import tokenize
+
+logger = logging.getLogger('locator')
+
+# Tag OSM -> cụm từ nhận diện (viết có dấu cho dễ đọc, được bỏ dấu khi dựng trie)
+TAG_PHRASES = {
+    'fuel': ['xăng', 'cây xăng', 'trạm xăng', 'đổ xăng', 'xăng dầu', 'petrolimex', 'gas', 'gas station', 'petrol', 'fuel'],
+    'atm': ['atm', 'cây atm', 'rút tiền', 'cash machine'],
+    'bank': ['ngân hàng', 'bank', 'vietcombank', 'techcombank', 'vietinbank', 'agribank', 'bidv', 'vpbank'],
+    'pharmacy': ['nhà thuốc', 'hiệu thuốc', 'quầy thuốc', 'mua thuốc', 'pharmacity', 'long châu', 'pharmacy', 'drugstore'],
+    'cafe': ['cafe', 'cà phê', 'cafê', 'coffee', 'trà sữa', 'highlands'],
+    'restaurant': ['nhà hàng', 'quán ăn', 'ăn trưa', 'ăn tối', 'restaurant', 'chỗ ăn'],
+    'fast_food': ['đồ ăn nhanh', 'fast food', 'gà rán', 'kfc', 'lotteria', 'burger', 'mcdonald'],
+    'hospital': ['bệnh viện', 'cấp cứu', 'hospital'],
+    'car_repair': ['sửa xe', 'tiệm sửa xe', 'vá xe', 'gara', 'garage', 'car repair'],
+    'mobile_phone': ['sửa điện thoại', 'điện thoại', 'thay màn hình', 'phone repair', 'mobile phone'],
+    'convenience': ['tạp hóa', 'cửa hàng tiện lợi', 'circle k', 'winmart', 'ministop', 'convenience store'],
+    'clothes': ['quần áo', 'shop thời trang', 'thời trang', 'clothes', 'clothing'],
+}
+
+# Dấu hiệu muốn tìm chỗ mới
+SEARCH_CUES = ['tìm', 'kiếm', 'ở đâu', 'đâu', 'gần đây', 'gần nhất', 'quanh đây', 'chỉ đường', 'cần', 'muốn',
+               'find', 'where', 'nearest', 'nearby', 'near', 'looking for', 'search']
+
+# Câu xã giao / hỏi về danh sách đang hiển thị
+CHAT_CUES = ['cảm ơn', 'cám ơn', 'thanks', 'thank you', 'xin chào', 'chào', 'hello', 'hi', 'ok', 'oke',
+             'quán này', 'quán đó', 'chỗ này', 'chỗ đó', 'cái nào', 'quán nào', 'review', 'đánh giá']
+
+
+def _build_trie(phrases):
+    root = {}
+    for phrase, value in phrases:
+        node = root
+        for token in tokenize(phrase):
+            node = node.setdefault(token, {})
+        node[None] = value
+    return root
+
+
+def _scan(trie, tokens):
+    """
+    Quét từ trái sang phải, lấy cụm khớp dài nhất tại mỗi vị trí. Trả về list giá trị khớp.
+    """
+    found, i = [], 0
+    while i < len(tokens):
+        node, j, match, match_end = trie, i, None, i
+        while j < len(tokens) and tokens[j] in node:
+            node = node[tokens[j]]
+            j += 1
+            if None in node:
+                match, match_end = node[None], j
+        if match is not None:
+            found.append(match)
+            i = match_end
+        else:
+            i += 1
+    return found
+
+
+class RouterStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.escalated = 0
+        self.route_seconds = 0.0
+        self.llm_seconds = 0.0
+
+    def record_route(self, seconds):
+        with self._lock:
+            self.routed += 1
+            self.route_seconds += seconds
+
+    def record_escalation(self, llm_seconds):
+        with self._lock:
+            self.escalated += 1
+            self.llm_seconds += llm_seconds
+
+    def snapshot(self):
+        total = self.routed + self.escalated
+        avg_llm = self.llm_seconds / self.escalated if self.escalated else 0.0
+        return {
+            'routed': self.routed,
+            'escalated': self.escalated,
+            'hit_rate': round(self.routed / total, 3) if total else 0.0,
+            'avg_route_us': round(self.route_seconds / self.routed * 1e6, 1) if self.routed else 0.0,
+            'avg_llm_s': round(avg_llm, 3),
+            # Ước lượng: mỗi câu định tuyến tại chỗ tiết kiệm một lần gọi LLM trung bình
+            'saved_s': round(self.routed * avg_llm, 1),
+        }
+
+
+class IntentRouter:
+    def __init__(self, tag_phrases=TAG_PHRASES, search_cues=SEARCH_CUES, chat_cues=CHAT_CUES, log_every=200):
+        self.tags = _build_trie((p, tag) for tag, phrases in tag_phrases.items() for p in phrases)
+        self.cues = _build_trie([(p, 'search') for p in search_cues] + [(p, 'chat') for p in chat_cues])
+        self.stats = RouterStats()
+        self.log_every = log_every
+
+    def match_tags(self, message):
+        return list(dict.fromkeys(_scan(self.tags, tokenize(message))))
+
+    def guess_tag(self, message):
+        tags = self.match_tags(message)
+        return tags[0] if len(tags) == 1 else None
+
+    def _decide(self, message, current_categories):
+        tokens = tokenize(message)
+        if not tokens:
+            return {"action": "CHAT"}
+        tags = list(dict.fromkeys(_scan(self.tags, tokens)))
+        cues = set(_scan(self.cues, tokens))
+
+        if len(tags) == 1:
+            tag = tags[0]
+            in_list = tag in current_categories
+            if 'search' in cues and not in_list:
+                return {"action": "SEARCH", "keyword": tag}
+            if not in_list and len(tokens) <= 4 and 'chat' not in cues:
+                return {"action": "SEARCH", "keyword": tag}
+            if in_list and 'search' not in cues:
+                return {"action": "CHAT"}
+            return None
+        if not tags and 'chat' in cues and 'search' not in cues:
+            return {"action": "CHAT"}
+        return None
+
+    def classify(self, message, current_stores=()):
+        """
+        Trả về dict intent giống detect_intent_with_llama, hoặc None nếu cần hỏi LLM.
+        """
+        started = time.perf_counter()
+        categories = {s.category_key for s in current_stores or ()}
+        decision = self._decide(message, categories)
+        if decision is not None:
+            self.stats.record_route(time.perf_counter() - started)
+            self._maybe_log()
+        return decision
+
+    def record_escalation(self, llm_seconds):
+        self.stats.record_escalation(llm_seconds)
+        self._maybe_log()
+
+    def _maybe_log(self):
+        if self.log_every and (self.stats.routed + self.stats.escalated) % self.log_every == 0:
+            logger.info(f"Intent router: {self.stats.snapshot()}")
+
+
+ROUTER = IntentRouter()
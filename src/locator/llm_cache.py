@@ -0,0 +1,90 @@
+"""
+Cache câu trả lời LLM: key = câu hỏi đã chuẩn hóa (thường, bỏ dấu, gộp khoảng trắng) + dấu vân tay
+các ID quán trong ngữ cảnh. Trúng cache thì không gọi Ollama/Gemini.
+Backend: 'local' (LRU trong tiến trình) hoặc 'django' (một alias trong CACHES, ví dụ Redis).
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import TTLCache
+from .text import fold_text
+
+
+def normalize_message(message):
+    return fold_text(message)
+
+
+def store_fingerprint(stores, limit=5):
+    # Prompt trả lời chỉ dùng 5 quán đầu
+    return ','.join(s.id for s in (stores or [])[:limit])
+
+
+class LocalLRUBackend:
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class DjangoCacheBackend:
+    def __init__(self, alias):
+        self.alias = alias
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, value, ttl):
+        caches[self.alias].set(key, value, ttl)
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+class LLMCache:
+    def __init__(self, backend, ttl=1800, prefix='llm'):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, message, stores=None):
+        raw = f"{normalize_message(message)}|{store_fingerprint(stores)}"
+        return f"{self.prefix}:{kind}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None: self.misses += 1
+            else: self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+
+def build_llm_cache():
+    ttl = getattr(settings, 'LLM_CACHE_TTL', 1800)
+    if getattr(settings, 'LLM_CACHE_BACKEND', 'local') == 'django':
+        backend = DjangoCacheBackend(getattr(settings, 'LLM_CACHE_ALIAS', 'default'))
+    else:
+        backend = LocalLRUBackend(getattr(settings, 'LLM_CACHE_MAX_ENTRIES', 2000), ttl)
+    return LLMCache(backend, ttl=ttl)
+
+
+LLM_CACHE = build_llm_cache()
@@ -0,0 +1,395 @@
+"""
+Cổng gọi LLM dùng chung cho intent, trả lời và làm giàu dữ liệu (sync lẫn async):
+- single-flight: các prompt giống hệt nhau đang chạy chỉ gọi LLM một lần, các request sau chờ chung kết quả;
+- mỗi provider có giới hạn số lệnh gọi đồng thời + hàng đợi FIFO có giới hạn, mỗi request có hạn chót;
+- hàng đợi Ollama dài quá LLM_FAILOVER_QUEUE_DEPTH (hoặc đầy, hoặc chờ quá hạn) thì chuyển sang Gemini ngay,
+  không chỉ khi Ollama báo lỗi.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import asynccontextmanager
+
+import google.generativeai as genai
+import ollama
+from django.conf import settings
+
+from .tracing import FALLBACKS, PROMPT_EVAL_SECONDS, PROMPT_EVAL_TOKENS, span
+
+logger = logging.getLogger('locator')
+
+OLLAMA_MODEL = 'llama3'
+GEMINI_MODEL = 'gemini-pro'
+# Thời gian Ollama giữ model trong RAM sau lệnh gọi cuối (-1 = ghim luôn, không tự unload khi rảnh)
+OLLAMA_KEEP_ALIVE = getattr(settings, 'OLLAMA_KEEP_ALIVE', -1)
+# Mọi lệnh gọi phải dùng cùng num_ctx: khác num_ctx với model đang nạp là Ollama nạp lại model
+OLLAMA_OPTIONS = {'num_ctx': getattr(settings, 'OLLAMA_NUM_CTX', 4096)}
+
+try:
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+except Exception as e:
+    logger.error(f"Gemini Config Error: {e}")
+
+
+class LLMUnavailable(Exception):
+    """Không provider nào trả lời được trong hạn (lỗi, hàng đợi đầy hoặc quá hạn)."""
+
+
+class QueueFull(LLMUnavailable):
+    pass
+
+
+class Overloaded(LLMUnavailable):
+    """Hàng đợi provider dài quá LLM_FAILOVER_QUEUE_DEPTH: nên chuyển provider thay vì xếp hàng."""
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+class LeaderGone(Exception):
+    """
+    Leader của single-flight bị hủy (client ngắt) trước khi có kết quả: không phải lỗi backend, follower tự gọi lại.
+    """
+
+
+class SlotQueue:
+    """
+    Semaphore có hàng đợi FIFO dùng được cho cả thread (Event) lẫn coroutine (Future của event loop),
+    để request WSGI và ASGI cùng xếp một hàng trước Ollama. Nhả slot thì trao thẳng cho người chờ đầu hàng.
+    """
+
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return len(self._waiters)
+
+    def _enter(self, waiter):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.max_waiting:
+                raise QueueFull(f"{len(self._waiters)} request đang chờ")
+            self._waiters.append(waiter)
+            return False
+
+    def _withdraw(self, waiter):
+        # True nếu rút khỏi hàng kịp; False nghĩa là slot vừa được trao -> đang giữ slot
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    def acquire(self, timeout):
+        event = threading.Event()
+        if self._enter(event): return
+        if not event.wait(max(0.0, timeout)) and self._withdraw(event):
+            raise DeadlineExceeded("Hết hạn khi chờ slot")
+
+    async def aacquire(self, timeout):
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        if self._enter(waiter): return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter): raise DeadlineExceeded("Hết hạn khi chờ slot")
+        except BaseException:
+            # Request bị hủy (client ngắt kết nối): rời hàng, hoặc trả lại slot nếu đã được trao
+            if not self._withdraw(waiter): self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+
+class Provider:
+    def __init__(self, name, call, acall, limit, max_waiting):
+        self.name = name
+        self.call = call
+        self.acall = acall
+        self.slots = SlotQueue(limit, max_waiting)
+        self.calls = 0
+        self.errors = 0
+
+
+_ollama_client = None
+_ollama_async_clients = weakref.WeakKeyDictionary()
+
+
+def ollama_client():
+    global _ollama_client
+    if _ollama_client is None:
+        _ollama_client = ollama.Client(timeout=getattr(settings, 'LLM_DEADLINE', 30))
+    return _ollama_client
+
+
+def ollama_async_client():
+    # AsyncClient giữ một httpx.AsyncClient bên trong -> mỗi event loop một instance
+    loop = asyncio.get_running_loop()
+    client = _ollama_async_clients.get(loop)
+    if client is None:
+        client = ollama.AsyncClient(timeout=getattr(settings, 'LLM_DEADLINE', 30))
+        _ollama_async_clients[loop] = client
+    return client
+
+
+def failover_reason(error):
+    if isinstance(error, Overloaded): return 'queue_depth'
+    if isinstance(error, QueueFull): return 'queue_full'
+    if isinstance(error, DeadlineExceeded): return 'deadline'
+    return 'error'
+
+
+_gemini_model = None
+
+
+def gemini_model():
+    # Một GenerativeModel cho cả tiến trình thay vì dựng lại ở mỗi lệnh gọi
+    global _gemini_model
+    if _gemini_model is None:
+        _gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+    return _gemini_model
+
+
+def gemini_available():
+    return bool(os.getenv("GEMINI_API_KEY"))
+
+
+# prompt là một chuỗi (gửi thành một message user) hoặc list message {'role', 'content'} của hội thoại nhiều lượt
+def as_messages(prompt):
+    return [{'role': 'user', 'content': prompt}] if isinstance(prompt, str) else prompt
+
+
+def as_text(prompt):
+    """
+    Gemini nhận một chuỗi: ghép các message theo thứ tự, đánh dấu các câu trả lời cũ của trợ lý.
+    """
+    if isinstance(prompt, str): return prompt
+    return '\n\n'.join(f"TRỢ LÝ ĐÃ TRẢ LỜI: {m['content']}" if m['role'] == 'assistant' else m['content'] for m in prompt)
+
+
+def record_prompt_eval(response):
+    """
+    Số token prompt Ollama phải xử lý (phần không trùng prefix đã cache) và thời gian xử lý.
+    """
+    tokens = response.get('prompt_eval_count')
+    if tokens is None: return
+    PROMPT_EVAL_TOKENS.inc(tokens)
+    PROMPT_EVAL_SECONDS.observe((response.get('prompt_eval_duration') or 0) / 1e9)
+
+
+# Ollama: timeout đặt một lần ở client (LLM_DEADLINE); Gemini nhận phần hạn còn lại của từng request
+def call_ollama(prompt, timeout):
+    response = ollama_client().chat(model=OLLAMA_MODEL, messages=as_messages(prompt), keep_alive=OLLAMA_KEEP_ALIVE,
+                                    options=OLLAMA_OPTIONS)
+    record_prompt_eval(response)
+    return response['message']['content']
+
+
+async def acall_ollama(prompt, timeout):
+    response = await ollama_async_client().chat(model=OLLAMA_MODEL, messages=as_messages(prompt),
+                                                keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS)
+    record_prompt_eval(response)
+    return response['message']['content']
+
+
+def call_gemini(prompt, timeout):
+    return gemini_model().generate_content(as_text(prompt), request_options={'timeout': timeout}).text
+
+
+async def acall_gemini(prompt, timeout):
+    return (await gemini_model().generate_content_async(as_text(prompt), request_options={'timeout': timeout})).text
+
+
+class LLMGateway:
+    def __init__(self, providers, deadline=30, failover_depth=8):
+        self.providers = {p.name: p for p in providers}
+        self.deadline = deadline
+        self.failover_depth = failover_depth
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+        self.failovers = {}
+
+    def _key(self, stage, providers, prompt):
+        if not isinstance(prompt, str): prompt = json.dumps(prompt, ensure_ascii=False)
+        return hashlib.sha1(f"{stage}|{','.join(providers)}|{prompt}".encode('utf-8')).hexdigest()
+
+    def _join(self, key):
+        """
+        (future, leader): request đầu tiên của một prompt là leader và tự gọi LLM, các request sau chờ future của nó.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None: future.set_exception(error)
+        else: future.set_result(result)
+
+    def _plan(self, providers, stage):
+        """
+        Thứ tự provider thực sự thử: Ollama quá tải (hàng chờ >= failover_depth) thì đưa provider sau lên trước.
+        """
+        order = [self.providers[name] for name in providers if name != 'gemini' or gemini_available()]
+        if len(order) > 1 and order[0].slots.depth >= self.failover_depth:
+            self.count_failover(order[0].name, stage, 'queue_depth')
+            order = order[1:] + order[:1]
+        return order
+
+    def count_failover(self, name, stage, reason):
+        with self._lock:
+            self.failovers[reason] = self.failovers.get(reason, 0) + 1
+        FALLBACKS.inc(stage=stage, reason=reason)
+        logger.debug(f"LLM failover from {name} ({stage}): {reason}")
+
+    def _failed(self, provider, stage, error, last):
+        reason = failover_reason(error)
+        if reason == 'error':
+            provider.errors += 1
+            logger.warning(f"LLM {provider.name} Error ({stage}): {error}")
+        if not last: self.count_failover(provider.name, stage, reason)
+
+    def complete(self, prompt, parse=str, providers=('ollama', 'gemini'), stage='llm', deadline=None):
+        """
+        parse(text) của provider đầu tiên trả lời hợp lệ; parse lỗi thì thử provider kế tiếp (như khi gọi lỗi).
+        Raise LLMUnavailable nếu không còn provider nào.
+        """
+        expires = time.monotonic() + (deadline or self.deadline)
+        key = self._key(stage, providers, prompt)
+        while True:
+            future, leader = self._join(key)
+            if leader: break
+            try:
+                return future.result(timeout=max(0.0, expires - time.monotonic()))
+            except FutureTimeout:
+                raise DeadlineExceeded("Hết hạn khi chờ request trùng prompt")
+            except LeaderGone:
+                continue
+
+        try:
+            order = self._plan(providers, stage)
+            for provider in order:
+                try:
+                    with span('llm_queue', provider=provider.name):
+                        provider.slots.acquire(expires - time.monotonic())
+                    try:
+                        provider.calls += 1
+                        with span(provider.name):
+                            result = parse(provider.call(prompt, max(1.0, expires - time.monotonic())))
+                    finally:
+                        provider.slots.release()
+                except Exception as e:
+                    self._failed(provider, stage, e, last=provider is order[-1])
+                    continue
+                self._finish(key, future, result=result)
+                return result
+            raise LLMUnavailable(f"Không provider nào trả lời ({stage})")
+        except BaseException as e:
+            if not future.done(): self._finish(key, future, error=e if isinstance(e, Exception) else LeaderGone(stage))
+            raise
+
+    async def acomplete(self, prompt, parse=str, providers=('ollama', 'gemini'), stage='llm', deadline=None):
+        expires = time.monotonic() + (deadline or self.deadline)
+        key = self._key(stage, providers, prompt)
+        while True:
+            future, leader = self._join(key)
+            if leader: break
+            try:
+                # shield: hết hạn chờ không được hủy future dùng chung của leader
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), max(0.0, expires - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Hết hạn khi chờ request trùng prompt")
+            except LeaderGone:
+                # Leader bị hủy: follower đầu tiên gọi lại sẽ thành leader mới
+                continue
+
+        try:
+            order = self._plan(providers, stage)
+            for provider in order:
+                try:
+                    with span('llm_queue', provider=provider.name):
+                        await provider.slots.aacquire(expires - time.monotonic())
+                    try:
+                        provider.calls += 1
+                        with span(provider.name):
+                            result = parse(await provider.acall(prompt, max(1.0, expires - time.monotonic())))
+                    finally:
+                        provider.slots.release()
+                except Exception as e:
+                    self._failed(provider, stage, e, last=provider is order[-1])
+                    continue
+                self._finish(key, future, result=result)
+                return result
+            raise LLMUnavailable(f"Không provider nào trả lời ({stage})")
+        except BaseException as e:
+            if not future.done(): self._finish(key, future, error=e if isinstance(e, Exception) else LeaderGone(stage))
+            raise
+
+    @asynccontextmanager
+    async def aslot(self, name, deadline=None):
+        """
+        Giữ một slot của provider suốt một lệnh gọi stream. Raise Overloaded nếu hàng đợi quá dài để người gọi chuyển provider.
+        """
+        provider = self.providers[name]
+        if name != 'gemini' and gemini_available() and provider.slots.depth >= self.failover_depth:
+            raise Overloaded(f"Hàng đợi {name} quá dài")
+        with span('llm_queue', provider=name):
+            await provider.slots.aacquire(deadline or self.deadline)
+        provider.calls += 1
+        try:
+            yield
+        finally:
+            provider.slots.release()
+
+    def stats(self):
+        return {
+            'providers': {name: {'active': p.slots.active, 'queued': p.slots.depth, 'calls': p.calls, 'errors': p.errors}
+                          for name, p in self.providers.items()},
+            'inflight': len(self._inflight),
+            'coalesced': self.coalesced,
+            'failovers': dict(self.failovers),
+        }
+
+
+LLM_MAX_QUEUE = getattr(settings, 'LLM_MAX_QUEUE', 64)
+LLM_GATEWAY = LLMGateway(
+    [
+        Provider('ollama', call_ollama, acall_ollama, getattr(settings, 'OLLAMA_MAX_CONCURRENCY', 4), LLM_MAX_QUEUE),
+        Provider('gemini', call_gemini, acall_gemini, getattr(settings, 'GEMINI_MAX_CONCURRENCY', 8), LLM_MAX_QUEUE),
+    ],
+    deadline=getattr(settings, 'LLM_DEADLINE', 30),
+    failover_depth=getattr(settings, 'LLM_FAILOVER_QUEUE_DEPTH', 8),
+)
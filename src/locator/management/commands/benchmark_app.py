@@ -0,0 +1,281 @@
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.benchmark import FakeOllama, FakeOverpass
+from locator.management.commands.loadtest_chat import DEFAULT_MESSAGES, percentile
+
+SCENARIOS = ('search', 'chat')
+STAGE_RE = re.compile(r'^locator_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.M)
+COMPARE_FIELDS = ('throughput', 'p50', 'p95', 'p99', 'kb_per_request')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_memory(pid):
+    """
+    (VmRSS, VmHWM) tính bằng KB của tiến trình và các tiến trình con trực tiếp (worker gunicorn...), None nếu không có /proc.
+    """
+    def status(p):
+        with open(f'/proc/{p}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+
+    try:
+        pids = [pid]
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(p) for p in f.read().split()]
+        samples = [status(p) for p in pids]
+    except (OSError, KeyError, ValueError):
+        return None
+    return sum(s[0] for s in samples), sum(s[1] for s in samples)
+
+
+def sample_points(n, lat, lng, spread_km, seed):
+    rnd = random.Random(seed)
+    d = spread_km / 111.0
+    return [(round(lat + rnd.uniform(-d, d), 5), round(lng + rnd.uniform(-d, d), 5)) for _ in range(n)]
+
+
+def stage_totals(metrics_text):
+    totals = {}
+    for kind, stage, value in STAGE_RE.findall(metrics_text):
+        totals.setdefault(stage, {'sum': 0.0, 'count': 0.0})[kind] = float(value)
+    return totals
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo /api/search/ và /api/chat/ offline: Overpass giả phát lại fixture đã ghi (thiếu thì sinh dữ liệu giả cố định),\n"
+        "Ollama giả với độ trễ token đầu / tốc độ token cấu hình được. App chạy ở tiến trình riêng (configs.settings_bench),\n"
+        "báo throughput, p50/p95/p99, bộ nhớ (RSS) mỗi request và thời gian từng chặng (/metrics). Ví dụ:\n"
+        "  manage.py benchmark_app --output before.json\n"
+        "  manage.py benchmark_app --compare before.json\n"
+        "  manage.py benchmark_app --record   (ghi fixture Overpass thật cho các điểm đo, cần mạng)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Lặp lại để chọn nhiều (mặc định: tất cả)")
+        parser.add_argument('--requests', type=int, default=200, help="Số request được đo mỗi kịch bản")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=10, help="Số request chạy trước, không tính vào kết quả")
+        parser.add_argument('--points', type=int, default=20, help="Số điểm tìm kiếm (sinh cố định theo --seed)")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--lat', type=float, default=21.0285)
+        parser.add_argument('--lng', type=float, default=105.8542)
+        parser.add_argument('--spread-km', type=float, default=3.0)
+        parser.add_argument('--overpass-latency', type=float, default=0.3, help="Giây, mỗi truy vấn Overpass giả")
+        parser.add_argument('--llm-first-token', type=float, default=0.4, help="Giây tới token đầu của Ollama giả")
+        parser.add_argument('--llm-tokens-per-sec', type=float, default=40.0)
+        parser.add_argument('--llm-reply-tokens', type=int, default=40, help="Độ dài câu trả lời của Ollama giả (token)")
+        parser.add_argument('--fixtures', default=str(settings.BASE_DIR.parent / 'data' / 'bench' / 'overpass'))
+        parser.add_argument('--record', action='store_true', help="Truy vấn chưa có fixture thì gọi Overpass thật rồi lưu lại")
+        parser.add_argument('--server-cmd', default=None,
+                            help="Lệnh chạy app, {port} được thay bằng cổng (mặc định: manage.py runserver --noreload)")
+        parser.add_argument('--chat-path', default='/api/chat/', help="Ví dụ /api/chat/async/ khi chạy ASGI")
+        parser.add_argument('--timeout', type=float, default=120.0)
+        parser.add_argument('--output', default=None, help="Ghi kết quả JSON để so sánh về sau")
+        parser.add_argument('--compare', default=None, help="File JSON của lần đo trước")
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or list(SCENARIOS)
+        recorder = None
+        if options['record']:
+            from locator.utils import OVERPASS_CLIENT
+            recorder = OVERPASS_CLIENT.fetch
+
+        overpass = FakeOverpass(options['fixtures'], latency=options['overpass_latency'], recorder=recorder).start()
+        ollama = FakeOllama(options['llm_first_token'], options['llm_tokens_per_sec'], options['llm_reply_tokens']).start()
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        points = sample_points(options['points'], options['lat'], options['lng'], options['spread_km'], options['seed'])
+
+        process, log = self.start_app(port, overpass.url, ollama.url, options)
+        try:
+            self.wait_ready(process, base_url, log)
+            results = {name: asyncio.run(self.run_scenario(name, base_url, points, process.pid, options)) for name in scenarios}
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+            overpass.shutdown()
+            ollama.shutdown()
+
+        self.report(results, overpass.stats, ollama.stats)
+        report = {
+            'meta': {
+                'commit': git_commit(), 'python': platform.python_version(), 'created': int(time.time()),
+                'options': {k: options[k] for k in ('requests', 'concurrency', 'warmup', 'points', 'seed', 'overpass_latency',
+                                                     'llm_first_token', 'llm_tokens_per_sec', 'llm_reply_tokens', 'chat_path')},
+                'overpass': overpass.stats, 'ollama': ollama.stats,
+            },
+            'scenarios': results,
+        }
+        if options['compare']:
+            self.compare(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Đã ghi kết quả vào {options['output']}"))
+
+    def start_app(self, port, overpass_url, ollama_url, options):
+        env = dict(os.environ)
+        env.pop('REDIS_URL', None)
+        env.update({
+            'DJANGO_SETTINGS_MODULE': 'configs.settings_bench',
+            'BENCH_OVERPASS_URL': overpass_url,
+            'OLLAMA_HOST': ollama_url,
+            # Không gọi Gemini (fallback / làm giàu dữ liệu) khi đo
+            'GEMINI_API_KEY': '',
+            'PYTHONHASHSEED': '0',
+        })
+        bench_dir = settings.BASE_DIR.parent / 'data' / 'bench'
+        os.makedirs(bench_dir, exist_ok=True)
+        manage = str(settings.BASE_DIR / 'manage.py')
+        migrate = subprocess.run([sys.executable, manage, 'migrate', '--noinput', '-v', '0'], cwd=settings.BASE_DIR,
+                                 env=env, capture_output=True, text=True)
+        if migrate.returncode != 0:
+            raise CommandError(f"migrate thất bại:\n{migrate.stderr[-2000:]}")
+
+        if options['server_cmd']:
+            cmd = options['server_cmd'].format(port=port).split()
+        else:
+            cmd = [sys.executable, manage, 'runserver', f'127.0.0.1:{port}', '--noreload']
+        log = open(bench_dir / 'server.log', 'w', encoding='utf-8')
+        process = subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        return process, log
+
+    def wait_ready(self, process, base_url, log, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"App dừng khi khởi động (xem {log.name})")
+            try:
+                # /readyz: chờ cả phần làm nóng model để lần đo không tính thời gian nạp model
+                if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200: return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise CommandError(f"App không sẵn sàng sau {timeout}s (xem {log.name})")
+
+    async def drive(self, name, base_url, points, count, concurrency, options):
+        latencies, errors = [], 0
+        counter = itertools.count()
+        limits = httpx.Limits(max_connections=concurrency)
+
+        async def worker(w):
+            nonlocal errors
+            # Mỗi người dùng ảo có cookie jar riêng; chat cần một lượt tìm kiếm trước để có vị trí + danh sách quán
+            async with httpx.AsyncClient(base_url=base_url, timeout=options['timeout'], limits=limits) as client:
+                if name == 'chat':
+                    lat, lng = points[w % len(points)]
+                    try:
+                        await client.get('/api/search/', params={'lat': lat, 'lng': lng})
+                    except httpx.HTTPError:
+                        pass
+                while True:
+                    i = next(counter)
+                    if i >= count: return
+                    started = time.perf_counter()
+                    try:
+                        if name == 'search':
+                            lat, lng = points[i % len(points)]
+                            r = await client.get('/api/search/', params={'lat': lat, 'lng': lng})
+                        else:
+                            r = await client.post(options['chat_path'], json={'message': DEFAULT_MESSAGES[i % len(DEFAULT_MESSAGES)]})
+                        ok = r.status_code == 200 and r.json().get('status') == 'success'
+                    except (httpx.HTTPError, ValueError):
+                        ok = False
+                    if ok: latencies.append(time.perf_counter() - started)
+                    else: errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def run_scenario(self, name, base_url, points, pid, options):
+        if options['warmup']:
+            await self.drive(name, base_url, points, options['warmup'], 1, options)
+
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            stages_before = stage_totals((await client.get('/metrics')).text)
+        memory_before = read_memory(pid)
+        latencies, errors, wall = await self.drive(name, base_url, points, options['requests'], options['concurrency'], options)
+        memory_after = read_memory(pid)
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            stages_after = stage_totals((await client.get('/metrics')).text)
+
+        stages = {}
+        for stage, after in stages_after.items():
+            before = stages_before.get(stage, {'sum': 0.0, 'count': 0.0})
+            count = after['count'] - before['count']
+            if count: stages[stage] = {'count': int(count), 'mean_ms': round((after['sum'] - before['sum']) / count * 1000, 2)}
+
+        done = len(latencies) + errors
+        return {
+            'ok': len(latencies),
+            'errors': errors,
+            'throughput': round(len(latencies) / wall, 3) if wall else 0.0,
+            'mean': round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50), 4),
+            'p95': round(percentile(latencies, 95), 4),
+            'p99': round(percentile(latencies, 99), 4),
+            'wall': round(wall, 3),
+            'rss_kb': memory_after[0] if memory_after else None,
+            'peak_rss_kb': memory_after[1] if memory_after else None,
+            'kb_per_request': round((memory_after[0] - memory_before[0]) / done, 2) if memory_before and memory_after and done else None,
+            'stages': stages,
+        }
+
+    def report(self, results, overpass_stats, ollama_stats):
+        self.stdout.write(f"{'scenario':<10}{'ok':>6}{'err':>5}{'req/s':>9}{'p50(s)':>9}{'p95(s)':>9}{'p99(s)':>9}{'rss(MB)':>9}{'KB/req':>8}")
+        for name, r in results.items():
+            rss = f"{r['rss_kb'] / 1024:.1f}" if r['rss_kb'] else 'n/a'
+            per_request = f"{r['kb_per_request']:.1f}" if r['kb_per_request'] is not None else 'n/a'
+            self.stdout.write(f"{name:<10}{r['ok']:>6}{r['errors']:>5}{r['throughput']:>9.2f}{r['p50']:>9.3f}"
+                              f"{r['p95']:>9.3f}{r['p99']:>9.3f}{rss:>9}{per_request:>8}")
+            stages = ', '.join(f"{stage} {s['mean_ms']}ms x{s['count']}" for stage, s in sorted(r['stages'].items()))
+            if stages: self.stdout.write(f"  chặng: {stages}")
+        self.stdout.write(f"Overpass giả: {overpass_stats or {}} | Ollama giả: {ollama_stats or {}}")
+        if overpass_stats.get('synthetic'):
+            self.stdout.write(self.style.WARNING("Có truy vấn dùng dữ liệu giả (chưa có fixture) -> chạy --record một lần để dùng dữ liệu thật."))
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        self.stdout.write(f"So với {path} (commit {baseline.get('meta', {}).get('commit')}):")
+        for name, r in results.items():
+            old = baseline.get('scenarios', {}).get(name)
+            if not old: continue
+            parts = []
+            for field in COMPARE_FIELDS:
+                if r.get(field) is None or not old.get(field): continue
+                parts.append(f"{field} {old[field]} -> {r[field]} ({(r[field] - old[field]) / old[field] * 100:+.1f}%)")
+            self.stdout.write(f"  {name}: " + ', '.join(parts))
@@ -0,0 +1,64 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from locator import ranking
+from locator.utils import calculate_distance
+
+SHOPS = ['cafe', 'restaurant', 'convenience', 'fuel', 'pharmacy', 'mobile_phone']
+HOURS = [None, '24/7', '07:00-22:00', 'Mo-Su 08:00-21:00', '18:00-02:00']
+
+
+def fake_elements(n, lat, lng, spread=0.05, seed=1):
+    rnd = random.Random(seed)
+    return [{
+        'id': i, 'lat': lat + rnd.uniform(-spread, spread), 'lon': lng + rnd.uniform(-spread, spread),
+        'tags': {'name': f"POI {i}", 'amenity': rnd.choice(SHOPS), 'opening_hours': rnd.choice(HOURS)},
+    } for i in range(n)]
+
+
+def legacy_rank(lat, lng, radius, elements, limit):
+    # Đường cũ: haversine vô hướng từng phần tử + sorted trên toàn bộ, rồi cắt limit
+    hits = []
+    for item in elements:
+        distance = calculate_distance(lat, lng, item['lat'], item['lon'])
+        if distance * 1000 <= radius:
+            hits.append((distance, item))
+    hits.sort(key=lambda x: x[0])
+    return hits[:limit]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = "So sánh xếp hạng POI từng phần tử (cũ) với ranking.rank_elements (NumPy) ở nhiều cỡ dữ liệu."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,1000,100000', help="Các cỡ tập ứng viên, phân tách bởi dấu phẩy")
+        parser.add_argument('--radius', type=int, default=3000)
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--lat', type=float, default=21.0285)
+        parser.add_argument('--lng', type=float, default=105.8542)
+
+    def handle(self, *args, **options):
+        lat, lng, radius, limit = options['lat'], options['lng'], options['radius'], options['limit']
+        paths = [
+            ('legacy', lambda els: legacy_rank(lat, lng, radius, els, limit)),
+            ('numpy', lambda els: ranking.rank_elements(lat, lng, radius, els, limit, 'cafe')),
+        ]
+
+        self.stdout.write(f"{'n':>8} " + ' '.join(f"{name:>12}" for name, _ in paths) + "   (ms, trung vị)")
+        for n in (int(x) for x in options['sizes'].split(',') if x.strip()):
+            elements = fake_elements(n, lat, lng)
+            row = [timed(lambda: fn(elements), options['repeat']) for _, fn in paths]
+            self.stdout.write(f"{n:>8} " + ' '.join(f"{ms:>12.2f}" for ms in row))
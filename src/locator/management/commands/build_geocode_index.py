@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.geocoder import build_geocode_index, place_kind
+from locator.management.commands.build_poi_index import load_json_elements
+
+
+def load_osm_places(path):
+    # File .osm.pbf / .osm cần pyosmium (pip install osmium); way lấy tâm theo trung bình các node
+    try:
+        import osmium
+    except ImportError:
+        raise CommandError("Đọc file .pbf/.osm cần gói 'osmium' (pip install osmium), hoặc dùng bản trích dạng Overpass JSON (out center).")
+
+    class PlaceHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.elements = []
+
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if place_kind(tags) and n.location.valid():
+                self.elements.append({'id': n.id, 'lat': n.location.lat, 'lon': n.location.lon, 'tags': tags})
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if not place_kind(tags): return
+            points = [(nd.location.lat, nd.location.lon) for nd in w.nodes if nd.location.valid()]
+            if not points: return
+            self.elements.append({
+                'id': w.id, 'tags': tags,
+                'center': {'lat': sum(p[0] for p in points) / len(points), 'lon': sum(p[1] for p in points) / len(points)},
+            })
+
+    handler = PlaceHandler()
+    handler.apply_file(path, locations=True)
+    return handler.elements
+
+
+class Command(BaseCommand):
+    help = (
+        "Dựng chỉ mục gợi ý vị trí (/api/geocode/) từ bản trích OSM (.osm.pbf, .osm hoặc Overpass JSON).\n"
+        "Overpass JSON nên lấy bằng 'out center;' để way (đường phố) có tọa độ tâm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Đường dẫn bản trích OSM")
+        parser.add_argument('--output', default=None, help="File chỉ mục (mặc định settings.GEOCODE_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        output = options['output'] or settings.GEOCODE_INDEX_PATH
+
+        started = time.monotonic()
+        if source.endswith('.json'):
+            elements, _ = load_json_elements(source)
+        else:
+            elements = load_osm_places(source)
+
+        count = build_geocode_index(output, elements)
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi {count} địa điểm vào {output} ({time.monotonic() - started:.1f}s)"))
@@ -0,0 +1,76 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.poi_index import build_index, is_poi
+
+
+def load_json_elements(path):
+    """
+    (elements, timestamp) — timestamp là mốc dữ liệu Overpass (osm3s.timestamp_osm_base) nếu có.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return data, None
+    return data.get('elements', []), (data.get('osm3s') or {}).get('timestamp_osm_base')
+
+
+def load_osm_elements(path):
+    # File .osm.pbf / .osm cần pyosmium (pip install osmium)
+    try:
+        import osmium
+    except ImportError:
+        raise CommandError("Đọc file .pbf/.osm cần gói 'osmium' (pip install osmium), hoặc dùng bản trích dạng Overpass JSON.")
+
+    class PoiHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.elements = []
+
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if is_poi(tags) and n.location.valid():
+                self.elements.append({'id': n.id, 'lat': n.location.lat, 'lon': n.location.lon, 'tags': tags})
+
+    handler = PoiHandler()
+    handler.apply_file(path)
+    # Bản trích Geofabrik / osmium ghi mốc replication trong header
+    reader = osmium.io.Reader(path, osmium.osm.osm_entity_bits.NOTHING)
+    timestamp = reader.header().get('osmosis_replication_timestamp') or None
+    reader.close()
+    return handler.elements, timestamp
+
+
+class Command(BaseCommand):
+    help = "Dựng chỉ mục POI cục bộ (SQLite R*Tree) từ bản trích OSM (.osm.pbf, .osm hoặc Overpass JSON)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Đường dẫn bản trích OSM")
+        parser.add_argument('--output', default=None, help="File index (mặc định settings.POI_INDEX_PATH)")
+        parser.add_argument('--bbox', default=None, help="Vùng phủ south,west,north,east (mặc định theo dữ liệu)")
+        parser.add_argument('--timestamp', default=None,
+                            help="Mốc dữ liệu OSM của bản trích (ISO 8601, dùng cho refresh_pois); mặc định lấy từ file")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        output = options['output'] or settings.POI_INDEX_PATH
+        bbox = None
+        if options['bbox']:
+            try:
+                bbox = tuple(float(v) for v in options['bbox'].split(','))
+                assert len(bbox) == 4
+            except (ValueError, AssertionError):
+                raise CommandError("--bbox phải có dạng south,west,north,east")
+
+        started = time.monotonic()
+        if source.endswith('.json'):
+            elements, timestamp = load_json_elements(source)
+        else:
+            elements, timestamp = load_osm_elements(source)
+        timestamp = options['timestamp'] or timestamp
+
+        count = build_index(output, elements, bbox=bbox, timestamp=timestamp)
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi {count} POI vào {output} ({time.monotonic() - started:.1f}s)"))
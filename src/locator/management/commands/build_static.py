@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.static_assets import build_bundles, build_dir, download_vendor
+
+
+class Command(BaseCommand):
+    help = ("Tải thư viện front-end (Bootstrap, Font Awesome, Leaflet, Routing Machine, icon marker) về máy "
+            "và gộp + nén CSS/JS thành bundle. collectstatic tự chạy lệnh này trước khi thu thập.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', action='store_true', help="Tải lại file vendor kể cả khi đã có")
+        parser.add_argument('--skip-vendor', action='store_true', help="Không tải vendor, chỉ gộp lại bundle")
+        parser.add_argument('--update-lock', action='store_true',
+                            help="Nhận nội dung vendor mới và ghi lại SHA-256 trong STATIC_VENDOR_LOCK (đi kèm --refresh)")
+
+    def handle(self, *args, **options):
+        if not options['skip_vendor']:
+            fetched, errors = download_vendor(refresh=options['refresh'], update_lock=options['update_lock'])
+            for error in errors:
+                self.stderr.write(f"Lỗi tải: {error}")
+            self.stdout.write(f"Vendor: tải {fetched} file vào {build_dir()}")
+        try:
+            sizes = build_bundles()
+        except FileNotFoundError as e:
+            raise CommandError(f"Thiếu file nguồn {e}; chạy lại khi có mạng để tải vendor.")
+        for bundle, size in sizes.items():
+            self.stdout.write(f"{bundle}: {size / 1024:.1f} KB")
+        self.stdout.write(self.style.SUCCESS("Đã build tài nguyên tĩnh"))
@@ -0,0 +1,22 @@
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectStaticCommand
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+
+class Command(CollectStaticCommand):
+    """
+    collectstatic chạy build_static trước (vendor + bundle). Build lỗi (ví dụ không có mạng) thì vẫn thu thập,
+    template dùng lại link CDN cho phần chưa build được.
+    """
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--skip-build', action='store_true', help="Không chạy build_static trước khi thu thập")
+
+    def handle(self, **options):
+        if not options['skip_build'] and not options['dry_run']:
+            try:
+                call_command('build_static', verbosity=options['verbosity'], stdout=self.stdout, stderr=self.stderr)
+            except CommandError as e:
+                self.stderr.write(f"Bỏ qua build_static: {e}")
+        return super().handle(**options)
@@ -0,0 +1,50 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.models import PlaceEnrichment
+from locator.utils import build_nearby_stores, enrich_data_with_ai, fetch_elements_in_bbox, osm_ids
+
+
+def parse_bbox(value):
+    try:
+        bbox = tuple(float(v) for v in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise CommandError("--bbox phải có dạng south,west,north,east")
+    return bbox
+
+
+class Command(BaseCommand):
+    help = "Làm giàu trước (Gemini) mọi POI trong một bounding box để request không phải chờ Gemini."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bbox', required=True, help="south,west,north,east")
+        parser.add_argument('--batch', type=int, default=20, help="Số POI mỗi lần gọi Gemini")
+        parser.add_argument('--delay', type=float, default=1.0, help="Nghỉ giữa các lần gọi (giây)")
+
+    def handle(self, *args, **options):
+        if not os.getenv("GEMINI_API_KEY"):
+            raise CommandError("Thiếu GEMINI_API_KEY")
+
+        elements = fetch_elements_in_bbox(*parse_bbox(options['bbox']))
+        if elements is None:
+            raise CommandError("Không lấy được POI (Overpass lỗi và chưa có chỉ mục cục bộ)")
+
+        stores = build_nearby_stores([(0.0, e) for e in elements], max_results=len(elements))
+        done = set(PlaceEnrichment.objects.filter(osm_id__in=osm_ids(stores)).values_list('osm_id', flat=True))
+        pending = [s for s in stores if s.id.isdigit() and int(s.id) not in done]
+        self.stdout.write(f"{len(stores)} POI, {len(done)} đã có dữ liệu, {len(pending)} cần làm giàu")
+
+        batch = max(1, options['batch'])
+        for i in range(0, len(pending), batch):
+            chunk = pending[i:i + batch]
+            enrich_data_with_ai(chunk, limit=len(chunk))
+            saved = PlaceEnrichment.objects.filter(osm_id__in=osm_ids(chunk)).count()
+            self.stdout.write(f"  [{i + len(chunk)}/{len(pending)}] lưu {saved}/{len(chunk)}")
+            if i + batch < len(pending):
+                time.sleep(options['delay'])
+
+        self.stdout.write(self.style.SUCCESS("Xong"))
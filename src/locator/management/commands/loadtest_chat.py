@@ -0,0 +1,84 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urljoin
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MESSAGES = ["Quán cafe nào gần nhất?", "Tìm cây xăng gần đây", "Quán nào được đánh giá tốt?", "Chỗ nào mở cửa khuya?"]
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+class Command(BaseCommand):
+    help = (
+        "Bắn nhiều lượt chat đồng thời vào một hoặc nhiều server đang chạy để so sánh throughput, ví dụ:\n"
+        "  gunicorn configs.wsgi -w 4 -b :8000   và   uvicorn configs.asgi:application --port 8001\n"
+        "  manage.py loadtest_chat --target wsgi=http://127.0.0.1:8000/api/chat/ "
+        "--target asgi=http://127.0.0.1:8001/api/chat/async/ --concurrency 200"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, help="name=url của endpoint chat (lặp lại để so sánh)")
+        parser.add_argument('--concurrency', type=int, default=50, help="Số người dùng ảo chat đồng thời")
+        parser.add_argument('--turns', type=int, default=4, help="Số lượt chat mỗi người dùng")
+        parser.add_argument('--lat', type=float, default=21.0285)
+        parser.add_argument('--lng', type=float, default=105.8542)
+        parser.add_argument('--timeout', type=float, default=120.0)
+
+    def handle(self, *args, **options):
+        targets = []
+        for t in options['target']:
+            name, sep, url = t.partition('=')
+            if not sep: raise CommandError(f"--target phải có dạng name=url: {t}")
+            targets.append((name, url))
+
+        rows = [asyncio.run(self.run_target(name, url, options)) for name, url in targets]
+
+        self.stdout.write(f"{'target':<10}{'ok':>7}{'err':>6}{'req/s':>9}{'p50(s)':>9}{'p95(s)':>9}{'max(s)':>9}{'wall(s)':>9}")
+        for r in rows:
+            self.stdout.write(f"{r['name']:<10}{r['ok']:>7}{r['errors']:>6}{r['throughput']:>9.2f}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['max']:>9.2f}{r['wall']:>9.2f}")
+
+    async def run_target(self, name, url, options):
+        latencies, errors = [], 0
+        search_url = urljoin(url, '/api/search/')
+        limits = httpx.Limits(max_connections=options['concurrency'])
+
+        async def user(i):
+            nonlocal errors
+            # Mỗi người dùng ảo có cookie jar riêng -> session riêng
+            async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+                try:
+                    await client.get(search_url, params={'lat': options['lat'], 'lng': options['lng']})
+                except httpx.HTTPError:
+                    pass
+                for turn in range(options['turns']):
+                    msg = DEFAULT_MESSAGES[(i + turn) % len(DEFAULT_MESSAGES)]
+                    started = time.monotonic()
+                    try:
+                        r = await client.post(url, json={'message': msg})
+                        ok = r.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    if ok: latencies.append(time.monotonic() - started)
+                    else: errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(user(i) for i in range(options['concurrency'])))
+        wall = time.monotonic() - started
+        return {
+            'name': name,
+            'ok': len(latencies),
+            'errors': errors,
+            'throughput': len(latencies) / wall if wall else 0.0,
+            'p50': statistics.median(latencies) if latencies else 0.0,
+            'p95': percentile(latencies, 95),
+            'max': max(latencies) if latencies else 0.0,
+            'wall': wall,
+        }
@@ -0,0 +1,66 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.management.commands.enrich_pois import parse_bbox
+from locator.poi_index import load_regions, save_region
+from locator.poi_sync import apply, parse_osc, sync_all
+
+
+class Command(BaseCommand):
+    help = ("Cập nhật dần chỉ mục POI: hỏi Overpass augmented diff cho từng vùng từ mốc đã đồng bộ "
+            "(chạy định kỳ bằng cron), hoặc áp file osmChange (.osc/.osc.gz).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', default=None, help="File index (mặc định settings.POI_INDEX_PATH)")
+        parser.add_argument('--add-region', nargs=2, metavar=('NAME', 'BBOX'),
+                            help="Đăng ký vùng NAME với bbox south,west,north,east")
+        parser.add_argument('--since', default=None,
+                            help="Mốc bắt đầu cho vùng mới (ISO 8601; mặc định mốc dữ liệu của index)")
+        parser.add_argument('--region', action='append', default=[], help="Chỉ đồng bộ vùng này (lặp được)")
+        parser.add_argument('--osc', action='append', default=[], help="Áp file osmChange thay vì hỏi Overpass (lặp được, theo thứ tự)")
+        parser.add_argument('--list', action='store_true', help="Liệt kê các vùng và mốc đã đồng bộ")
+
+    def handle(self, *args, **options):
+        path = options['index'] or settings.POI_INDEX_PATH
+        if not path or not os.path.exists(path):
+            raise CommandError(f"Chưa có chỉ mục POI ({path}); chạy build_poi_index trước.")
+
+        if options['add_region']:
+            name, bbox = options['add_region']
+            try:
+                save_region(path, name, parse_bbox(bbox), options['since'])
+            except ValueError as e:
+                raise CommandError(f"{e}; dùng --since")
+            self.stdout.write(self.style.SUCCESS(f"Đã đăng ký vùng {name}"))
+            return
+
+        if options['list']:
+            for name, region in load_regions(path).items():
+                self.stdout.write(f"{name}: bbox={','.join(map(str, region['bbox']))} synced_at={region['synced_at']}")
+            return
+
+        started = time.monotonic()
+        if options['osc']:
+            for osc in options['osc']:
+                stats = apply(path, *parse_osc(osc))
+                self.stdout.write(f"{osc}: {stats['written']} ghi, {stats['deleted']} xóa, {stats['tiles']} tile cần sinh lại")
+            self.stdout.write(self.style.SUCCESS(f"Xong ({time.monotonic() - started:.1f}s)"))
+            return
+
+        results = sync_all(path, options['region'] or None)
+        if not results:
+            raise CommandError("Chưa có vùng nào; đăng ký bằng --add-region NAME south,west,north,east")
+        failed = 0
+        for name, stats in results.items():
+            if 'error' in stats:
+                failed += 1
+                self.stderr.write(f"{name}: lỗi {stats['error']}")
+            else:
+                self.stdout.write(f"{name}: {stats['written']} ghi, {stats['deleted']} xóa, "
+                                  f"{stats['tiles']} tile cần sinh lại, đồng bộ tới {stats['synced_at']}")
+        if failed:
+            raise CommandError(f"{failed}/{len(results)} vùng lỗi")
+        self.stdout.write(self.style.SUCCESS(f"Xong ({time.monotonic() - started:.1f}s)"))
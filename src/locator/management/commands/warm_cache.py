@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from locator.geo import bbox_around, geohash_decode, geohash_encode
+from locator.management.commands.enrich_pois import parse_bbox
+from locator.utils import (
+    OVERPASS_CLIENT, POI_CACHE_PRECISION, POI_CACHE_TTL, build_keyword_stores, build_nearby_stores,
+    enrich_data_with_ai, fill_tile, tile_request,
+)
+
+# Trùng HANOI_COORDS trong static/js/map_logic.js
+HANOI_COORDS = (21.0285, 105.8542)
+
+
+def parse_point(value):
+    try:
+        lat, lng = (float(v) for v in value.split(','))
+    except ValueError:
+        raise CommandError("--point phải có dạng lat,lng")
+    return lat, lng
+
+
+def cells_in_bbox(south, west, north, east, precision):
+    """
+    Các ô geohash phủ bbox, đi theo lưới bằng đúng kích thước ô.
+    """
+    _, _, half_lat, half_lng = geohash_decode(geohash_encode(south, west, precision))
+    cells = {}
+    lat = south
+    while lat <= north + half_lat:
+        lng = west
+        while lng <= east + half_lng:
+            cells[geohash_encode(min(lat, north), min(lng, east), precision)] = None
+            lng += 2 * half_lng
+        lat += 2 * half_lat
+    return list(cells)
+
+
+class WarmState:
+    """
+    Lưu thời điểm warm gần nhất của từng (ô, bán kính, keyword) vào file JSON để chạy tiếp khi bị ngắt
+    và để lần chạy định kỳ chỉ làm mới các ô sắp hết TTL.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._dirty = 0
+        try:
+            self.data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+
+    def is_fresh(self, key, max_age):
+        return time.time() - self.data.get(key, 0) < max_age
+
+    def mark(self, key):
+        with self._lock:
+            self.data[key] = time.time()
+            self._dirty += 1
+            if self._dirty >= 20: self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+        self._dirty = 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Làm nóng cache POI (ô geohash) và dữ liệu làm giàu cho các vùng hay dùng, ví dụ:\n"
+        "  manage.py warm_cache --bbox 20.98,105.78,21.08,105.90 --keywords cafe,restaurant,fuel\n"
+        "Chạy định kỳ (cron mỗi vài phút) để làm mới các ô trước khi hết POI_CACHE_TTL; "
+        "ô còn mới trong file trạng thái sẽ được bỏ qua."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bbox', action='append', default=[], help="south,west,north,east (lặp lại được)")
+        parser.add_argument('--point', action='append', default=[], help="lat,lng tâm vùng (lặp lại được)")
+        parser.add_argument('--point-radius', type=int, default=3000, help="Bán kính vùng quanh mỗi --point (m)")
+        parser.add_argument('--radius', type=int, default=1500, help="Bán kính tìm kiếm cần warm (get_nearby_stores dùng 1500)")
+        parser.add_argument('--keyword-radius', type=int, default=3000,
+                            help="Bán kính warm cho các keyword (search_specific_stores dùng 3000)")
+        parser.add_argument('--keywords', default='', help="Các keyword search_specific_stores cần warm, phân tách bởi dấu phẩy")
+        parser.add_argument('--concurrency', type=int, default=4, help="Số ô xử lý đồng thời")
+        parser.add_argument('--rate', type=float, default=1.0, help="Số request/giây tối đa cho mỗi mirror Overpass")
+        parser.add_argument('--refresh-margin', type=int, default=300, help="Làm mới ô khi còn ít hơn số giây này là hết TTL")
+        parser.add_argument('--state', default=None, help="File trạng thái (mặc định data/warm_cache_state.json)")
+        parser.add_argument('--reset', action='store_true', help="Bỏ trạng thái cũ, warm lại toàn bộ")
+        parser.add_argument('--no-enrich', action='store_true', help="Chỉ warm POI, không gọi Gemini")
+        parser.add_argument('--enrich-limit', type=int, default=12, help="Số quán gần tâm ô được làm giàu")
+
+    def handle(self, *args, **options):
+        if getattr(settings, 'POI_CACHE_BACKEND', 'local') != 'django':
+            raise CommandError(
+                "POI_CACHE_BACKEND đang là 'local' (cache trong tiến trình): POI warm ở đây không tới được server. "
+                "Đặt POI_CACHE_BACKEND=django (Redis hoặc file cache alias 'pois') rồi chạy lại."
+            )
+
+        regions = [parse_bbox(b) for b in options['bbox']]
+        points = [parse_point(p) for p in options['point']] or ([] if regions else [HANOI_COORDS])
+        regions += [bbox_around(lat, lng, options['point_radius']) for lat, lng in points]
+
+        cells = list(dict.fromkeys(c for region in regions for c in cells_in_bbox(*region, POI_CACHE_PRECISION)))
+        keywords = [None] + [k.strip().lower() for k in options['keywords'].split(',') if k.strip()]
+        enrich = not options['no_enrich'] and bool(os.getenv("GEMINI_API_KEY"))
+        if not options['no_enrich'] and not enrich:
+            self.stdout.write(self.style.WARNING("Thiếu GEMINI_API_KEY -> bỏ qua bước làm giàu"))
+
+        state = WarmState(options['state'] or Path(settings.BASE_DIR).parent / 'data' / 'warm_cache_state.json')
+        if options['reset']: state.data = {}
+        max_age = max(0, POI_CACHE_TTL - options['refresh_margin'])
+
+        def state_key(cell, keyword):
+            radius = options['keyword_radius'] if keyword else options['radius']
+            return f"{cell}|{radius}|{keyword or '*'}"
+
+        tasks = [(cell, kw) for cell in cells for kw in keywords if not state.is_fresh(state_key(cell, kw), max_age)]
+        self.stdout.write(f"{len(cells)} ô x {len(keywords)} keyword, {len(tasks)} cần warm")
+        if not tasks: return
+
+        OVERPASS_CLIENT.set_rate_limit(options['rate'])
+
+        def warm(cell, keyword):
+            lat, lng, _, _ = geohash_decode(cell)
+            miss = tile_request(lat, lng, options['keyword_radius'] if keyword else options['radius'], keyword)
+            hits = fill_tile(miss, OVERPASS_CLIENT.fetch_round_robin(miss.query))
+            if hits is None: return None
+            if enrich and hits:
+                limit = options['enrich_limit']
+                stores = build_keyword_stores(hits, keyword, limit) if keyword else build_nearby_stores(hits, limit)
+                enrich_data_with_ai(stores, limit=limit)
+            state.mark(state_key(cell, keyword))
+            return len(hits)
+
+        done = failed = 0
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+                futures = {executor.submit(warm, cell, kw): (cell, kw) for cell, kw in tasks}
+                for future in as_completed(futures):
+                    cell, keyword = futures[future]
+                    # Lỗi của một ô (Gemini, DB, dữ liệu lạ...) không dừng cả lượt warm
+                    try:
+                        count, error = future.result(), 'Overpass lỗi'
+                    except Exception as e:
+                        count, error = None, e
+                    done += 1
+                    if count is None: failed += 1
+                    self.stdout.write(f"  [{done}/{len(tasks)}] {cell} {keyword or '*'}: {f'lỗi ({error})' if count is None else f'{count} POI'}")
+        finally:
+            state.save()
+            OVERPASS_CLIENT.set_rate_limit(None)
+
+        self.stdout.write(self.style.SUCCESS(f"Xong {done - failed}/{len(tasks)} ô trong {time.monotonic() - started:.1f}s ({failed} lỗi)"))
@@ -0,0 +1,61 @@
+"""
+Chỉ số trạng thái đọc tại thời điểm scrape /metrics (cache, circuit breaker, bộ định tuyến intent),
+ghép với counter/histogram của tracing.
+"""
+from . import admission
+from .geocoder import GEOCODE_CACHE
+from .intent_router import ROUTER
+from .llm_cache import LLM_CACHE
+from .llm_gateway import LLM_GATEWAY
+from .tracing import format_labels, render_metrics
+from .utils import OVERPASS_CLIENT, POI_CACHE
+from .warmup import READY_STATES, readiness
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+ADMISSION_STATES = {'normal': 0, 'degraded': 1, 'shedding': 2}
+
+
+def gauge(name, help_text, samples):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines += [f"{name}{format_labels(tuple(labels.items()))} {value}" for labels, value in samples]
+    return lines
+
+
+def runtime_lines():
+    caches = {'poi': POI_CACHE.stats(), 'llm': LLM_CACHE.stats(), 'geocode': GEOCODE_CACHE.stats()}
+    router = ROUTER.stats.snapshot()
+    mirrors = OVERPASS_CLIENT.health()
+    gateway = LLM_GATEWAY.stats()
+    budgets = admission.stats()
+    lines = []
+    lines += gauge('locator_cache_hits', "Số lần trúng cache theo loại cache",
+                   [({'cache': name}, s['hits']) for name, s in caches.items()])
+    lines += gauge('locator_cache_misses', "Số lần trượt cache theo loại cache",
+                   [({'cache': name}, s['misses']) for name, s in caches.items()])
+    lines += gauge('locator_intent_router_total', "Số câu được bộ luật định tuyến (routed) hoặc phải gọi LLM (escalated)",
+                   [({'outcome': 'routed'}, router['routed']), ({'outcome': 'escalated'}, router['escalated'])])
+    lines += gauge('locator_overpass_breaker_state', "Trạng thái circuit breaker mirror Overpass (0 đóng, 1 nửa mở, 2 mở)",
+                   [({'mirror': m['url']}, BREAKER_STATES.get(m['state'], -1)) for m in mirrors])
+    lines += gauge('locator_overpass_last_latency_seconds', "Độ trễ lần gọi thành công gần nhất của mirror Overpass",
+                   [({'mirror': m['url']}, round(m['last_latency'], 4)) for m in mirrors if m['last_latency'] is not None])
+    lines += gauge('locator_llm_active', "Số lệnh gọi LLM đang chạy theo provider",
+                   [({'provider': name}, p['active']) for name, p in gateway['providers'].items()])
+    lines += gauge('locator_llm_queued', "Số request đang xếp hàng chờ LLM theo provider",
+                   [({'provider': name}, p['queued']) for name, p in gateway['providers'].items()])
+    lines += gauge('locator_llm_coalesced', "Số request dùng chung kết quả của một lệnh gọi LLM đang chạy (single-flight)",
+                   [({}, gateway['coalesced'])])
+    lines += gauge('locator_llm_model_ready', "Model LLM đã được làm nóng (1) hay chưa (0)",
+                   [({'provider': name}, int(status in READY_STATES)) for name, status in readiness()[1]['models'].items()])
+    lines += gauge('locator_admission_active', "Số request đang được phục vụ theo nhóm (chat, search)",
+                   [({'group': name}, b['active']) for name, b in budgets.items()])
+    lines += gauge('locator_admission_waiting', "Số request đang chờ slot theo nhóm",
+                   [({'group': name}, b['waiting']) for name, b in budgets.items()])
+    lines += gauge('locator_admission_limit', "Số request đồng thời tối đa theo nhóm",
+                   [({'group': name}, b['limit']) for name, b in budgets.items()])
+    lines += gauge('locator_admission_state', "Trạng thái tải theo nhóm (0 bình thường, 1 đang hạ cấp, 2 đang từ chối)",
+                   [({'group': name}, ADMISSION_STATES[b['state']]) for name, b in budgets.items()])
+    return lines
+
+
+def render():
+    return render_metrics(runtime_lines())
@@ -0,0 +1,69 @@
+"""
+Middleware đo thời gian: mở một trace cho mỗi request, trả Server-Timing theo từng chặng,
+ghi một dòng log JSON (logger 'locator.trace') và cập nhật histogram theo route.
+"""
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.utils.decorators import sync_and_async_middleware
+
+from .tracing import REQUEST_SECONDS, REQUESTS, end_trace, span, start_trace
+
+trace_logger = logging.getLogger('locator.trace')
+
+
+def _finish(request, response, trace, started):
+    elapsed = time.perf_counter() - started
+    match = getattr(request, 'resolver_match', None)
+    route = match.url_name if match and match.url_name else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, route=route)
+    REQUESTS.inc(route=route, status=response.status_code)
+    # Response stream (SSE): chỉ có các chặng chạy trước khi gửi header
+    response['Server-Timing'] = trace.server_timing(elapsed)
+    trace_logger.info(json.dumps({
+        'ts': round(time.time(), 3),
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 1),
+        'streaming': response.streaming,
+        'spans': [{'name': name, 'ms': round(seconds * 1000, 1), **labels} for name, seconds, labels in trace.spans],
+    }, ensure_ascii=False))
+    return response
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            trace, token = start_trace()
+            try:
+                response = await get_response(request)
+            finally:
+                end_trace(token)
+            return _finish(request, response, trace, started)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            trace, token = start_trace()
+            try:
+                response = get_response(request)
+            finally:
+                end_trace(token)
+            return _finish(request, response, trace, started)
+    return middleware
+
+
+class TimedSessionMiddleware(SessionMiddleware):
+    """
+    SessionMiddleware của Django, thêm span 'session' quanh bước lưu session khi trả response.
+    """
+
+    def process_response(self, request, response):
+        with span('session'):
+            return super().process_response(request, response)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceEnrichment',
+            fields=[
+                ('osm_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('category_key', models.CharField(blank=True, max_length=64)),
+                ('rating', models.FloatField(blank=True, null=True)),
+                ('reviews_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('open_hour', models.CharField(blank=True, max_length=64)),
+                ('products', models.JSONField(blank=True, default=list)),
+                ('description', models.TextField(blank=True)),
+                ('review_list', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
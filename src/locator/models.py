@@ -1,3 +1,40 @@
 from django.db import models
 
-# Create your models here.
+
+class PlaceEnrichment(models.Model):
+    """
+    Dữ liệu AI sinh cho một POI OSM (rating, giờ mở cửa, sản phẩm, review).
+    Sinh một lần rồi dùng lại cho mọi lượt tìm kiếm.
+    """
+    ENRICHED_FIELDS = ('rating', 'reviews_count', 'open_hour', 'products', 'description', 'review_list')
+
+    osm_id = models.BigIntegerField(primary_key=True)
+    name = models.CharField(max_length=255, blank=True)
+    category_key = models.CharField(max_length=64, blank=True)
+    rating = models.FloatField(null=True, blank=True)
+    reviews_count = models.PositiveIntegerField(null=True, blank=True)
+    open_hour = models.CharField(max_length=64, blank=True)
+    products = models.JSONField(default=list, blank=True)
+    description = models.TextField(blank=True)
+    review_list = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.osm_id})"
+
+    def apply_to(self, store):
+        for field in self.ENRICHED_FIELDS:
+            value = getattr(self, field)
+            if value not in (None, '', []):
+                setattr(store, field, value)
+        return store
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(
+            osm_id=int(store.id),
+            name=store.name or '',
+            category_key=store.category_key or '',
+            **{field: getattr(store, field) for field in cls.ENRICHED_FIELDS},
+        )
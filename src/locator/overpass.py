@@ -0,0 +1,284 @@
+"""
+Client Overpass nhiều mirror: session pool riêng cho từng mirror, gửi yêu cầu dạng hedged
+(mirror sau được bắn nếu mirror trước chưa trả lời sau `hedge_delay` giây) và circuit breaker
+để bỏ qua mirror đang hỏng.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tracing import OVERPASS_REQUESTS, span, submit_traced
+
+logger = logging.getLogger('locator')
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.google.com/'
+}
+
+
+class CircuitBreaker:
+    """
+    closed -> (lỗi liên tiếp >= failure_threshold) -> open -> (sau reset_timeout) -> half_open:
+    cho đúng một request thử; thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """
+        Request bị hủy giữa chừng (thua hedge): trả lượt thử, không tính là thành công hay lỗi.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Giãn cách request tối thiểu 1/rate giây (rate request/giây), chặn luồng gọi tới khi tới lượt.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def try_acquire(self):
+        """
+        Không chờ: True nếu tới lượt ngay (và chiếm lượt đó), False nếu phải đợi.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next: return False
+            self._next = now + self.interval
+            return True
+
+
+class Mirror:
+    def __init__(self, url, pool_size=10, failure_threshold=3, reset_timeout=30.0):
+        self.url = url
+        self.host = urlparse(url).hostname or url
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_size = pool_size
+        # httpx.AsyncClient gắn với event loop nên giữ một client cho mỗi loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # Chỉ đặt cho job nền (warm_cache) để không dội tải lên mirror công cộng
+        self.rate_limiter = None
+        self.requests = 0
+        self.errors = 0
+        self.last_latency = None
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(headers=DEFAULT_HEADERS, limits=httpx.Limits(max_connections=self.pool_size))
+            self._async_clients[loop] = client
+        return client
+
+
+class OverpassClient:
+    def __init__(self, urls, timeout=15, hedge_delay=1.5, pool_size=10, failure_threshold=3, reset_timeout=30.0):
+        self.mirrors = [Mirror(u, pool_size, failure_threshold, reset_timeout) for u in urls]
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max(4, pool_size * len(self.mirrors)), thread_name_prefix='overpass')
+        self._rr_lock = threading.Lock()
+        self._rr_next = 0
+
+    def _request(self, mirror, query, raw=False):
+        if mirror.rate_limiter: mirror.rate_limiter.acquire()
+        started = time.monotonic()
+        mirror.requests += 1
+        try:
+            logger.debug(f"Connecting to: {mirror.url}")
+            with span('overpass', mirror=mirror.host):
+                r = mirror.session.get(mirror.url, params={'data': query}, timeout=self.timeout)
+            expected = 'xml' if raw else 'json'
+            if r.status_code != 200 or expected not in r.headers.get('Content-Type', '').lower():
+                raise ValueError(f"HTTP {r.status_code} ({r.headers.get('Content-Type', '')})")
+            data = r.text if raw else r.json()
+        except Exception as e:
+            mirror.errors += 1
+            mirror.breaker.record_failure()
+            OVERPASS_REQUESTS.inc(mirror=mirror.host, outcome='error')
+            logger.warning(f"Overpass mirror {mirror.url} failed: {e}")
+            raise
+        mirror.last_latency = time.monotonic() - started
+        mirror.breaker.record_success()
+        OVERPASS_REQUESTS.inc(mirror=mirror.host, outcome='ok')
+        return data
+
+    def fetch(self, query):
+        """
+        Trả về JSON của mirror trả lời hợp lệ sớm nhất, hoặc None nếu mọi mirror đều lỗi / đang bị ngắt.
+        """
+        pending_mirrors = list(self.mirrors)
+        in_flight = set()
+
+        def launch_next():
+            while pending_mirrors:
+                mirror = pending_mirrors.pop(0)
+                if mirror.breaker.allow():
+                    in_flight.add(submit_traced(self._executor, self._request, mirror, query))
+                    return True
+            return False
+
+        launch_next()
+        while in_flight:
+            # Chờ tối đa hedge_delay; nếu chưa ai trả lời thì bắn thêm mirror kế tiếp
+            done, _ = wait(in_flight, timeout=self.hedge_delay if pending_mirrors else None, return_when=FIRST_COMPLETED)
+            if not done:
+                launch_next()
+                continue
+            for future in done:
+                in_flight.discard(future)
+                if future.exception() is None:
+                    return future.result()
+            # Mirror vừa lỗi -> thử ngay mirror kế tiếp, không chờ hết hedge_delay
+            launch_next()
+        return None
+
+    def set_rate_limit(self, rate):
+        """
+        Giới hạn số request/giây cho từng mirror (None để bỏ giới hạn).
+        """
+        for mirror in self.mirrors:
+            mirror.rate_limiter = RateLimiter(rate) if rate else None
+
+    def fetch_round_robin(self, query, raw=False):
+        """
+        Không hedge: lần lượt xoay vòng mirror (bỏ mirror đang bị ngắt), lỗi thì thử mirror kế.
+        Dùng cho job nền chạy nhiều query, chia đều tải thay vì bắn trùng lên nhiều mirror.
+        raw=True trả về nội dung XML (ví dụ augmented diff) thay vì JSON.
+        """
+        with self._rr_lock:
+            start = self._rr_next
+            self._rr_next = (self._rr_next + 1) % len(self.mirrors)
+        for i in range(len(self.mirrors)):
+            mirror = self.mirrors[(start + i) % len(self.mirrors)]
+            if not mirror.breaker.allow(): continue
+            try:
+                return self._request(mirror, query, raw)
+            except Exception:
+                continue
+        return None
+
+    async def _arequest(self, mirror, query):
+        started = time.monotonic()
+        mirror.requests += 1
+        try:
+            with span('overpass', mirror=mirror.host):
+                r = await mirror.async_client().get(mirror.url, params={'data': query}, timeout=self.timeout)
+            if r.status_code != 200 or 'json' not in r.headers.get('Content-Type', '').lower():
+                raise ValueError(f"HTTP {r.status_code} ({r.headers.get('Content-Type', '')})")
+            data = r.json()
+        except asyncio.CancelledError:
+            mirror.breaker.release()
+            raise
+        except Exception as e:
+            mirror.errors += 1
+            mirror.breaker.record_failure()
+            OVERPASS_REQUESTS.inc(mirror=mirror.host, outcome='error')
+            logger.warning(f"Overpass mirror {mirror.url} failed: {e}")
+            raise
+        mirror.last_latency = time.monotonic() - started
+        mirror.breaker.record_success()
+        OVERPASS_REQUESTS.inc(mirror=mirror.host, outcome='ok')
+        return data
+
+    async def afetch(self, query):
+        """
+        Bản async của fetch(): cùng chiến lược hedged + circuit breaker, các request thua cuộc bị hủy.
+        """
+        pending_mirrors = list(self.mirrors)
+        in_flight = set()
+
+        def launch_next():
+            while pending_mirrors:
+                mirror = pending_mirrors.pop(0)
+                if mirror.breaker.allow():
+                    in_flight.add(asyncio.ensure_future(self._arequest(mirror, query)))
+                    return True
+            return False
+
+        launch_next()
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, timeout=self.hedge_delay if pending_mirrors else None, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch_next()
+                    continue
+                for task in done:
+                    in_flight.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                launch_next()
+            return None
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def health(self):
+        return [{
+            'url': m.url,
+            'state': m.breaker.state,
+            'requests': m.requests,
+            'errors': m.errors,
+            'last_latency': m.last_latency,
+        } for m in self.mirrors]
@@ -0,0 +1,187 @@
+"""
+Một lượt chat: intent -> (tìm kiếm mới) -> trả lời.
+Ở chế độ pipeline (settings.CHAT_PIPELINE), tìm kiếm được bắn đầu cơ song song với lệnh gọi LLM intent
+dựa trên bộ đoán từ khóa rẻ tiền, và làm giàu dữ liệu (Gemini) chạy song song với bước sinh câu trả lời.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .utils import (
+    detect_intent_with_llama, enrich_data_with_ai, generate_answer_with_llama, run_closing_connections, search_specific_stores,
+    template_answer,
+)
+from .async_utils import adetect_intent_with_llama, aenrich_data_with_ai, agenerate_answer_with_llama, asearch_specific_stores
+from .admission import FULL, SKIP_ENRICH, TEMPLATE_REPLY
+from .intent_router import ROUTER
+from .tracing import span, submit_traced
+
+EXECUTOR = ThreadPoolExecutor(max_workers=getattr(settings, 'CHAT_PIPELINE_WORKERS', 16), thread_name_prefix='chat-pipeline')
+
+def guess_search_keyword(user_message):
+    # Chỉ cần đủ tốt để bắn tìm kiếm sớm, intent vẫn là quyết định cuối cùng
+    return ROUTER.guess_tag(user_message)
+
+
+def detect_intent(user_msg, current_stores):
+    """
+    Bộ định tuyến luật trả lời các câu rõ ràng; câu mơ hồ mới gọi LLM.
+    """
+    with span('route'):
+        intent = ROUTER.classify(user_msg, current_stores)
+    if intent is not None:
+        return intent
+    started = time.perf_counter()
+    intent = detect_intent_with_llama(user_msg)
+    ROUTER.record_escalation(time.perf_counter() - started)
+    return intent
+
+
+async def adetect_intent(user_msg, current_stores):
+    with span('route'):
+        intent = ROUTER.classify(user_msg, current_stores)
+    if intent is not None:
+        return intent
+    started = time.perf_counter()
+    intent = await adetect_intent_with_llama(user_msg)
+    ROUTER.record_escalation(time.perf_counter() - started)
+    return intent
+
+
+def rule_intent(user_msg, current_stores):
+    """
+    Intent không gọi LLM (khi quá tải): bộ luật, câu mơ hồ thì tìm theo từ khóa đoán được nếu có.
+    """
+    with span('route'):
+        intent = ROUTER.classify(user_msg, current_stores)
+    if intent is not None:
+        return intent
+    guess = guess_search_keyword(user_msg)
+    return {'action': 'SEARCH', 'keyword': guess} if guess else {'action': 'CHAT'}
+
+
+def template_turn(user_msg, current_stores, user_loc):
+    """
+    Lượt chat bậc TEMPLATE_REPLY: intent theo luật, tìm kiếm không làm giàu, trả lời mẫu gợi ý quán gần nhất.
+    """
+    intent = rule_intent(user_msg, current_stores)
+    if intent.get('action') == 'SEARCH' and user_loc:
+        new_stores = search_specific_stores(user_loc['lat'], user_loc['lng'], intent.get('keyword'), enrich=False)
+        if new_stores:
+            return "update_map", new_stores, template_answer(new_stores)
+    return "chat", current_stores, template_answer(current_stores)
+
+
+async def atemplate_turn(user_msg, current_stores, user_loc):
+    intent = rule_intent(user_msg, current_stores)
+    if intent.get('action') == 'SEARCH' and user_loc:
+        new_stores = await asearch_specific_stores(user_loc['lat'], user_loc['lng'], intent.get('keyword'), enrich=False)
+        if new_stores:
+            return "update_map", new_stores, template_answer(new_stores)
+    return "chat", current_stores, template_answer(current_stores)
+
+
+def same_keyword(a, b):
+    return bool(a) and bool(b) and a.lower() == b.lower()
+
+
+def run_chat_turn(user_msg, current_stores, user_loc, level=FULL, conversation=None):
+    """
+    Trả về (action_type, stores, ai_result). action_type = "update_map" khi có kết quả tìm kiếm mới.
+    level: bậc phục vụ do admission control cấp (SKIP_ENRICH bỏ làm giàu, TEMPLATE_REPLY không gọi LLM).
+    conversation: hội thoại của session (locator/conversation.py), gửi kèm lịch sử cho bước trả lời.
+    """
+    if level >= TEMPLATE_REPLY:
+        return template_turn(user_msg, current_stores, user_loc)
+    enrich = level < SKIP_ENRICH
+
+    if not getattr(settings, 'CHAT_PIPELINE', True):
+        intent = detect_intent(user_msg, current_stores)
+        if intent.get('action') == 'SEARCH' and user_loc:
+            new_stores = search_specific_stores(user_loc['lat'], user_loc['lng'], intent.get('keyword'), enrich=enrich)
+            if new_stores:
+                return "update_map", new_stores, generate_answer_with_llama(user_msg, new_stores, conversation)
+        return "chat", current_stores, generate_answer_with_llama(user_msg, current_stores, conversation)
+
+    # 1. Tìm kiếm đầu cơ song song với intent LLM
+    guess = guess_search_keyword(user_msg) if user_loc else None
+    speculative = submit_traced(EXECUTOR, run_closing_connections, search_specific_stores, user_loc['lat'], user_loc['lng'], guess, enrich=False) if guess else None
+    intent = detect_intent(user_msg, current_stores)
+
+    # Đoán sai hoặc intent là CHAT: bỏ kết quả đoán. Lúc này tìm kiếm đầu cơ đã chạy trong pool (không hủy được),
+    # cứ để nó chạy xong và lấp cache ô POI.
+    new_stores = None
+    if intent.get('action') == 'SEARCH' and user_loc:
+        keyword = intent.get('keyword')
+        if speculative and same_keyword(keyword, guess):
+            new_stores = speculative.result()
+        else:
+            new_stores = search_specific_stores(user_loc['lat'], user_loc['lng'], keyword, enrich=False)
+
+    if not new_stores:
+        return "chat", current_stores, generate_answer_with_llama(user_msg, current_stores, conversation)
+    if not enrich:
+        return "update_map", new_stores, generate_answer_with_llama(user_msg, new_stores, conversation)
+
+    # 2. Làm giàu dữ liệu song song với sinh câu trả lời (câu trả lời dùng bản chụp chưa làm giàu)
+    enrichment = submit_traced(EXECUTOR, run_closing_connections, enrich_data_with_ai, new_stores)
+    ai_result = generate_answer_with_llama(user_msg, [s.copy() for s in new_stores], conversation)
+    return "update_map", enrichment.result(), ai_result
+
+
+async def aresolve_turn(user_msg, current_stores, user_loc, level=FULL):
+    """
+    Pha intent + tìm kiếm (pipeline, chưa làm giàu dữ liệu). Trả về (action_type, stores).
+    """
+    if level >= TEMPLATE_REPLY:
+        action_type, stores, _ = await atemplate_turn(user_msg, current_stores, user_loc)
+        return action_type, stores
+
+    guess = guess_search_keyword(user_msg) if user_loc else None
+    speculative = asyncio.create_task(asearch_specific_stores(user_loc['lat'], user_loc['lng'], guess, enrich=False)) if guess else None
+    # Đoán sai, intent CHAT hay adetect_intent lỗi / bị hủy: không để task đầu cơ chạy mồ côi
+    try:
+        intent = await adetect_intent(user_msg, current_stores)
+
+        new_stores = None
+        if intent.get('action') == 'SEARCH' and user_loc:
+            keyword = intent.get('keyword')
+            if speculative and same_keyword(keyword, guess):
+                new_stores = await speculative
+            else:
+                new_stores = await asearch_specific_stores(user_loc['lat'], user_loc['lng'], keyword, enrich=False)
+    finally:
+        if speculative: speculative.cancel()
+
+    if not new_stores:
+        return "chat", current_stores
+    return "update_map", new_stores
+
+
+async def arun_chat_turn(user_msg, current_stores, user_loc, level=FULL, conversation=None):
+    """
+    Bản async của run_chat_turn.
+    """
+    if level >= TEMPLATE_REPLY:
+        return await atemplate_turn(user_msg, current_stores, user_loc)
+    enrich = level < SKIP_ENRICH
+
+    if not getattr(settings, 'CHAT_PIPELINE', True):
+        intent = await adetect_intent(user_msg, current_stores)
+        if intent.get('action') == 'SEARCH' and user_loc:
+            new_stores = await asearch_specific_stores(user_loc['lat'], user_loc['lng'], intent.get('keyword'), enrich=enrich)
+            if new_stores:
+                return "update_map", new_stores, await agenerate_answer_with_llama(user_msg, new_stores, conversation)
+        return "chat", current_stores, await agenerate_answer_with_llama(user_msg, current_stores, conversation)
+
+    action_type, stores = await aresolve_turn(user_msg, current_stores, user_loc)
+    if action_type == "chat" or not enrich:
+        return action_type, stores, await agenerate_answer_with_llama(user_msg, stores, conversation)
+
+    enriched, ai_result = await asyncio.gather(
+        aenrich_data_with_ai(stores),
+        agenerate_answer_with_llama(user_msg, [s.copy() for s in stores], conversation),
+    )
+    return "update_map", enriched, ai_result
@@ -0,0 +1,266 @@
+"""
+Chỉ mục POI cục bộ (SQLite R*Tree) dựng từ bản trích OSM.
+Trả lời cùng dạng truy vấn around-radius mà get_nearby_stores / search_specific_stores gửi lên Overpass,
+nhưng chạy tại chỗ, không cần mạng.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+
+from .geo import bbox_around
+
+logger = logging.getLogger('locator')
+
+# Giống bộ lọc amenity trong truy vấn Overpass mặc định
+NEARBY_AMENITIES = {'cafe', 'restaurant', 'fast_food', 'bar', 'pub', 'fuel', 'bank', 'pharmacy'}
+
+SCHEMA = """
+    CREATE TABLE pois (
+        id INTEGER PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        name TEXT NOT NULL,
+        shop TEXT,
+        amenity TEXT,
+        tags TEXT NOT NULL
+    );
+    CREATE VIRTUAL TABLE poi_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Vùng cập nhật dần (manage.py refresh_pois): synced_at = mốc dữ liệu OSM đã áp vào index
+REGIONS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sync_regions (
+        name TEXT PRIMARY KEY,
+        south REAL NOT NULL,
+        west REAL NOT NULL,
+        north REAL NOT NULL,
+        east REAL NOT NULL,
+        synced_at TEXT NOT NULL
+    );
+"""
+
+
+def is_poi(tags):
+    return bool(tags.get('name')) and bool(tags.get('shop') or tags.get('amenity'))
+
+
+def poi_row(item):
+    tags = item['tags']
+    osm_id = int(item['id'])
+    return (
+        (osm_id, item['lat'], item['lon'], tags['name'], tags.get('shop'), tags.get('amenity'), json.dumps(tags, ensure_ascii=False, separators=(',', ':'))),
+        (osm_id, item['lat'], item['lat'], item['lon'], item['lon']),
+    )
+
+
+def build_index(path, elements, bbox=None, timestamp=None):
+    """
+    Ghi các node OSM (dạng element của Overpass JSON) ra file index mới, thay thế file cũ một cách nguyên tử.
+    bbox = (south, west, north, east) là vùng phủ của bản trích; None thì lấy theo dữ liệu.
+    timestamp là mốc dữ liệu OSM của bản trích (ISO 8601), làm điểm bắt đầu cho cập nhật dần.
+    Trả về số POI đã ghi.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    count = 0
+    south = west = float('inf')
+    north = east = float('-inf')
+    batch = []
+
+    def flush():
+        conn.executemany("INSERT OR REPLACE INTO pois VALUES (?, ?, ?, ?, ?, ?, ?)", [b[0] for b in batch])
+        conn.executemany("INSERT OR REPLACE INTO poi_rtree VALUES (?, ?, ?, ?, ?)", [b[1] for b in batch])
+        batch.clear()
+
+    for item in elements:
+        tags = item.get('tags') or {}
+        lat, lon = item.get('lat'), item.get('lon')
+        if lat is None or lon is None or not is_poi(tags): continue
+        batch.append(poi_row(item))
+        south, north = min(south, lat), max(north, lat)
+        west, east = min(west, lon), max(east, lon)
+        count += 1
+        if len(batch) >= 5000: flush()
+    flush()
+
+    if bbox is None:
+        bbox = (south, west, north, east) if count else (0.0, 0.0, 0.0, 0.0)
+    conn.execute("INSERT INTO meta VALUES ('bbox', ?)", (json.dumps(list(bbox)),))
+    if timestamp:
+        conn.execute("INSERT INTO meta VALUES ('timestamp', ?)", (timestamp,))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _chunks(items, size=500):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def apply_changes(path, upserts, deletes):
+    """
+    Áp thay đổi tại chỗ lên file index (một transaction), không dựng lại toàn bộ.
+    upserts: node mới / đã sửa (dạng element Overpass); node không còn là POI hoặc đã ra ngoài vùng phủ
+    thì bị xóa khỏi index. deletes: id node đã bị xóa.
+    Trả về (số dòng ghi, số dòng xóa, list (lat, lon) bị ảnh hưởng gồm cả vị trí cũ lẫn mới).
+    Ghi ở chế độ journal mặc định nên mtime file đổi và các tiến trình đọc (get_poi_index) tự nạp lại.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        bbox = json.loads(_meta(conn, 'bbox') or 'null')
+        removed = {int(i) for i in deletes}
+        rows = {}
+        for item in upserts:
+            tags = item.get('tags') or {}
+            lat, lon = item.get('lat'), item.get('lon')
+            inside = lat is not None and lon is not None and (
+                not bbox or (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]))
+            if inside and is_poi(tags):
+                row = poi_row(item)
+                rows[row[0][0]] = row
+                removed.discard(row[0][0])
+            else:
+                removed.add(int(item['id']))
+                rows.pop(int(item['id']), None)
+
+        points = []
+        deleted = 0
+        with conn:
+            for chunk in _chunks(removed | set(rows)):
+                marks = ','.join('?' * len(chunk))
+                points += conn.execute(f"SELECT lat, lon FROM pois WHERE id IN ({marks})", chunk).fetchall()
+            for chunk in _chunks(removed):
+                marks = ','.join('?' * len(chunk))
+                deleted += conn.execute(f"DELETE FROM pois WHERE id IN ({marks})", chunk).rowcount
+                conn.execute(f"DELETE FROM poi_rtree WHERE id IN ({marks})", chunk)
+            conn.executemany("INSERT OR REPLACE INTO pois VALUES (?, ?, ?, ?, ?, ?, ?)", [r[0] for r in rows.values()])
+            conn.executemany("INSERT OR REPLACE INTO poi_rtree VALUES (?, ?, ?, ?, ?)", [r[1] for r in rows.values()])
+        points += [(r[0][1], r[0][2]) for r in rows.values()]
+        return len(rows), deleted, points
+    finally:
+        conn.close()
+
+
+def load_regions(path):
+    """
+    {name: {'bbox': (south, west, north, east), 'synced_at': ...}} của file index.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(REGIONS_SCHEMA)
+        rows = conn.execute("SELECT name, south, west, north, east, synced_at FROM sync_regions ORDER BY name").fetchall()
+        return {r[0]: {'bbox': tuple(r[1:5]), 'synced_at': r[5]} for r in rows}
+    finally:
+        conn.close()
+
+
+def save_region(path, name, bbox, synced_at=None):
+    """
+    Thêm / cập nhật một vùng. synced_at None thì giữ mốc cũ, vùng mới thì lấy mốc dữ liệu của index.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(REGIONS_SCHEMA)
+        with conn:
+            if synced_at is None:
+                row = conn.execute("SELECT synced_at FROM sync_regions WHERE name = ?", (name,)).fetchone()
+                synced_at = row[0] if row else _meta(conn, 'timestamp')
+            if not synced_at:
+                raise ValueError(f"Chưa biết mốc dữ liệu cho vùng '{name}'")
+            conn.execute("INSERT OR REPLACE INTO sync_regions VALUES (?, ?, ?, ?, ?, ?)", (name, *bbox, synced_at))
+    finally:
+        conn.close()
+
+
+class PoiIndex:
+    """
+    Đọc file index; mỗi thread giữ một kết nối SQLite read-only riêng.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.mtime = os.path.getmtime(self.path)
+        self._local = threading.local()
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'bbox'").fetchone()
+        self.bbox = tuple(json.loads(row[0])) if row else None
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def covers(self, lat, lng):
+        if not self.bbox: return False
+        south, west, north, east = self.bbox
+        return south <= lat <= north and west <= lng <= east
+
+    def query_bbox(self, south, west, north, east):
+        rows = self._conn().execute(
+            """SELECT p.id, p.lat, p.lon, p.tags FROM poi_rtree r JOIN pois p ON p.id = r.id
+               WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?""",
+            (south, north, west, east),
+        )
+        return [{'type': 'node', 'id': r[0], 'lat': r[1], 'lon': r[2], 'tags': json.loads(r[3])} for r in rows]
+
+    def query_around_bbox(self, south, west, north, east):
+        """
+        POI trong bbox, cùng bộ lọc với truy vấn Overpass mặc định (shop hoặc amenity phổ biến).
+        """
+        return [e for e in self.query_bbox(south, west, north, east)
+                if e['tags'].get('shop') or e['tags'].get('amenity') in NEARBY_AMENITIES]
+
+    def query_around(self, lat, lng, radius, keyword=None):
+        """
+        Các element trong bbox bao vòng tròn, lọc giống truy vấn Overpass tương ứng.
+        Lọc bán kính chính xác do phía gọi thực hiện.
+        """
+        elements = self.query_bbox(*bbox_around(lat, lng, radius))
+        if keyword:
+            # Overpass: node["shop"~kw,i] | node["amenity"~kw,i] | node["name"~kw,i]
+            try: pattern = re.compile(keyword, re.IGNORECASE)
+            except re.error: pattern = re.compile(re.escape(keyword), re.IGNORECASE)
+            return [e for e in elements if any(pattern.search(e['tags'].get(k) or '') for k in ('shop', 'amenity', 'name'))]
+        return [e for e in elements if e['tags'].get('shop') or e['tags'].get('amenity') in NEARBY_AMENITIES]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_poi_index():
+    """
+    Index dùng chung cho tiến trình; tự nạp lại khi file index được dựng lại. None nếu chưa có file.
+    """
+    global _index
+    path = getattr(settings, 'POI_INDEX_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    with _index_lock:
+        try:
+            if _index is None or _index.path != str(path) or _index.mtime != os.path.getmtime(path):
+                _index = PoiIndex(path)
+        except sqlite3.Error as e:
+            logger.error(f"POI Index Error: {e}")
+            _index = None
+    return _index
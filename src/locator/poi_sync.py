@@ -0,0 +1,118 @@
+"""
+Cập nhật dần chỉ mục POI thay vì tải lại toàn bộ bản trích: mỗi vùng đã đăng ký lưu mốc dữ liệu đã đồng bộ,
+mỗi lần chạy hỏi Overpass augmented diff ([adiff:]) từ mốc đó và áp thêm / sửa / xóa tại chỗ.
+Cũng đọc được file osmChange (.osc, .osc.gz, ví dụ minutely diff của planet) khi tự chạy replication.
+"""
+import gzip
+import logging
+import xml.etree.ElementTree as ET
+
+from .poi_index import apply_changes, is_poi, load_regions, save_region
+from .tiles import invalidate_points
+from .utils import OVERPASS_CLIENT
+
+logger = logging.getLogger('locator')
+
+
+def build_adiff_query(bbox, since):
+    south, west, north, east = bbox
+    # Cùng bộ lọc với build_poi_index (node có shop/amenity); node ra khỏi bộ lọc được báo là delete
+    return f"""
+        [adiff:"{since}"][timeout:180][bbox:{south},{west},{north},{east}];
+        (node["shop"]; node["amenity"];);
+        out meta;
+    """
+
+
+def node_element(node):
+    tags = {t.get('k'): t.get('v') for t in node.findall('tag')}
+    lat, lon = node.get('lat'), node.get('lon')
+    return {
+        'type': 'node', 'id': int(node.get('id')), 'tags': tags,
+        'lat': float(lat) if lat is not None else None, 'lon': float(lon) if lon is not None else None,
+    }
+
+
+def parse_adiff(text):
+    """
+    XML augmented diff -> (upserts, deletes, osm_base). osm_base là mốc dữ liệu của diff (đồng bộ lần sau từ đó).
+    """
+    root = ET.fromstring(text)
+    meta = root.find('meta')
+    osm_base = meta.get('osm_base') if meta is not None else None
+    upserts, deletes = [], []
+    for action in root.iter('action'):
+        kind = action.get('type')
+        node = action.find('node') if kind == 'create' else action.find('new/node')
+        if node is None: continue
+        if kind == 'delete' or node.get('visible') == 'false':
+            deletes.append(int(node.get('id')))
+        else:
+            upserts.append(node_element(node))
+    return upserts, deletes, osm_base
+
+
+def parse_osc(path):
+    """
+    File osmChange -> (upserts, deletes). Chỉ xét node; đọc dạng stream nên dùng được cho diff lớn.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    upserts, deletes = {}, set()
+    with opener(path, 'rb') as f:
+        section = None
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in ('create', 'modify', 'delete'): section = elem.tag
+                continue
+            if elem.tag == 'node':
+                osm_id = int(elem.get('id'))
+                element = node_element(elem) if section != 'delete' else None
+                # Node không (còn) là POI chỉ cần giữ id để xóa nếu đang có trong index
+                if element and is_poi(element['tags']):
+                    upserts[osm_id] = element
+                    deletes.discard(osm_id)
+                else:
+                    upserts.pop(osm_id, None)
+                    deletes.add(osm_id)
+                elem.clear()
+            elif elem.tag in ('way', 'relation'):
+                elem.clear()
+    return list(upserts.values()), deletes
+
+
+def apply(path, upserts, deletes):
+    written, deleted, points = apply_changes(path, upserts, deletes)
+    tiles = invalidate_points(points)
+    return {'written': written, 'deleted': deleted, 'tiles': tiles}
+
+
+def sync_region(path, name, region):
+    """
+    Đồng bộ một vùng từ mốc synced_at của nó. Raise RuntimeError nếu Overpass lỗi (mốc giữ nguyên).
+    """
+    text = OVERPASS_CLIENT.fetch_round_robin(build_adiff_query(region['bbox'], region['synced_at']), raw=True)
+    if text is None:
+        raise RuntimeError("Overpass không phản hồi")
+    upserts, deletes, osm_base = parse_adiff(text)
+    stats = apply(path, upserts, deletes)
+    if osm_base:
+        save_region(path, name, region['bbox'], osm_base)
+    stats['synced_at'] = osm_base or region['synced_at']
+    logger.info(f"POI Sync [{name}]: {stats['written']} upserts, {stats['deleted']} deletes, "
+                f"{stats['tiles']} tiles invalidated, synced to {stats['synced_at']}")
+    return stats
+
+
+def sync_all(path, names=None):
+    """
+    Đồng bộ các vùng (mặc định tất cả). Trả về {name: stats hoặc {'error': ...}}; một vùng lỗi không chặn vùng khác.
+    """
+    results = {}
+    for name, region in load_regions(path).items():
+        if names and name not in names: continue
+        try:
+            results[name] = sync_region(path, name, region)
+        except Exception as e:
+            logger.error(f"POI Sync Error [{name}]: {e}")
+            results[name] = {'error': str(e)}
+    return results
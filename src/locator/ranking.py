@@ -0,0 +1,109 @@
+"""
+Xếp hạng ứng viên POI theo lô: tính khoảng cách cho toàn bộ ứng viên trong một lần gọi, lọc theo bán kính,
+chọn top-k theo điểm tổng hợp (khoảng cách, đang mở cửa, khớp loại) bằng argpartition.
+Không dùng rating: OSM không có, còn rating trong PlaceEnrichment do AI sinh và chỉ có sau khi đã chọn xong top-k.
+"""
+import math
+import re
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+
+from .geo import EARTH_RADIUS_KM
+
+DEFAULT_WEIGHTS = {'distance': 0.7, 'open_now': 0.1, 'category': 0.2}
+
+# Giá trị trung tính khi không biết (nhiều POI thiếu opening_hours, không có keyword)
+UNKNOWN_SCORE = 0.5
+
+_HOURS_RANGE = re.compile(r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})')
+
+
+def ranking_weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'RANKING_WEIGHTS', {})}
+
+
+def open_now_score(hours, now=None):
+    """
+    1.0 nếu đang mở, 0.0 nếu đang đóng, UNKNOWN_SCORE nếu không đọc được.
+    Chỉ hiểu dạng phổ biến: "24/7" và một khung giờ "HH:MM-HH:MM" (có thể kèm "Mo-Su").
+    """
+    if not hours: return UNKNOWN_SCORE
+    if hours.strip() == '24/7': return 1.0
+    match = _HOURS_RANGE.search(hours)
+    if not match or ';' in hours or ',' in hours: return UNKNOWN_SCORE
+    h1, m1, h2, m2 = map(int, match.groups())
+    now = now or datetime.now()
+    minute, start, end = now.hour * 60 + now.minute, h1 * 60 + m1, h2 * 60 + m2
+    if start <= end:
+        return 1.0 if start <= minute < end else 0.0
+    # Khung giờ qua nửa đêm, ví dụ 18:00-02:00
+    return 1.0 if minute >= start or minute < end else 0.0
+
+
+def category_score(tags, keyword):
+    if not keyword: return UNKNOWN_SCORE
+    keyword = keyword.lower()
+    return 1.0 if keyword in (tags.get('shop'), tags.get('amenity'), tags.get('cuisine')) else 0.0
+
+
+def element_features(items, keyword=None, now=None):
+    """
+    Đặc trưng ngoài khoảng cách của từng ứng viên: (open_now, category), mỗi thứ trong [0, 1].
+    """
+    now = now or datetime.now()
+    return [
+        (open_now_score(item.get('tags', {}).get('opening_hours'), now),
+         category_score(item.get('tags', {}), keyword))
+        for item in items
+    ]
+
+
+def coordinates(elements):
+    """
+    Một lượt qua element: bỏ phần tử thiếu/sai tọa độ, trả về (elements hợp lệ, lats, lngs).
+    """
+    valid, lats, lngs = [], [], []
+    for item in elements:
+        try:
+            la, ln = float(item['lat']), float(item['lon'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        valid.append(item)
+        lats.append(la)
+        lngs.append(ln)
+    return valid, lats, lngs
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """
+    Khoảng cách (km) từ một điểm tới mảng điểm (ndarray).
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    d_lat = lat2 - lat1
+    d_lng = np.radians(np.asarray(lngs, dtype=np.float64) - lng)
+    a = np.sin(d_lat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(d_lng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def rank_elements(lat, lng, radius, elements, limit=None, keyword=None, now=None):
+    """
+    Lọc element OSM trong bán kính (m) quanh (lat, lng) và trả về list (khoảng cách km, element) gần -> xa.
+    Có limit: chỉ giữ limit ứng viên điểm tổng hợp cao nhất (chọn theo điểm, hiển thị vẫn theo khoảng cách).
+    """
+    elements, lats, lngs = coordinates(elements)
+    if not elements: return []
+    radius_km = radius / 1000.0
+    weights = ranking_weights()
+
+    distances = haversine_many(lat, lng, lats, lngs)
+    inside = np.flatnonzero(distances <= radius_km)
+    if limit is not None and len(inside) > limit:
+        features = np.asarray(element_features([elements[i] for i in inside], keyword, now), dtype=np.float64)
+        scores = (weights['distance'] * (1.0 - distances[inside] / max(radius_km, 1e-9))
+                  + features @ np.array([weights['open_now'], weights['category']]))
+        inside = inside[np.argpartition(-scores, limit - 1)[:limit]]
+    inside = inside[np.argsort(distances[inside], kind='stable')]
+    return [(float(distances[i]), elements[i]) for i in inside]
@@ -0,0 +1,76 @@
+"""
+Bản ghi quán gọn: dataclass có __slots__ thay cho dict 15 khóa.
+Chuỗi lặp lại (loại, category, mô tả, giờ mở cửa) được intern, danh sách sản phẩm/review mẫu dùng chung
+một tuple cho mọi quán, nên mỗi request chỉ cấp phát phần thực sự khác nhau (id, tên, tọa độ...).
+Chỉ chuyển sang JSON một lần ở biên response qua dumps() (orjson nếu có).
+"""
+import json
+import sys
+from dataclasses import asdict, dataclass, fields, replace
+
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def shared(values):
+    """
+    Tuple chuỗi đã intern; dùng cho dữ liệu mẫu để mọi quán trỏ cùng một đối tượng.
+    """
+    return tuple(intern(v) for v in values)
+
+
+@dataclass(slots=True)
+class StoreRecord:
+    id: str
+    name: str
+    type: str
+    category_key: str
+    lat: float
+    lng: float
+    distance: float
+    address: str
+    rating: float
+    reviews_count: int
+    open_hour: str
+    products: tuple
+    description: str
+    tags: tuple
+    review_list: tuple
+
+    def copy(self, **changes):
+        return replace(self, **changes)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
+
+def _default(obj):
+    if isinstance(obj, StoreRecord): return obj.to_dict()
+    if isinstance(obj, tuple): return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    JSON bytes; orjson tự tuần tự hóa dataclass/tuple, fallback json chuẩn giữ nguyên tiếng Việt.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, ensure_ascii=False).encode('utf-8')
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
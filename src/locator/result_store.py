@@ -0,0 +1,81 @@
+"""
+Kho kết quả tìm kiếm: session chỉ giữ result_id + vị trí người dùng, còn danh sách quán nằm trong cache
+CACHES[RESULT_CACHE_ALIAS] (LocMem trong tiến trình, hoặc Redis khi có REDIS_URL).
+result_id sinh từ tập ID quán nên những người dùng nhận cùng một tập kết quả dùng chung một entry;
+khoảng cách được tính lại theo vị trí của từng người khi đọc ra.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .geo import haversine_km
+
+
+def _cache():
+    return caches[getattr(settings, 'RESULT_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'RESULT_CACHE_TTL', 3600)
+
+
+def result_id_for(stores):
+    return hashlib.sha1('|'.join(s.id for s in stores).encode('utf-8')).hexdigest()[:20]
+
+
+def _canonical(stores):
+    return [s.copy(distance=0.0) for s in stores]
+
+
+def save_results(stores, replace=False):
+    """
+    Lưu danh sách quán (distance đặt về 0 vì là riêng của từng người). Trả về result_id, hoặc None nếu rỗng.
+    replace=True để ghi đè bản đã có (ví dụ sau khi làm giàu dữ liệu xong).
+    """
+    if not stores: return None
+    result_id = result_id_for(stores)
+    key = f"results:{result_id}"
+    canonical = _canonical(stores)
+    cache = _cache()
+    if replace:
+        cache.set(key, canonical, _ttl())
+    elif not cache.add(key, canonical, _ttl()):
+        cache.touch(key, _ttl())
+    return result_id
+
+
+def localize(stores, user_loc):
+    """
+    Bản sao danh sách quán với khoảng cách tính theo vị trí người dùng, sắp xếp gần -> xa.
+    """
+    if not user_loc:
+        return [s.copy() for s in stores]
+    lat, lng = user_loc['lat'], user_loc['lng']
+    result = [s.copy(distance=haversine_km(lat, lng, float(s.lat), float(s.lng))) for s in stores]
+    result.sort(key=lambda s: s.distance)
+    return result
+
+
+def load_results(result_id, user_loc=None):
+    if not result_id: return []
+    stores = _cache().get(f"results:{result_id}")
+    return localize(stores, user_loc) if stores else []
+
+
+async def asave_results(stores, replace=False):
+    if not stores: return None
+    result_id = result_id_for(stores)
+    key = f"results:{result_id}"
+    cache = _cache()
+    if replace:
+        await cache.aset(key, _canonical(stores), _ttl())
+    elif not await cache.aadd(key, _canonical(stores), _ttl()):
+        await cache.atouch(key, _ttl())
+    return result_id
+
+
+async def aload_results(result_id, user_loc=None):
+    if not result_id: return []
+    stores = await _cache().aget(f"results:{result_id}")
+    return localize(stores, user_loc) if stores else []
@@ -0,0 +1,340 @@
+"""
+Tài nguyên tĩnh cho giao diện bản đồ: tải các thư viện đang lấy từ CDN về thư mục build (vendor), gộp + nén
+CSS/JS thành một bundle mỗi loại, để collectstatic (ManifestStaticFilesStorage) gắn hash nội dung vào tên file
+và ghi sẵn bản .gz/.br. static_assets_middleware phục vụ các file đó với cache immutable dài hạn.
+Chưa build (dev, hoặc không tải được vendor) thì template tự quay về link CDN cũ.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+from urllib.parse import unquote, urljoin
+
+import requests
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import BaseStorageFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.decorators import sync_and_async_middleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+logger = logging.getLogger('locator')
+
+# Tên static (trong thư mục build) -> URL gốc. File CSS được quét url() để tải kèm font/ảnh nó tham chiếu.
+# Icon leaflet-color-markers không có bản phát hành trên CDN nên lấy từ GitHub; như mọi file vendor,
+# nội dung được khóa bằng SHA-256 trong STATIC_VENDOR_LOCK (xem download_vendor).
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'vendor/leaflet/leaflet.css': 'https://unpkg.com/leaflet@1.9.4/dist/leaflet.css',
+    'vendor/leaflet/leaflet.js': 'https://unpkg.com/leaflet@1.9.4/dist/leaflet.js',
+    'vendor/leaflet/images/marker-shadow.png': 'https://unpkg.com/leaflet@1.9.4/dist/images/marker-shadow.png',
+    'vendor/leaflet-routing-machine/leaflet-routing-machine.css': 'https://unpkg.com/leaflet-routing-machine@3.2.12/dist/leaflet-routing-machine.css',
+    'vendor/leaflet-routing-machine/leaflet-routing-machine.js': 'https://unpkg.com/leaflet-routing-machine@3.2.12/dist/leaflet-routing-machine.js',
+    'vendor/leaflet-color-markers/marker-icon-2x-red.png': 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-red.png',
+    'vendor/leaflet-color-markers/marker-icon-2x-blue.png': 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-blue.png',
+}
+
+# Bundle -> các file nguồn theo thứ tự nạp (cùng thứ tự các thẻ <link>/<script> cũ trong index.html)
+BUNDLES = {
+    'css/app.bundle.css': [
+        'vendor/bootstrap/css/bootstrap.min.css',
+        'vendor/fontawesome/css/all.min.css',
+        'vendor/leaflet/leaflet.css',
+        'vendor/leaflet-routing-machine/leaflet-routing-machine.css',
+        'css/style.css',
+    ],
+    'js/app.bundle.js': [
+        'vendor/leaflet/leaflet.js',
+        'vendor/leaflet-routing-machine/leaflet-routing-machine.js',
+        'js/map_logic.js',
+    ],
+}
+
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+SOURCE_MAP_RE = re.compile(r'^\s*(/\*#|//#) sourceMappingURL=.*$', re.M)
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.ttf', '.eot', '.otf', '.ico', '.html', '.xml')
+
+
+def build_dir():
+    return Path(getattr(settings, 'STATIC_BUILD_DIR', Path(settings.BASE_DIR).parent / 'data' / 'static_build'))
+
+
+def vendor_lock_path():
+    return Path(getattr(settings, 'STATIC_VENDOR_LOCK', Path(settings.BASE_DIR) / 'static_vendor.lock.json'))
+
+
+def load_vendor_lock():
+    try:
+        return json.loads(vendor_lock_path().read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+
+
+def write_file(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def is_external(ref):
+    return ref.startswith(('data:', 'http:', 'https:', '//', '#', '/'))
+
+
+def css_refs(text):
+    """
+    Đường dẫn tương đối trong url() của CSS (bỏ data:, URL tuyệt đối, ?query/#fragment).
+    """
+    refs = []
+    for _, ref in CSS_URL_RE.findall(text):
+        ref = ref.strip()
+        if is_external(ref): continue
+        ref = ref.split('#')[0].split('?')[0]
+        if ref: refs.append(ref)
+    return list(dict.fromkeys(refs))
+
+
+def download_vendor(refresh=False, timeout=30, update_lock=False):
+    """
+    Tải các file VENDOR (và font/ảnh CSS tham chiếu) vào thư mục build; file đã có thì bỏ qua trừ khi refresh.
+    File tải về phải khớp SHA-256 trong lock (file mới thì được ghi thêm vào lock); khác lock là lỗi, trừ khi update_lock.
+    Trả về (số file đã tải, list lỗi).
+    """
+    root = build_dir()
+    queue = list(VENDOR.items())
+    lock = load_vendor_lock()
+    locked = dict(lock)
+    seen, fetched, errors = set(), 0, []
+    with requests.Session() as session:
+        while queue:
+            name, url = queue.pop(0)
+            if name in seen: continue
+            seen.add(name)
+            path = root / name
+            if path.exists() and not refresh:
+                content = path.read_bytes()
+            else:
+                try:
+                    r = session.get(url, timeout=timeout)
+                    r.raise_for_status()
+                except requests.RequestException as e:
+                    errors.append(f"{url}: {e}")
+                    continue
+                content = r.content
+                digest = hashlib.sha256(content).hexdigest()
+                if lock.get(name, digest) != digest and not update_lock:
+                    errors.append(f"{url}: SHA-256 {digest} khác bản đã khóa {lock[name]} (dùng --update-lock nếu chủ ý nâng cấp)")
+                    continue
+                lock[name] = digest
+                write_file(path, content)
+                fetched += 1
+            if name.endswith('.css'):
+                for ref in css_refs(content.decode('utf-8', errors='replace')):
+                    queue.append((posixpath.normpath(posixpath.join(posixpath.dirname(name), ref)), urljoin(url, ref)))
+    if lock != locked:
+        write_file(vendor_lock_path(), (json.dumps(lock, indent=2, sort_keys=True) + '\n').encode('utf-8'))
+    return fetched, errors
+
+
+def minify_css(text):
+    if rcssmin:
+        return rcssmin.cssmin(text)
+    # Không có rcssmin: chỉ bỏ comment và khoảng trắng thừa (an toàn với CSS viết tay của repo)
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    # Không có rjsmin thì giữ nguyên; phần lớn dung lượng tiết kiệm được nằm ở bản .gz/.br
+    return rjsmin.jsmin(text) if rjsmin else text
+
+
+def rebase_css(text, source, bundle):
+    """
+    Viết lại url() tương đối của file CSS nguồn theo vị trí của bundle.
+    """
+    def replace(match):
+        quote, ref = match.group(1), match.group(2).strip()
+        if is_external(ref): return match.group(0)
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), ref))
+        return f"url({quote}{posixpath.relpath(target, posixpath.dirname(bundle))}{quote})"
+    return CSS_URL_RE.sub(replace, text)
+
+
+def build_bundles():
+    """
+    Gộp và nén các BUNDLES vào thư mục build. Raise FileNotFoundError nếu thiếu file nguồn (chưa tải vendor).
+    Trả về {bundle: số byte}.
+    """
+    sizes = {}
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            path = finders.find(source)
+            if not path:
+                raise FileNotFoundError(source)
+            text = SOURCE_MAP_RE.sub('', Path(path).read_text(encoding='utf-8'))
+            minified = '.min.' in source
+            if bundle.endswith('.css'):
+                parts.append(rebase_css(text if minified else minify_css(text), source, bundle))
+            else:
+                parts.append((text if minified else minify_js(text)).rstrip().rstrip(';') + ';')
+        content = '\n'.join(parts).encode('utf-8')
+        write_file(build_dir() / bundle, content)
+        sizes[bundle] = len(content)
+    return sizes
+
+
+class BuildFinder(BaseStorageFinder):
+    """
+    Finder cho thư mục build (vendor + bundle); thư mục chưa tồn tại thì coi như rỗng.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.storage = FileSystemStorage(location=build_dir())
+        super().__init__(*args, **kwargs)
+
+    def list(self, ignore_patterns):
+        if not os.path.isdir(self.storage.location):
+            return []
+        return super().list(ignore_patterns)
+
+
+def write_compressed(path):
+    """
+    Ghi path.gz và path.br (nếu có gói brotli) cạnh file gốc; bỏ qua biến thể không nhỏ hơn đáng kể.
+    """
+    data = Path(path).read_bytes()
+    variants = {'.gz': lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        variants['.br'] = lambda: brotli.compress(data, quality=11)
+    for suffix, compress in variants.items():
+        target = Path(f"{path}{suffix}")
+        if target.exists(): continue
+        blob = compress()
+        if len(blob) < len(data) * 0.95:
+            write_file(target, blob)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage + bản nén sẵn cho mọi file đã gắn hash.
+    Tham chiếu tới file không có (ví dụ source map của thư viện) được giữ nguyên thay vì làm hỏng collectstatic.
+    """
+
+    def url_converter(self, name, hashed_files, template=None):
+        convert = super().url_converter(name, hashed_files, template)
+
+        def converter(matchobj):
+            try:
+                return convert(matchobj)
+            except ValueError:
+                return matchobj[0]
+        return converter
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run: return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESSIBLE):
+                write_compressed(self.path(name))
+
+
+def is_available(name):
+    """
+    File static đã có để phục vụ chưa: theo manifest khi chạy production, theo finder khi DEBUG.
+    """
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if not settings.DEBUG and hashed_files is not None:
+        return name in hashed_files
+    return finders.find(name) is not None
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in header.split(','):
+        token, _, params = part.partition(';')
+        if re.search(r'q=0(\.0*)?\s*$', params): continue
+        encodings.add(token.strip().lower())
+    return encodings
+
+
+@functools.lru_cache(maxsize=4096)
+def static_variants(path):
+    """
+    Các bản nén sẵn có của file (đã collectstatic thì không đổi cho tới lần deploy sau).
+    """
+    return tuple(encoding for encoding, suffix in (('br', '.br'), ('gzip', '.gz')) if os.path.exists(path + suffix))
+
+
+def serve_static(request):
+    """
+    FileResponse cho request tới STATIC_URL nếu file có trong STATIC_ROOT, không thì None.
+    """
+    root = getattr(settings, 'STATIC_ROOT', None)
+    prefix = '/' + settings.STATIC_URL.lstrip('/')
+    if not root or request.method not in ('GET', 'HEAD') or not request.path.startswith(prefix):
+        return None
+    name = unquote(request.path[len(prefix):])
+    try:
+        path = safe_join(root, name)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    content_type, _ = mimetypes.guess_type(path)
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding = next((e for e in static_variants(path) if e in accepted), None)
+    if encoding:
+        path += '.br' if encoding == 'br' else '.gz'
+    response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+    response.headers.pop('Content-Disposition', None)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    if HASHED_NAME_RE.search(name):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'STATIC_MAX_AGE', 3600)}"
+    return response
+
+
+@sync_and_async_middleware
+def static_assets_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return serve_static(request) or await get_response(request)
+    else:
+        def middleware(request):
+            return serve_static(request) or get_response(request)
+    return middleware
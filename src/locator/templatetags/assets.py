@@ -0,0 +1,28 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from locator.static_assets import BUNDLES, VENDOR, is_available
+
+register = template.Library()
+
+
+@register.simple_tag
+def asset_url(name):
+    """
+    URL static của file vendor; chưa build thì trả về URL CDN gốc.
+    """
+    if name in VENDOR and not is_available(name):
+        return VENDOR[name]
+    return static(name)
+
+
+@register.simple_tag
+def asset_bundle(name):
+    """
+    Thẻ <link>/<script> cho bundle đã build, hoặc từng file nguồn (vendor chưa tải thì lấy từ CDN).
+    """
+    urls = [static(name)] if is_available(name) else [asset_url(source) for source in BUNDLES[name]]
+    if name.endswith('.css'):
+        return format_html_join('\n', '<link rel="stylesheet" href="{}">', ((url,) for url in urls))
+    return format_html_join('\n', '<script src="{}"></script>', ((url,) for url in urls))
@@ -1,3 +1,1167 @@
-from django.test import TestCase
+import asyncio
+import gc
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import admission, async_utils, geocoder, pipeline, static_assets, tiles, utils, viewport, warmup
+from .admission import FULL, SKIP_ENRICH, TEMPLATE_REPLY, Budget
+from .async_utils import AnswerStream
+from .batch import batch_search, fetch_group, parse_queries, plan_fetches
+from .cache import TTLCache
+from .conversation import CONTEXT, QUESTION, Conversation
+from .geo import bbox_around, geohash_decode, geohash_encode, haversine_km
+from .geocoder import GeocodeIndex
+from .intent_router import IntentRouter
+from .llm_cache import LLMCache, LocalLRUBackend
+from .llm_gateway import LLMGateway, Provider
+from .management.commands.warm_cache import cells_in_bbox
+from .overpass import CircuitBreaker, OverpassClient
+from .pipeline import guess_search_keyword, run_chat_turn
+from .poi_index import PoiIndex, build_index
+from .poi_sync import apply, parse_osc
+from .ranking import open_now_score, rank_elements
+from .records import StoreRecord, dumps
+from .result_store import aload_results, asave_results, load_results, save_results
+from .static_assets import accepted_encodings, css_refs, rebase_css, serve_static, static_variants
+from .text import fold_text
+from .tiles import TILE_MIN_ZOOM, tile_path, tile_xy, write_atomic
+from .tracing import end_trace, span, start_trace, submit_traced
+from .utils import parse_answer
+from .viewport import ViewportTooLarge, viewport_payload
+
+
+class TTLCacheTests(SimpleTestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expiry_and_stats(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('old', 1, ttl=-1)
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(len(cache), 0)
+        cache.set('new', 2)
+        self.assertEqual(cache.get('new'), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class GeoTests(SimpleTestCase):
+    def test_geohash_round_trip(self):
+        cell = geohash_encode(21.0285, 105.8542, 6)
+        self.assertEqual(len(cell), 6)
+        lat, lng, half_lat, half_lng = geohash_decode(cell)
+        self.assertLessEqual(abs(lat - 21.0285), half_lat)
+        self.assertLessEqual(abs(lng - 105.8542), half_lng)
+
+    def test_bbox_around_contains_circle(self):
+        south, west, north, east = bbox_around(21.0, 105.8, 1000)
+        self.assertAlmostEqual(haversine_km(21.0, 105.8, north, 105.8), 1.0, places=3)
+        self.assertAlmostEqual(haversine_km(21.0, 105.8, 21.0, east), 1.0, places=2)
+        self.assertLess(south, 21.0)
+        self.assertLess(west, 105.8)
+
+
+def poi(osm_id, lat, lon, name, **tags):
+    return {'type': 'node', 'id': osm_id, 'lat': lat, 'lon': lon, 'tags': {'name': name, **tags}}
+
+
+def store(store_id, lat=21.03, lng=105.85, **fields):
+    return StoreRecord(**{
+        'id': store_id, 'name': f'Quán {store_id}', 'type': 'Quán cà phê', 'category_key': 'cafe',
+        'lat': lat, 'lng': lng, 'distance': 0.0, 'address': '', 'rating': 4.5, 'reviews_count': 10,
+        'open_hour': '', 'products': (), 'description': '', 'tags': (), 'review_list': (), **fields,
+    })
+
+
+class TempDirMixin:
+    def setUp(self):
+        super().setUp()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.addCleanup(self._tmp.cleanup)
+
+
+class PoiIndexTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmp, 'pois.sqlite3')
+        self.count = build_index(self.path, [
+            poi(1, 21.0300, 105.8500, 'Cafe Giảng', amenity='cafe'),
+            poi(2, 21.0305, 105.8505, 'Tạp hóa Hai', shop='convenience'),
+            poi(3, 21.0310, 105.8510, 'Trường học', amenity='school'),
+            poi(4, 21.0800, 105.9000, 'Cafe Xa', amenity='cafe'),
+            {'type': 'node', 'id': 5, 'lat': 21.0301, 'lon': 105.8501, 'tags': {'amenity': 'cafe'}},  # không tên
+        ], bbox=(21.0, 105.8, 21.1, 105.95))
+        self.index = PoiIndex(self.path)
+
+    def test_build_skips_unnamed_nodes_and_stores_bbox(self):
+        self.assertEqual(self.count, 4)
+        self.assertTrue(self.index.covers(21.05, 105.9))
+        self.assertFalse(self.index.covers(10.0, 106.0))
+
+    def test_query_around_nearby_filter(self):
+        ids = {e['id'] for e in self.index.query_around(21.0302, 105.8502, 500)}
+        # Giống truy vấn Overpass mặc định: shop hoặc amenity phổ biến, không lấy trường học / điểm ngoài vùng
+        self.assertEqual(ids, {1, 2})
+
+    def test_query_around_keyword_matches_tags_and_name(self):
+        self.assertEqual({e['id'] for e in self.index.query_around(21.0302, 105.8502, 500, 'cafe')}, {1})
+        self.assertEqual({e['id'] for e in self.index.query_around(21.0302, 105.8502, 500, 'giảng')}, {1})
+        self.assertEqual({e['id'] for e in self.index.query_around(21.0302, 105.8502, 500, 'school')}, {3})
+        # Keyword không phải regex hợp lệ vẫn tìm được theo chuỗi
+        self.assertEqual(self.index.query_around(21.0302, 105.8502, 500, 'cafe('), [])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_and_closes_on_success(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Half-open chỉ cho một request thử
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_release_frees_trial_without_changing_state(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(breaker.failures, 1)
+        self.assertTrue(breaker.allow())
+
+    def test_cancelled_hedge_loser_releases_half_open_trial(self):
+        client = OverpassClient(['http://slow.test', 'http://fast.test'], hedge_delay=0.01, failure_threshold=1, reset_timeout=0)
+        slow, fast = client.mirrors
+        slow.breaker.record_failure()
+
+        class Response:
+            status_code = 200
+            headers = {'Content-Type': 'application/json'}
+
+            def json(self):
+                return {'elements': []}
+
+        class SlowClient:
+            async def get(self, *args, **kwargs):
+                await asyncio.sleep(5)
+
+        class FastClient:
+            async def get(self, *args, **kwargs):
+                return Response()
+
+        slow.async_client = SlowClient
+        fast.async_client = FastClient
+
+        async def run():
+            data = await client.afetch('[out:json];node(1);out;')
+            # Cho task thua cuộc chạy tới except CancelledError
+            await asyncio.sleep(0.01)
+            return data
+
+        self.assertEqual(asyncio.run(run()), {'elements': []})
+        self.assertEqual(slow.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(slow.breaker.failures, 1)
+        self.assertTrue(slow.breaker.allow())
+
+
+def json_response(payload, status=200):
+    response = mock.Mock(status_code=status, headers={'Content-Type': 'application/json'})
+    response.json.return_value = payload
+    return response
+
+
+class OverpassClientTests(SimpleTestCase):
+    def test_hedged_request_returns_fastest_mirror(self):
+        client = OverpassClient(['http://slow.test', 'http://fast.test'], hedge_delay=0.01)
+        slow, fast = client.mirrors
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.3)
+            return json_response({'elements': ['slow']})
+
+        slow.session.get = slow_get
+        fast.session.get = lambda *a, **kw: json_response({'elements': ['fast']})
+        self.assertEqual(client.fetch('q'), {'elements': ['fast']})
+
+    def test_failed_mirror_falls_through_and_opens_breaker(self):
+        client = OverpassClient(['http://bad.test', 'http://good.test'], hedge_delay=5, failure_threshold=1)
+        bad, good = client.mirrors
+        bad.session.get = lambda *a, **kw: json_response({}, status=504)
+        good.session.get = lambda *a, **kw: json_response({'elements': []})
+
+        started = time.monotonic()
+        self.assertEqual(client.fetch('q'), {'elements': []})
+        # Lỗi thì chuyển ngay sang mirror kế tiếp, không chờ hết hedge_delay
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(bad.breaker.state, CircuitBreaker.OPEN)
+
+        bad.session.get = mock.Mock(side_effect=AssertionError('mirror đang mở không được gọi'))
+        self.assertEqual(client.fetch('q'), {'elements': []})
+
+
+class AsyncOverpassTests(SimpleTestCase):
+    def test_afetch_returns_fastest_mirror_and_cancels_loser(self):
+        client = OverpassClient(['http://slow.test', 'http://fast.test'], hedge_delay=0.01)
+        slow, fast = client.mirrors
+        cancelled = []
+
+        class Response:
+            status_code = 200
+            headers = {'Content-Type': 'application/json'}
+
+            def json(self):
+                return {'elements': []}
+
+        class SlowClient:
+            async def get(self, *args, **kwargs):
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+
+        class FastClient:
+            async def get(self, *args, **kwargs):
+                return Response()
+
+        slow.async_client = SlowClient
+        fast.async_client = FastClient
+
+        async def run():
+            data = await client.afetch('[out:json];node(1);out;')
+            await asyncio.sleep(0.01)
+            return data
+
+        self.assertEqual(asyncio.run(run()), {'elements': []})
+        self.assertEqual(cancelled, [True])
+
+
+class ParseAnswerTests(SimpleTestCase):
+    def test_json_reply_inside_text(self):
+        content = 'Đây nhé: {"reply": "Quán A", "best_store_id": "7"} cảm ơn'
+        self.assertEqual(parse_answer(content, []), {'reply': 'Quán A', 'best_store_id': '7'})
+
+    def test_invalid_json_falls_back_to_first_store(self):
+        result = parse_answer('không phải JSON', [store('3'), store('4')])
+        self.assertEqual(result['best_store_id'], '3')
+        self.assertIsNone(parse_answer('không phải JSON', [])['best_store_id'])
+
+
+class ChatPipelineTests(SimpleTestCase):
+    LOC = {'lat': 21.03, 'lng': 105.85}
+
+    def test_guess_search_keyword(self):
+        self.assertEqual(guess_search_keyword('Gần đây có cây xăng nào không?'), 'fuel')
+        self.assertEqual(guess_search_keyword('Tìm ATM giúp mình'), 'atm')
+        self.assertIsNone(guess_search_keyword('Xin chào'))
+
+    @mock.patch('locator.pipeline.generate_answer_with_llama', return_value={'reply': 'ok', 'best_store_id': None})
+    @mock.patch('locator.pipeline.enrich_data_with_ai', side_effect=lambda stores: [s.copy(description='đã làm giàu') for s in stores])
+    @mock.patch('locator.pipeline.search_specific_stores', return_value=[store('1')])
+    @mock.patch('locator.pipeline.detect_intent_with_llama', return_value={'action': 'SEARCH', 'keyword': 'fuel'})
+    def test_speculative_search_is_reused_when_intent_agrees(self, intent, search, enrich, answer):
+        action, stores, result = run_chat_turn('tìm cây xăng', [], self.LOC)
+        self.assertEqual(action, 'update_map')
+        self.assertEqual(stores, [store('1', description='đã làm giàu')])
+        search.assert_called_once_with(21.03, 105.85, 'fuel', enrich=False)
+        # Câu trả lời sinh trên bản chụp chưa làm giàu
+        self.assertEqual(answer.call_args.args[1], [store('1')])
+
+    @mock.patch('locator.pipeline.generate_answer_with_llama', return_value={'reply': 'ok', 'best_store_id': None})
+    @mock.patch('locator.pipeline.search_specific_stores', return_value=[store('1')])
+    @mock.patch('locator.pipeline.detect_intent_with_llama', return_value={'action': 'CHAT'})
+    def test_chat_intent_keeps_current_stores(self, intent, search, answer):
+        action, stores, _ = run_chat_turn('cây xăng này tốt không?', [store('9')], self.LOC)
+        self.assertEqual((action, stores), ('chat', [store('9')]))
+
+    def aresolve_with_slow_search(self, intent):
+        started = []
+
+        async def search(lat, lng, keyword, enrich=True):
+            started.append(keyword)
+            await asyncio.sleep(10)
+
+        async def run():
+            with mock.patch.object(pipeline, 'asearch_specific_stores', search), \
+                    mock.patch.object(pipeline, 'adetect_intent', intent):
+                try:
+                    return await pipeline.aresolve_turn('tìm cây xăng', [store('9')], self.LOC)
+                finally:
+                    others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+                    await asyncio.sleep(0)
+                    self.assertEqual(started, ['fuel'])
+                    self.assertTrue(all(t.done() for t in others))
+
+        return asyncio.run(run())
+
+    def test_speculative_task_is_cancelled_when_intent_fails(self):
+        async def intent(user_msg, stores):
+            await asyncio.sleep(0)
+            raise RuntimeError('LLM lỗi')
+
+        with self.assertRaisesMessage(RuntimeError, 'LLM lỗi'):
+            self.aresolve_with_slow_search(intent)
+
+    def test_speculative_task_is_cancelled_for_chat_intent(self):
+        async def intent(user_msg, stores):
+            await asyncio.sleep(0)
+            return {'action': 'CHAT'}
+
+        self.assertEqual(self.aresolve_with_slow_search(intent), ('chat', [store('9')]))
+
+    def test_pool_work_closes_db_connections_even_on_error(self):
+        with mock.patch.object(utils, 'close_old_connections') as close:
+            self.assertEqual(utils.run_closing_connections(lambda a, b=0: a + b, 1, b=2), 3)
+            with self.assertRaises(ZeroDivisionError):
+                utils.run_closing_connections(lambda: 1 / 0)
+        self.assertEqual(close.call_count, 4)
+
+
+class IntentRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = IntentRouter(log_every=0)
+
+    def test_fold_text(self):
+        self.assertEqual(fold_text('Cây Xăng  Đồng-Tâm!'), 'cay xang dong tam')
+
+    def test_longest_phrase_wins_without_diacritics(self):
+        self.assertEqual(self.router.match_tags('sua dien thoai o dau'), ['mobile_phone'])
+        self.assertEqual(self.router.match_tags('Tìm ATM hoặc ngân hàng'), ['atm', 'bank'])
+        self.assertIsNone(self.router.guess_tag('Tìm ATM hoặc ngân hàng'))
+
+    def test_clear_messages_are_routed_locally(self):
+        self.assertEqual(self.router.classify('Tìm cây xăng gần đây'), {'action': 'SEARCH', 'keyword': 'fuel'})
+        self.assertEqual(self.router.classify('nhà thuốc'), {'action': 'SEARCH', 'keyword': 'pharmacy'})
+        self.assertEqual(self.router.classify('Cảm ơn bạn nhé'), {'action': 'CHAT'})
+        # Đã có quán cà phê trên bản đồ -> hỏi về danh sách hiện tại
+        self.assertEqual(self.router.classify('quán cà phê nào yên tĩnh', [store('1', category_key='cafe')]), {'action': 'CHAT'})
+        self.assertEqual(self.router.stats.routed, 4)
+
+    def test_ambiguous_messages_escalate(self):
+        self.assertIsNone(self.router.classify('hôm nay trời đẹp quá nên đi đâu chơi'))
+        self.assertIsNone(self.router.classify('cây xăng với nhà thuốc gần nhất'))
+        self.router.record_escalation(2.0)
+        self.assertEqual(self.router.stats.snapshot()['escalated'], 1)
+
+
+class AnswerStreamTests(SimpleTestCase):
+    def test_marker_split_across_chunks_is_not_streamed(self):
+        stream = AnswerStream()
+        sent = ''.join(stream.feed(chunk) for chunk in ["Quán A gần ", "nhất nhé.\nBEST", "_ID", ": 42\n"])
+        tail, best_id, has_marker = stream.finish()
+        self.assertEqual(sent + tail, "Quán A gần nhất nhé.\n")
+        self.assertNotIn("BEST", sent + tail)
+        self.assertEqual(best_id, '42')
+        self.assertTrue(has_marker)
+
+    def test_without_marker_everything_is_reply(self):
+        stream = AnswerStream()
+        sent = stream.feed("Xin chào") + stream.feed(" bạn")
+        tail, best_id, has_marker = stream.finish()
+        self.assertEqual(sent + tail, "Xin chào bạn")
+        self.assertIsNone(best_id)
+        self.assertFalse(has_marker)
+
+    def test_null_best_id(self):
+        stream = AnswerStream()
+        stream.feed("Không có quán phù hợp.\nBEST_ID: null")
+        self.assertEqual(stream.finish()[1:], (None, True))
+
+    def stream(self, chunks, stores, cached=None):
+        async def ollama_chunks(prompt):
+            for chunk in chunks:
+                yield chunk
+
+        async def run():
+            return [event async for event in async_utils.astream_answer_with_llama('quán nào?', stores)]
+
+        cache = LLMCache(LocalLRUBackend(maxsize=10, ttl=60))
+        if cached is not None: cache.set(cache.key('answer', 'quán nào?', stores), cached)
+        with mock.patch.object(async_utils, '_ollama_chunks', ollama_chunks), mock.patch.object(async_utils, 'LLM_CACHE', cache):
+            return asyncio.run(run())
+
+    def test_stream_without_marker_suggests_nearest_store(self):
+        events = self.stream(['Quán này ', 'gần nhé.'], [store('xa', distance=2.0), store('gan', distance=0.1)])
+        self.assertEqual(''.join(text for kind, text in events if kind == 'token'), 'Quán này gần nhé.')
+        self.assertEqual(events[-1], ('done', 'gan'))
+
+
+    def test_cached_answer_without_best_id_is_served(self):
+        events = self.stream(['không gọi tới'], [store('gan')], cached={'reply': 'Quán gần nhất nhé.'})
+        self.assertEqual(events, [('token', 'Quán gần nhất nhé.'), ('done', None)])
+
+    def test_incomplete_cached_answer_is_treated_as_miss(self):
+        events = self.stream(['Quán này ', 'gần nhé.'], [store('gan', distance=0.1)], cached={'best_store_id': 'gan'})
+        self.assertEqual(''.join(text for kind, text in events if kind == 'token'), 'Quán này gần nhé.')
+        self.assertEqual(events[-1], ('done', 'gan'))
+
+
+class LLMCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = LLMCache(LocalLRUBackend(maxsize=10, ttl=60), ttl=60)
+
+    def test_key_normalizes_message_and_uses_first_five_stores(self):
+        stores = [store(str(i)) for i in range(8)]
+        self.assertEqual(self.cache.key('answer', 'Quán  Cà Phê nào NGON?', stores),
+                         self.cache.key('answer', 'quan ca phe nao ngon', stores[:5] + [store('x')]))
+        self.assertNotEqual(self.cache.key('answer', 'quan ca phe', stores), self.cache.key('answer', 'quan ca phe', stores[1:]))
+        self.assertNotEqual(self.cache.key('answer', 'quan ca phe'), self.cache.key('intent', 'quan ca phe'))
+
+    def test_hits_skip_the_llm_call(self):
+        intent = {'action': 'SEARCH', 'keyword': 'fuel'}
+        with mock.patch.object(utils, 'LLM_CACHE', self.cache), \
+                mock.patch.object(utils.LLM_GATEWAY, 'complete', return_value=intent) as chat:
+            utils.detect_intent_with_llama('Tìm cây xăng')
+            second = utils.detect_intent_with_llama('tim cay xang')
+        self.assertEqual(chat.call_count, 1)
+        self.assertEqual(second, {'action': 'SEARCH', 'keyword': 'fuel'})
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+
+class ResultStoreTests(SimpleTestCase):
+    STORES = [store('a', 21.0300, 105.8500, distance=9.0), store('b', 21.0400, 105.8600, distance=1.0)]
+
+    def setUp(self):
+        caches['results'].clear()
+
+    def test_users_share_one_entry_and_get_their_own_distances(self):
+        result_id = save_results(self.STORES)
+        self.assertEqual(save_results([s.copy(distance=0.5) for s in self.STORES]), result_id)
+        self.assertEqual(caches['results'].get(f'results:{result_id}')[0].distance, 0.0)
+
+        near_b = load_results(result_id, {'lat': 21.0401, 'lng': 105.8601})
+        self.assertEqual([s.id for s in near_b], ['b', 'a'])
+        self.assertLess(near_b[0].distance, 0.05)
+        self.assertEqual([s.id for s in load_results(result_id, {'lat': 21.03, 'lng': 105.85})], ['a', 'b'])
+
+    def test_replace_overwrites_and_missing_id_is_empty(self):
+        result_id = save_results(self.STORES)
+        save_results([s.copy(description='mới') for s in self.STORES])
+        self.assertEqual(load_results(result_id)[0].description, '')
+        save_results([s.copy(description='mới') for s in self.STORES], replace=True)
+        self.assertEqual(load_results(result_id)[0].description, 'mới')
+        self.assertIsNone(save_results([]))
+        self.assertEqual(load_results('khong-ton-tai'), [])
+
+    def test_async_round_trip(self):
+        async def run():
+            result_id = await asave_results(self.STORES)
+            return await aload_results(result_id, {'lat': 21.04, 'lng': 105.86})
+
+        self.assertEqual([s.id for s in asyncio.run(run())], ['b', 'a'])
+
+
+class RankingTests(SimpleTestCase):
+    ELEMENTS = [
+        {'id': 1, 'lat': 21.0310, 'lon': 105.8500, 'tags': {'amenity': 'restaurant'}},
+        {'id': 2, 'lat': 21.0302, 'lon': 105.8500, 'tags': {'amenity': 'cafe'}},
+        {'id': 3, 'lat': 21.0304, 'lon': 105.8500, 'tags': {'amenity': 'restaurant'}},
+        {'id': 4, 'lat': 21.2000, 'lon': 105.8500, 'tags': {'amenity': 'cafe'}},
+        {'id': 5, 'lon': 105.85, 'tags': {}},
+    ]
+
+    def test_open_now_score(self):
+        noon, night = datetime(2026, 1, 1, 12, 0), datetime(2026, 1, 1, 1, 0)
+        self.assertEqual(open_now_score('Mo-Su 07:00-22:00', noon), 1.0)
+        self.assertEqual(open_now_score('07:00-22:00', night), 0.0)
+        self.assertEqual(open_now_score('18:00-02:00', night), 1.0)
+        self.assertEqual(open_now_score('24/7', night), 1.0)
+        self.assertEqual(open_now_score('Mo-Fr 08:00-12:00; Sa 08:00-10:00', noon), 0.5)
+
+    def test_filters_radius_and_sorts_by_distance(self):
+        ranked = rank_elements(21.03, 105.85, 500, self.ELEMENTS)
+        self.assertEqual([e['id'] for _, e in ranked], [2, 3, 1])
+        self.assertAlmostEqual(ranked[0][0], 0.0222, places=3)
+
+    def test_limit_keeps_best_scores_then_orders_by_distance(self):
+        ranked = rank_elements(21.03, 105.85, 500, self.ELEMENTS, limit=2, keyword='restaurant')
+        self.assertEqual([e['id'] for _, e in ranked], [3, 1])
+
+    def test_open_now_breaks_near_ties(self):
+        elements = [
+            {'id': 1, 'lat': 21.0302, 'lon': 105.8500, 'tags': {'opening_hours': '18:00-23:00'}},
+            {'id': 2, 'lat': 21.0303, 'lon': 105.8500, 'tags': {'opening_hours': '07:00-22:00'}},
+        ]
+        ranked = rank_elements(21.03, 105.85, 500, elements, limit=1, now=datetime(2026, 1, 1, 12, 0))
+        self.assertEqual([e['id'] for _, e in ranked], [2])
+
+
+class StoreRecordTests(SimpleTestCase):
+    def test_dumps_serializes_records_and_tuples(self):
+        record = store('1', products=('Cà phê sữa', 'Bạc xỉu'), tags=('Wifi',))
+        data = json.loads(dumps({'stores': [record]}))
+        self.assertEqual(data['stores'][0]['products'], ['Cà phê sữa', 'Bạc xỉu'])
+        self.assertEqual(data['stores'][0]['name'], 'Quán 1')
+        with mock.patch('locator.records.orjson', None):
+            self.assertIn('Cà phê sữa'.encode('utf-8'), dumps([record]))
+
+    def test_from_dict_ignores_unknown_keys_and_copy_is_independent(self):
+        record = StoreRecord.from_dict({**store('1').to_dict(), 'extra': True})
+        self.assertEqual(record, store('1'))
+        self.assertFalse(hasattr(record, '__dict__'))
+        moved = record.copy(distance=2.5)
+        self.assertEqual((record.distance, moved.distance), (0.0, 2.5))
+
+
+class ViewportTests(TempDirMixin, SimpleTestCase):
+    BBOX = (21.0, 105.8, 21.01, 105.81)
+
+    def setUp(self):
+        super().setUp()
+        path = os.path.join(self.tmp, 'pois.sqlite3')
+        # Lưới 5x4 quán cà phê cách nhau ~200 m
+        build_index(path, [poi(100 + i * 4 + j, 21.001 + i * 0.002, 105.801 + j * 0.002, f'Cafe {i}{j}', amenity='cafe')
+                           for i in range(5) for j in range(4)], bbox=(20.9, 105.7, 21.1, 105.9))
+        patcher = mock.patch.object(viewport, 'get_poi_index', return_value=PoiIndex(path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_low_zoom_returns_clusters(self):
+        payload = viewport_payload(*self.BBOX, zoom=14)
+        self.assertEqual(payload['mode'], 'clusters')
+        self.assertEqual(payload['total'], 20)
+        self.assertTrue(payload['clusters'])
+        self.assertEqual(sum(c['count'] for c in payload['clusters']) + len(payload['points']), 20)
+        self.assertEqual(payload['clusters'][0]['top_category'], 'cafe')
+
+    def test_wide_viewport_is_rejected_even_with_local_index(self):
+        with mock.patch.object(viewport, 'VIEWPORT_MAX_SPAN_DEG', 0.1), self.assertRaises(ViewportTooLarge):
+            viewport_payload(20.95, 105.75, 21.05, 105.89, zoom=11)
+
+    def test_high_zoom_pages_with_cursor(self):
+        seen, cursor = [], None
+        while True:
+            payload = viewport_payload(*self.BBOX, zoom=17, cursor=cursor, page_size=6)
+            self.assertEqual(payload['mode'], 'points')
+            seen += [int(p['id']) for p in payload['points']]
+            cursor = payload['next_cursor']
+            if cursor is None: break
+        self.assertEqual(seen, list(range(100, 120)))
+
+    def test_overpass_fallback_caches_tiles_and_rejects_wide_viewports(self):
+        viewport.get_poi_index.return_value = None
+        with self.assertRaises(ViewportTooLarge):
+            viewport_payload(21.0, 105.8, 21.5, 105.9, zoom=12)
+
+        data = {'elements': [poi(1, 21.001, 105.801, 'Cafe', amenity='cafe'), poi(2, 21.015, 105.801, 'Ngoài khung', amenity='cafe')]}
+        with mock.patch.object(viewport, 'POI_CACHE', TTLCache(maxsize=100, ttl=60)), \
+                mock.patch.object(viewport, 'fetch_overpass_data', return_value=data) as fetch:
+            first = viewport_payload(*self.BBOX, zoom=17)
+            second = viewport_payload(*self.BBOX, zoom=17)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual([p['id'] for p in first['points']], ['1'])
+        self.assertEqual(second, first)
+
+
+class TileApiTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(TILE_CACHE_DIR=self.tmp)
+        override.enable()
+        self.addCleanup(override.disable)
+        south, west, _, _ = tiles.tile_bounds(17, 104_000, 56_000)
+        patcher = mock.patch.object(tiles, 'fetch_viewport_elements', return_value=[poi(7, south, west, 'Cafe', amenity='cafe')])
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse('poi_tile', kwargs={'z': 17, 'x': 104_000, 'y': 56_000})
+
+    def test_tile_is_cached_on_disk_with_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        feature = json.loads(b''.join(response.streaming_content))['features'][0]
+        self.assertEqual(feature['properties']['id'], '7')
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertTrue(tiles.tile_path(17, 104_000, 56_000).exists())
+
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_invalid_or_unavailable_tiles(self):
+        self.assertEqual(self.client.get(reverse('poi_tile', kwargs={'z': 17, 'x': 2 ** 17, 'y': 0})).status_code, 404)
+        self.fetch.return_value = None
+        self.assertEqual(self.client.get(self.url).status_code, 502)
+        # Zoom thấp: tile rỗng, không hỏi dữ liệu
+        response = self.client.get(reverse('poi_tile', kwargs={'z': 10, 'x': 812, 'y': 437}))
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['features'], [])
+
+
+@override_settings(POI_CACHE_BACKEND='django')
+class WarmCacheTests(TempDirMixin, SimpleTestCase):
+    def test_cells_cover_bbox_corners(self):
+        cells = cells_in_bbox(21.00, 105.80, 21.02, 105.83, 6)
+        for lat, lng in [(21.00, 105.80), (21.02, 105.83), (21.00, 105.83), (21.02, 105.80)]:
+            self.assertIn(geohash_encode(lat, lng, 6), cells)
+
+    def test_warmed_tiles_are_served_and_fresh_cells_skipped(self):
+        cache = TTLCache(maxsize=1000, ttl=600)
+        client = mock.Mock()
+        client.fetch_round_robin.return_value = {'elements': [poi(1, 21.0301, 105.8501, 'Cafe', amenity='cafe')]}
+        state = os.path.join(self.tmp, 'state.json')
+        args = ['warm_cache', '--point', '21.03,105.85', '--point-radius', '300', '--no-enrich', '--state', state]
+        with mock.patch.object(utils, 'POI_CACHE', cache), mock.patch.object(utils, 'get_poi_index', return_value=None), \
+                mock.patch('locator.management.commands.warm_cache.OVERPASS_CLIENT', client):
+            call_command(*args, stdout=StringIO())
+            warmed = client.fetch_round_robin.call_count
+            self.assertGreater(warmed, 0)
+            hits, miss = utils.lookup_nearby_elements(21.0301, 105.8501, 1500)
+            self.assertIsNone(miss)
+            self.assertEqual([e['id'] for _, e in hits], [1])
+
+            out = StringIO()
+            call_command(*args, stdout=out)
+        self.assertIn('0 cần warm', out.getvalue())
+        self.assertEqual(client.fetch_round_robin.call_count, warmed)
+
+    def test_failing_cell_does_not_stop_the_run(self):
+        calls = []
+
+        def fetch(query):
+            calls.append(query)
+            if len(calls) == 1: raise RuntimeError('dữ liệu lạ')
+            return {'elements': []}
+
+        client = mock.Mock()
+        client.fetch_round_robin.side_effect = fetch
+        out = StringIO()
+        with mock.patch.object(utils, 'POI_CACHE', TTLCache(maxsize=1000, ttl=600)), \
+                mock.patch('locator.management.commands.warm_cache.OVERPASS_CLIENT', client):
+            call_command('warm_cache', '--point', '21.03,105.85', '--point-radius', '300', '--no-enrich', '--concurrency', '1',
+                         '--state', os.path.join(self.tmp, 'state.json'), stdout=out)
+        self.assertGreater(len(calls), 1)
+        self.assertIn('lỗi (dữ liệu lạ)', out.getvalue())
+        self.assertIn('(1 lỗi)', out.getvalue())
+
+    def test_keywords_are_warmed_with_the_search_radius(self):
+        client = mock.Mock()
+        client.fetch_round_robin.return_value = {'elements': []}
+        requests = []
+        with mock.patch.object(utils, 'POI_CACHE', TTLCache(maxsize=1000, ttl=600)), \
+                mock.patch('locator.management.commands.warm_cache.OVERPASS_CLIENT', client), \
+                mock.patch('locator.management.commands.warm_cache.tile_request',
+                           side_effect=lambda *a: requests.append(a) or utils.tile_request(*a)):
+            call_command('warm_cache', '--point', '21.03,105.85', '--point-radius', '100', '--keywords', 'cafe',
+                         '--no-enrich', '--state', os.path.join(self.tmp, 'state.json'), stdout=StringIO())
+        self.assertEqual({(r[2], r[3]) for r in requests}, {(1500, None), (3000, 'cafe')})
+
+    @override_settings(POI_CACHE_BACKEND='local')
+    def test_process_local_cache_is_rejected(self):
+        client = mock.Mock()
+        with mock.patch('locator.management.commands.warm_cache.OVERPASS_CLIENT', client):
+            with self.assertRaisesMessage(CommandError, 'POI_CACHE_BACKEND'):
+                call_command('warm_cache', '--no-enrich', '--state', os.path.join(self.tmp, 'state.json'), stdout=StringIO())
+        client.fetch_round_robin.assert_not_called()
+
+
+@override_settings(GEOCODE_INDEX_PATH=None)
+class GeocodeTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        geocoder.GEOCODE_CACHE.clear()
+        geocoder.NOMINATIM_MISSES.clear()
+
+    def build(self, elements):
+        source = os.path.join(self.tmp, 'places.json')
+        output = os.path.join(self.tmp, 'geocode.sqlite3')
+        with open(source, 'w', encoding='utf-8') as f:
+            json.dump({'osm3s': {'timestamp_osm_base': '2024-01-01T00:00:00Z'}, 'elements': elements}, f, ensure_ascii=False)
+        out = StringIO()
+        call_command('build_geocode_index', source, output=output, stdout=out)
+        self.assertIn(f"{len(elements)} địa điểm", out.getvalue())
+        return output
+
+    def test_build_command_and_prefix_search(self):
+        output = self.build([
+            poi(1, 21.03, 105.85, 'Phố Hàng Bài', highway='residential'),
+            poi(2, 21.02, 105.84, 'Hoàn Kiếm', place='district'),
+            poi(3, 21.01, 105.83, 'Cafe Hàng Bài', amenity='cafe'),
+        ])
+        names = [r['display_name'] for r in GeocodeIndex(output).search('hang b')]
+        # Đường phố xếp trước POI; gõ không dấu vẫn khớp từ giữa tên
+        self.assertEqual(names, ['Phố Hàng Bài', 'Cafe Hàng Bài'])
+        self.assertEqual(GeocodeIndex(output).search('hoan')[0]['kind'], 'district')
+
+    def test_ranking_sees_matches_beyond_first_keys(self):
+        elements = [poi(i, 21.0, 105.0 + i / 1000, f'Hàng quán {i:03d}', amenity='cafe') for i in range(1, 300)]
+        elements.append(poi(999, 21.0, 106.0, 'Hàng Zzz', place='quarter'))
+        output = self.build(elements)
+        results = GeocodeIndex(output).search('hang', 3)
+        self.assertEqual(results[0]['display_name'], 'Hàng Zzz')
+        self.assertEqual(len(results), 3)
+
+    def test_short_prefixes_use_precomputed_top_k(self):
+        elements = [poi(i, 21.0, 105.0 + i / 1000, f'Hàng quán {i:03d}', amenity='cafe') for i in range(1, 30)]
+        elements += [poi(999, 21.0, 106.0, 'Hàng Zzz', place='quarter'), poi(998, 21.0, 106.1, 'Hai Bà Trưng', place='district')]
+        index = GeocodeIndex(self.build(elements))
+        self.assertTrue(index.has_short_prefixes)
+        precomputed = [index.search(q, 5) for q in ('h', 'ha', 'Hà')]
+        # Bản chỉ mục cũ (không có short_prefixes) quét cả đoạn khóa: kết quả phải như nhau
+        index.has_short_prefixes = False
+        self.assertEqual(precomputed, [index.search(q, 5) for q in ('h', 'ha', 'Hà')])
+        self.assertEqual([r['display_name'] for r in precomputed[1][:2]], ['Hai Bà Trưng', 'Hàng Zzz'])
+        self.assertEqual(len(precomputed[1]), 5)
+
+    def test_local_results_are_cached_and_nominatim_is_fallback(self):
+        index = GeocodeIndex(self.build([poi(1, 21.03, 105.85, 'Phố Hàng Bài', highway='residential')]))
+        remote = [{'display_name': 'Đà Nẵng', 'lat': 16.05, 'lon': 108.2, 'kind': 'city', 'source': 'nominatim'}]
+        with mock.patch.object(geocoder, 'get_geocode_index', return_value=index), \
+                mock.patch.object(geocoder, 'nominatim_search', return_value=remote) as search, \
+                mock.patch.object(geocoder.NOMINATIM_LIMITER, 'try_acquire', return_value=True):
+            self.assertEqual(geocoder.geocode('Hàng Bài')[0]['source'], 'local')
+            with mock.patch.object(index, 'search', side_effect=AssertionError('phải lấy từ LRU')):
+                self.assertEqual(geocoder.geocode('hang bai')[0]['display_name'], 'Phố Hàng Bài')
+            self.assertEqual(geocoder.geocode('Đà Nẵng'), remote)
+            search.return_value = None
+            self.assertEqual(geocoder.geocode('lỗi mạng'), [])
+        self.assertEqual(search.call_count, 2)
+
+    def test_nominatim_fallback_is_throttled_and_misses_cached(self):
+        calls = []
+
+        def search(query, limit=5):
+            calls.append(query)
+            return []
+
+        with mock.patch.object(geocoder, 'nominatim_search', search), \
+                mock.patch.object(geocoder.NOMINATIM_LIMITER, 'try_acquire', side_effect=[True, False]):
+            self.assertEqual(geocoder.geocode('xyz'), [])
+            self.assertEqual(geocoder.geocode('xyz'), [])    # nhớ chuỗi không có kết quả
+            self.assertEqual(geocoder.geocode('xyzw'), [])   # chưa tới lượt gọi
+        self.assertEqual(calls, ['xyz'])
+
+
+    def test_nominatim_identifies_the_app_instead_of_a_browser(self):
+        response = mock.Mock(**{'json.return_value': []})
+        with mock.patch.object(geocoder, 'NOMINATIM_CONTACT', 'ops@example.org'), \
+                mock.patch.object(geocoder._session, 'get', return_value=response) as get:
+            geocoder.nominatim_search('Hà Nội')
+        self.assertEqual(get.call_args.kwargs['params']['email'], 'ops@example.org')
+        user_agent = geocoder._session.headers['User-Agent']
+        self.assertTrue(user_agent.startswith('AI-Locator/'))
+        self.assertNotIn('Mozilla', user_agent)
+        self.assertNotIn('Referer', geocoder._session.headers)
+
+
+class TracingTests(SimpleTestCase):
+    def test_spans_follow_request_into_pool_threads(self):
+        def fetch(mirror):
+            with span('overpass', mirror=mirror):
+                pass
+
+        trace, token = start_trace()
+        try:
+            with span('intent'):
+                pass
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [submit_traced(executor, fetch, mirror) for mirror in ('a', 'b')]
+                for future in futures:
+                    future.result()
+        finally:
+            end_trace(token)
+        with span('ngoài request'):
+            pass
+        self.assertEqual(list(trace.summary()), ['intent', 'overpass'])
+        self.assertEqual(trace.summary()['overpass'][1], 2)
+        header = trace.server_timing(0.25)
+        self.assertRegex(header, r'^intent;dur=[\d.]+, overpass;dur=[\d.]+;desc="x2", total;dur=250\.0$')
+
+    def test_middleware_sets_server_timing_logs_and_counts_routes(self):
+        with self.assertLogs('locator.trace', level='INFO') as logs:
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'(^|, )total;dur=[\d.]+$')
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['route'], line['status']), ('metrics', 200))
+
+        body = self.client.get(reverse('metrics')).content.decode('utf-8')
+        self.assertIn('locator_requests_total{route="metrics",status="200"}', body)
+        self.assertIn('locator_cache_hits{cache="poi"}', body)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_identical_prompts_share_one_call(self):
+        calls = []
+
+        async def acall(prompt, timeout):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return 'ok'
+
+        gateway = LLMGateway([Provider('ollama', None, acall, 2, 8)])
+
+        async def run():
+            same = [gateway.acomplete('p', providers=('ollama',)) for _ in range(3)]
+            return await asyncio.gather(*same, gateway.acomplete('khác', providers=('ollama',)))
+
+        self.assertEqual(asyncio.run(run()), ['ok'] * 4)
+        self.assertEqual(calls, ['p', 'khác'])
+        self.assertEqual(gateway.stats()['coalesced'], 2)
+        self.assertEqual(gateway.stats()['inflight'], 0)
+
+    def test_followers_survive_cancelled_leader(self):
+        calls = []
+
+        async def acall(prompt, timeout):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return 'ok'
+
+        gateway = LLMGateway([Provider('ollama', None, acall, 2, 8)])
+
+        async def run():
+            leader = asyncio.create_task(gateway.acomplete('p', providers=('ollama',)))
+            await asyncio.sleep(0.01)
+            followers = [asyncio.create_task(gateway.acomplete('p', providers=('ollama',))) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(*followers)
+
+        self.assertEqual(asyncio.run(run()), ['ok', 'ok', 'ok'])
+        # Leader bị hủy + một follower thành leader mới
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(gateway.stats()['inflight'], 0)
+
+    def test_error_or_unparsable_reply_fails_over(self):
+        def broken(prompt, timeout):
+            raise ConnectionError('ollama down')
+
+        gateway = LLMGateway([Provider('a', broken, None, 1, 4), Provider('b', lambda p, t: '{"ok": 1}', None, 1, 4)])
+        with self.assertLogs('locator', 'WARNING'):
+            self.assertEqual(gateway.complete('p', parse=json.loads, providers=('a', 'b')), {'ok': 1})
+            gateway.providers['a'].call = lambda p, t: 'không phải JSON'
+            self.assertEqual(gateway.complete('q', parse=json.loads, providers=('a', 'b')), {'ok': 1})
+        self.assertEqual(gateway.stats()['failovers'], {'error': 2})
+        self.assertEqual(gateway.stats()['providers']['a']['errors'], 2)
+
+
+class WarmupTests(SimpleTestCase):
+    def serving(self, argv, run_main=None, opt_in=None):
+        env = {'RUN_MAIN': run_main or '', 'LOCATOR_SERVING': opt_in or ''}
+        with mock.patch.object(warmup.sys, 'argv', argv), mock.patch.dict(os.environ, env):
+            return warmup.serving_process()
+
+    def test_serving_process(self):
+        self.assertTrue(self.serving(['/venv/bin/gunicorn', 'configs.wsgi']))
+        self.assertTrue(self.serving(['/venv/bin/uvicorn', 'configs.asgi:application']))
+        self.assertFalse(self.serving(['manage.py', 'migrate']))
+        self.assertFalse(self.serving(['manage.py', 'runserver']))
+        self.assertTrue(self.serving(['manage.py', 'runserver'], run_main='true'))
+        self.assertTrue(self.serving(['manage.py', 'runserver', '--noreload']))
+        self.assertTrue(self.serving(['/venv/lib/python3.12/site-packages/gunicorn/__main__.py', 'configs.wsgi']))
+        # Tiến trình không phục vụ request thì không nạp model
+        self.assertFalse(self.serving(['/venv/bin/pytest']))
+        self.assertFalse(self.serving(['/venv/bin/celery', 'worker']))
+        self.assertTrue(self.serving(['/usr/sbin/httpd'], opt_in='1'))
+
+    def test_readiness_probe(self):
+        with mock.patch.dict(warmup.STATE, {'ollama': 'pending', 'gemini': 'disabled'}):
+            response = self.client.get(reverse('readiness'))
+            self.assertEqual((response.status_code, response.json()['status']), (503, 'warming'))
+            warmup.STATE['ollama'] = 'ready'
+            self.assertEqual(self.client.get(reverse('readiness')).status_code, 200)
+
+
+class BatchSearchTests(SimpleTestCase):
+    def test_parse_queries_defaults_and_validation(self):
+        nearby, keyword = parse_queries([{'lat': '21.03', 'lng': 105.85}, {'lat': 21.03, 'lng': 105.85, 'keyword': ' cafe '}])
+        self.assertEqual((nearby.keyword, nearby.radius, nearby.limit), (None, 1500, 12))
+        self.assertEqual((keyword.keyword, keyword.radius), ('cafe', 3000))
+        for items in ([], [{'lat': 21}], [{'lat': 91, 'lng': 0}], [{'lat': 21, 'lng': 105, 'radius': 99999}],
+                      [{'lat': 21, 'lng': 105, 'keyword': 'a"b'}]):
+            with self.assertRaises(ValueError):
+                parse_queries(items)
+
+    def test_plan_fetches_dedupes_and_groups_by_keyword(self):
+        misses = [utils.TileMiss(('w7er8u', 1500, kw), None, 0, 0, 1500, kw if kw != '*' else None, None)
+                  for kw in ('*', 'cafe', '*')]
+        misses += [utils.TileMiss((f'w7er{i:02d}', 1500, '*'), None, 0, 0, 1500, None, None) for i in range(30)]
+        groups = plan_fetches(misses)
+        self.assertEqual(sorted(len(keys) for _, keys in groups), [1, 6, 25])
+        self.assertEqual({kw for kw, _ in groups}, {None, 'cafe'})
+
+    def test_nearby_points_share_one_overpass_request(self):
+        client = mock.Mock()
+        client.fetch_round_robin.return_value = {'elements': [poi(1, 21.0301, 105.8501, 'Cafe', amenity='cafe')]}
+        cache = TTLCache(maxsize=100, ttl=60)
+        with mock.patch.object(utils, 'POI_CACHE', cache), mock.patch('locator.batch.POI_CACHE', cache), \
+                mock.patch.object(utils, 'get_poi_index', return_value=None), mock.patch('locator.batch.OVERPASS_CLIENT', client):
+            results = batch_search(parse_queries([
+                {'lat': 21.0300, 'lng': 105.8500}, {'lat': 21.0302, 'lng': 105.8502}, {'lat': 21.0300, 'lng': 105.8500, 'keyword': 'cafe'},
+            ]), enrich=False)
+        # Một request cho ô không keyword, một cho keyword
+        self.assertEqual(client.fetch_round_robin.call_count, 2)
+        self.assertEqual([[s.id for s in r['stores']] for r in results], [['1'], ['1'], ['1']])
+        self.assertNotEqual(results[0]['stores'][0].distance, results[1]['stores'][0].distance)
+
+    def test_each_tile_gets_its_own_limit_and_duplicates_are_dropped(self):
+        query = utils.build_overpass_union_query([(21.0, 105.8, 500), (21.01, 105.81, 500)], 'cafe', limit=40)
+        self.assertEqual(query.count('out 40;'), 2)
+
+        keys = [('w7er8u', 1500, 'cafe'), ('w7er8v', 1500, 'cafe')]
+        lat, lng, _ = utils.tile_circle(keys[0])
+        shared = poi(1, lat, lng, 'Cafe', amenity='cafe')
+        client = mock.Mock()
+        client.fetch_round_robin.return_value = {'elements': [shared, dict(shared)]}
+        with mock.patch('locator.batch.POI_CACHE', TTLCache(maxsize=10, ttl=60)), mock.patch('locator.batch.OVERPASS_CLIENT', client):
+            tiles = fetch_group('cafe', keys)
+        self.assertEqual([e['id'] for e in tiles[keys[0]]], [1])
+
+
+class PoiSyncTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index_path = os.path.join(self.tmp, 'pois.sqlite3')
+        build_index(self.index_path, [
+            poi(1, 21.0300, 105.8500, 'Cafe Một', amenity='cafe'),
+            poi(2, 21.0310, 105.8510, 'Tạp hóa Hai', shop='convenience'),
+            poi(3, 21.0320, 105.8520, 'Nhà thuốc Ba', amenity='pharmacy'),
+        ], bbox=(21.0, 105.8, 21.1, 105.9))
+
+    def ids(self):
+        return {e['id'] for e in PoiIndex(self.index_path).query_bbox(21.0, 105.8, 21.1, 105.9)}
+
+    def test_apply_upserts_deletes_and_invalidates_tiles(self):
+        with override_settings(TILE_CACHE_DIR=os.path.join(self.tmp, 'tiles')):
+            stale = tile_path(TILE_MIN_ZOOM, *tile_xy(21.0300, 105.8500, TILE_MIN_ZOOM))
+            write_atomic(stale, b'{}')
+            stats = apply(self.index_path, [
+                poi(1, 21.0400, 105.8600, 'Cafe Một', amenity='cafe'),   # dời chỗ
+                poi(4, 21.0500, 105.8700, 'Quán Bốn', amenity='restaurant'),  # mới
+                {'type': 'node', 'id': 2, 'lat': 21.0310, 'lon': 105.8510, 'tags': {'name': 'Tạp hóa Hai'}},  # hết là POI
+                poi(5, 10.0, 106.0, 'Ngoài vùng', amenity='cafe'),
+            ], {3})
+            self.assertFalse(stale.exists())
+
+        self.assertEqual(stats['written'], 2)
+        self.assertEqual(stats['deleted'], 2)
+        self.assertGreaterEqual(stats['tiles'], 1)
+        self.assertEqual(self.ids(), {1, 4})
+        moved = next(e for e in PoiIndex(self.index_path).query_bbox(21.0, 105.8, 21.1, 105.9) if e['id'] == 1)
+        self.assertEqual((moved['lat'], moved['lon']), (21.0400, 105.8600))
+
+    def test_parse_osc_gz(self):
+        path = os.path.join(self.tmp, 'change.osc.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write("""<osmChange version="0.6">
+              <create><node id="6" lat="21.06" lon="105.88"><tag k="name" v="Cafe Sáu"/><tag k="amenity" v="cafe"/></node></create>
+              <modify><node id="2" lat="21.031" lon="105.851"><tag k="name" v="Tạp hóa Hai"/></node></modify>
+              <delete><node id="3" lat="21.032" lon="105.852"/></delete>
+              <modify><way id="9"><nd ref="1"/></way></modify>
+            </osmChange>""")
+        upserts, deletes = parse_osc(path)
+        self.assertEqual([e['id'] for e in upserts], [6])
+        self.assertEqual(deletes, {2, 3})
+
+        with override_settings(TILE_CACHE_DIR=os.path.join(self.tmp, 'tiles')):
+            apply(self.index_path, upserts, deletes)
+        self.assertEqual(self.ids(), {1, 6})
+
+
+class StaticAssetsTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        static_variants.cache_clear()
+        self.addCleanup(static_variants.cache_clear)
+        override = override_settings(STATIC_ROOT=self.tmp, STATIC_URL='/static/')
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.tmp, 'js'))
+        for name, content in [('js/app.0123456789ab.js', b'var a;'), ('js/app.0123456789ab.js.gz', b'gz'), ('js/map.js', b'var m;')]:
+            with open(os.path.join(self.tmp, name), 'wb') as f:
+                f.write(content)
+
+    def get(self, path, encoding=''):
+        return serve_static(RequestFactory().get(path, HTTP_ACCEPT_ENCODING=encoding))
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate, br;q=0'), {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings('br;q=0.5, gzip;q=0.0'), {'br'})
+
+    def test_serves_precompressed_hashed_files_as_immutable(self):
+        response = self.get('/static/js/app.0123456789ab.js', 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(b''.join(response.streaming_content), b'gz')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        plain = self.get('/static/js/app.0123456789ab.js', 'identity')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(b''.join(plain.streaming_content), b'var a;')
+        self.assertNotIn('immutable', self.get('/static/js/map.js')['Cache-Control'])
+
+    def test_missing_or_outside_files_fall_through(self):
+        self.assertIsNone(self.get('/static/js/khong-co.js'))
+        self.assertIsNone(self.get('/static/../settings.py'))
+        self.assertIsNone(self.get('/api/search/'))
+
+    def test_css_urls_are_rebased_to_bundle(self):
+        css = "a{background:url('../images/x.png')} b{src:url(data:font/woff2;base64,AA)} c{src:url(../webfonts/f.woff2?v=1#x)}"
+        self.assertEqual(css_refs(css), ['../images/x.png', '../webfonts/f.woff2'])
+        rebased = rebase_css(css, 'vendor/leaflet/css/leaflet.css', 'css/app.bundle.css')
+        self.assertIn("url('../vendor/leaflet/images/x.png')", rebased)
+        self.assertIn('url(data:font/woff2;base64,AA)', rebased)
+
+
+    def test_vendor_downloads_are_pinned_by_sha256(self):
+        lock = os.path.join(self.tmp, 'vendor.lock.json')
+        build = os.path.join(self.tmp, 'build')
+        session = mock.MagicMock()
+        session.__enter__.return_value = session
+        session.get.return_value = mock.Mock(content=b'icon v1')
+        vendor = {'vendor/icon.png': 'https://example.org/master/icon.png'}
+        with override_settings(STATIC_VENDOR_LOCK=lock, STATIC_BUILD_DIR=build), \
+                mock.patch.object(static_assets, 'VENDOR', vendor), \
+                mock.patch.object(static_assets.requests, 'Session', return_value=session):
+            self.assertEqual(static_assets.download_vendor(), (1, []))
+            with open(lock) as f:
+                self.assertEqual(json.load(f), {'vendor/icon.png': hashlib.sha256(b'icon v1').hexdigest()})
+
+            # Nhánh upstream đổi nội dung: không ghi đè file đã khóa
+            session.get.return_value = mock.Mock(content=b'icon v2')
+            fetched, errors = static_assets.download_vendor(refresh=True)
+            self.assertEqual(fetched, 0)
+            self.assertIn('khác bản đã khóa', errors[0])
+            with open(os.path.join(build, 'vendor', 'icon.png'), 'rb') as f:
+                self.assertEqual(f.read(), b'icon v1')
+
+            self.assertEqual(static_assets.download_vendor(refresh=True, update_lock=True), (1, []))
+            with open(lock) as f:
+                self.assertEqual(json.load(f), {'vendor/icon.png': hashlib.sha256(b'icon v2').hexdigest()})
+
+
+class AdmissionTests(SimpleTestCase):
+    def test_levels_follow_queue_depth_and_wait(self):
+        budget = Budget('test', limit=1, max_waiting=8, timeout=10.0, enrich_depth=2, template_depth=4)
+        self.assertEqual(budget.level_for(0, 0.0), FULL)
+        self.assertEqual(budget.level_for(2, 0.0), SKIP_ENRICH)
+        self.assertEqual(budget.level_for(4, 0.0), TEMPLATE_REPLY)
+        # Chờ quá nửa hạn thì hạ thêm một bậc
+        self.assertEqual(budget.level_for(0, 6.0), SKIP_ENRICH)
+        self.assertEqual(budget.level_for(4, 6.0), TEMPLATE_REPLY)
+
+    def test_full_budget_sheds_and_streams_hold_slot_until_closed(self):
+        budget = Budget('test', limit=1, max_waiting=0, timeout=0.05, enrich_depth=1, template_depth=1)
+        request = RequestFactory().get('/')
+        with mock.patch.dict(admission.BUDGETS, {'test': budget}):
+            plain = admission.admit('test')(lambda request: HttpResponse('ok'))
+            stream = admission.admit('test')(lambda request: StreamingHttpResponse(iter(['a', 'b'])))
+
+            self.assertEqual(plain(request).status_code, 200)
+            self.assertEqual(budget.slots.active, 0)
+
+            streaming = stream(request)
+            self.assertEqual(budget.slots.active, 1)
+            rejected = plain(request)
+            self.assertEqual(rejected.status_code, 503)
+            self.assertGreaterEqual(int(rejected['Retry-After']), 1)
+            self.assertEqual(budget.state(), 'shedding')
+
+            self.assertEqual(b''.join(streaming.streaming_content), b'ab')
+            streaming.close()
+            self.assertEqual(budget.slots.active, 0)
+
+    def test_stream_slot_is_released_when_exhausted_or_abandoned(self):
+        budget = Budget('test', limit=1, max_waiting=0, timeout=0.05, enrich_depth=1, template_depth=1)
+
+        async def chunks():
+            yield 'a'
+            yield 'b'
+
+        with mock.patch.dict(admission.BUDGETS, {'test': budget}):
+            stream = admission.admit('test')(lambda request: StreamingHttpResponse(iter(['a'])))
+            response = stream(RequestFactory().get('/'))
+            self.assertEqual(list(response.streaming_content), [b'a'])
+            self.assertEqual(budget.slots.active, 0)
+
+            async def view(request):
+                return StreamingHttpResponse(chunks())
+
+            async def abandon():
+                response = await admission.admit('test')(view)(RequestFactory().get('/'))
+                self.assertEqual(budget.slots.active, 1)
+                # Client ngắt sau chunk đầu: không ai gọi close()
+                await anext(aiter(response.streaming_content))
+
+            asyncio.run(abandon())
+            gc.collect()
+            self.assertEqual(budget.slots.active, 0)
+
+
+class ConversationTests(SimpleTestCase):
+    def test_follow_up_prompt_extends_previous_prompt(self):
+        conversation = Conversation('c1')
+        stores = [store('1'), store('2')]
+        first = utils.build_answer_prompt('Quán nào gần nhất?', stores, conversation)
+        utils.record_answer(conversation, 'Quán nào gần nhất?', stores, '{"reply": "Quán 1", "best_store_id": "1"}')
+
+        second = utils.build_answer_prompt('Còn quán nào yên tĩnh?', stores, conversation)
+        # Prefix giữ nguyên (Ollama dùng lại KV cache), dữ liệu quán không gửi lại khi không đổi
+        self.assertEqual(second[:len(first)], first)
+        self.assertEqual(second[len(first)]['role'], 'assistant')
+        self.assertEqual(len(second), len(first) + 2)
+
+        third = utils.build_answer_prompt('Thế còn chỗ khác?', [store('3')], conversation)
+        self.assertIn('Quán 3', third[-2]['content'])
+
+    def test_trim_keeps_latest_turns_and_current_context(self):
+        conversation = Conversation('c2')
+        context = {'role': 'user', 'content': 'DỮ LIỆU ' + 'x' * 300}
+        for i in range(20):
+            conversation.record(context, {'role': 'user', 'content': f'câu hỏi {i} ' + 'y' * 300}, 'trả lời ' + 'z' * 300)
+        self.assertLessEqual(conversation.tokens(), 1500)
+        kinds = [kind for kind, _ in conversation.history]
+        self.assertEqual(kinds[0], CONTEXT)
+        self.assertEqual(kinds.count(CONTEXT), 1)
+        questions = [m['content'] for kind, m in conversation.history if kind == QUESTION]
+        self.assertTrue(questions[-1].startswith('câu hỏi 19'))
+        self.assertLess(len(questions), 20)
+
+    def test_saved_conversation_round_trips(self):
+        conversation = Conversation('c3')
+        conversation.record({'role': 'user', 'content': 'DỮ LIỆU'}, {'role': 'user', 'content': 'hỏi'}, 'đáp')
+        conversation.save()
+        loaded = Conversation.load('c3')
+        self.assertEqual((loaded.history, loaded.context_digest), (conversation.history, conversation.context_digest))
+        self.assertTrue(Conversation.load('khong-co').empty)
@@ -0,0 +1,27 @@
+"""
+Chuẩn hóa văn bản tiếng Việt: bỏ dấu, hạ chữ thường, gộp khoảng trắng.
+"""
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def fold_diacritics(text):
+    """
+    "Cây Xăng Đồng Tâm" -> "cay xang dong tam" (giữ nguyên dấu câu).
+    """
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+    return text.replace('đ', 'd')
+
+
+def fold_text(text):
+    """
+    Bỏ dấu và thay mọi ký tự không phải chữ/số bằng một khoảng trắng.
+    """
+    return _NON_WORD.sub(' ', fold_diacritics(text)).strip()
+
+
+def tokenize(text):
+    return fold_text(text).split()
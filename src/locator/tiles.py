@@ -0,0 +1,123 @@
+"""
+Tile POI theo lưới XYZ chuẩn (cùng lưới với lớp bản đồ Leaflet), mỗi tile là một GeoJSON FeatureCollection
+được cache trên đĩa. Trình duyệt / reverse proxy cache theo ETag + Last-Modified, nên kéo bản đồ qua lại
+chỉ là các request tile đã cache thay vì tìm kiếm mới theo tâm.
+"""
+import math
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .records import dumps
+from .viewport import fetch_viewport_elements, point_payload
+
+TILE_MIN_ZOOM = getattr(settings, 'TILE_MIN_ZOOM', 16)
+TILE_MAX_ZOOM = getattr(settings, 'TILE_MAX_ZOOM', 19)
+TILE_CACHE_TTL = getattr(settings, 'TILE_CACHE_TTL', 24 * 3600)
+
+
+def tile_cache_dir():
+    return Path(getattr(settings, 'TILE_CACHE_DIR', Path(settings.BASE_DIR).parent / 'data' / 'tiles'))
+
+
+def tile_bounds(z, x, y):
+    """
+    (south, west, north, east) của tile XYZ (Web Mercator).
+    """
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def tile_path(z, x, y):
+    return tile_cache_dir() / str(z) / str(x) / f"{y}.geojson"
+
+
+def build_tile(z, x, y):
+    """
+    GeoJSON bytes của tile; None nếu không lấy được dữ liệu. Zoom thấp hơn TILE_MIN_ZOOM trả về tile rỗng
+    (ở mức đó bản đồ dùng cụm của /api/viewport/).
+    """
+    features = []
+    if z >= TILE_MIN_ZOOM:
+        elements = fetch_viewport_elements(*tile_bounds(z, x, y))
+        if elements is None: return None
+        for e in elements:
+            props = point_payload(e)
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [props.pop('lng'), props.pop('lat')]},
+                'properties': props,
+            })
+    return dumps({'type': 'FeatureCollection', 'features': features})
+
+
+def write_atomic(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def ensure_tile(z, x, y):
+    """
+    Đường dẫn tile đã cache (sinh lại khi quá TILE_CACHE_TTL). Trả về (path, etag, mtime) hoặc None nếu lỗi dữ liệu;
+    raise ValueError nếu tọa độ tile không hợp lệ.
+    """
+    if not (0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError("Tile không hợp lệ")
+    path = tile_path(z, x, y)
+    try:
+        stat = path.stat()
+        fresh = time.time() - stat.st_mtime < TILE_CACHE_TTL
+    except FileNotFoundError:
+        fresh = False
+    if not fresh:
+        content = build_tile(z, x, y)
+        if content is None: return None
+        write_atomic(path, content)
+        stat = path.stat()
+    # ETag kiểu nginx: mtime + kích thước, không phải đọc lại nội dung
+    return path, f'"{int(stat.st_mtime):x}-{stat.st_size:x}"', stat.st_mtime
+
+
+def clear_tiles():
+    """
+    Xóa toàn bộ tile đã cache (ví dụ sau khi build lại chỉ mục POI).
+    """
+    root = tile_cache_dir()
+    if not root.exists(): return 0
+    count = 0
+    for path in root.rglob('*.geojson'):
+        path.unlink(missing_ok=True)
+        count += 1
+    return count
+
+
+def tile_xy(lat, lng, z):
+    n = 2 ** z
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def invalidate_points(points):
+    """
+    Xóa các tile đã cache chứa các điểm (lat, lng) ở mọi zoom có dữ liệu; lần xem sau sẽ sinh lại từ chỉ mục.
+    Trả về số tile đã xóa.
+    """
+    stale = {(z, *tile_xy(lat, lng, z)) for lat, lng in points for z in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1)}
+    count = 0
+    for z, x, y in stale:
+        path = tile_path(z, x, y)
+        if path.exists():
+            path.unlink(missing_ok=True)
+            count += 1
+    return count
@@ -0,0 +1,182 @@
+"""
+Đo thời gian từng chặng của một request (intent, Overpass từng mirror, làm giàu, trả lời, session...).
+span() ghi vào trace của request hiện tại (contextvars, theo cả asyncio task và thread được submit
+qua submit_traced) và vào histogram chung; middleware xuất Server-Timing + một dòng log JSON,
+/metrics xuất dạng Prometheus.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('locator_trace', default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, count, total) in sorted(self._series.items()):
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels(key, [('le', bound)])} {c}")
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total:.6f}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('locator_stage_seconds', "Thời gian từng chặng xử lý (intent, overpass, enrich, answer, session...)")
+REQUEST_SECONDS = Histogram('locator_request_seconds', "Thời gian xử lý request theo route")
+REQUESTS = Counter('locator_requests_total', "Số request theo route và mã trạng thái")
+FALLBACKS = Counter('locator_llm_fallback_total', "Số lần chuyển sang provider LLM kế tiếp, theo chặng và lý do (error, queue_depth, queue_full, deadline)")
+OVERPASS_REQUESTS = Counter('locator_overpass_requests_total', "Request Overpass theo mirror và kết quả")
+
+PROMPT_EVAL_TOKENS = Counter('locator_llm_prompt_eval_tokens_total', "Số token prompt Ollama phải xử lý (không tính phần prefix dùng lại từ KV cache)")
+PROMPT_EVAL_SECONDS = Histogram('locator_llm_prompt_eval_seconds', "Thời gian Ollama xử lý prompt mỗi lệnh gọi")
+ADMISSIONS = Counter('locator_admission_total', "Request được nhận theo nhóm và bậc phục vụ (full, skip_enrich, template_reply)")
+SHED = Counter('locator_admission_shed_total', "Request bị từ chối (503) theo nhóm và lý do (queue_full, timeout)")
+
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, FALLBACKS, OVERPASS_REQUESTS, PROMPT_EVAL_TOKENS, PROMPT_EVAL_SECONDS, ADMISSIONS, SHED]
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, labels):
+        with self._lock:
+            self.spans.append((name, seconds, labels))
+
+    def summary(self):
+        """
+        {tên chặng: (tổng giây, số lần)}, giữ thứ tự xuất hiện đầu tiên.
+        """
+        result = {}
+        with self._lock:
+            for name, seconds, _ in self.spans:
+                total, count = result.get(name, (0.0, 0))
+                result[name] = (total + seconds, count + 1)
+        return result
+
+    def server_timing(self, total_seconds):
+        parts = [f'{name};dur={total * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+                 for name, (total, count) in self.summary().items()]
+        parts.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def start_trace():
+    trace = Trace()
+    return trace, _current.set(trace)
+
+
+def end_trace(token):
+    _current.reset(token)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _current.get()
+        if trace is not None: trace.add(name, elapsed, labels)
+
+
+def traced(name):
+    """
+    Decorator bọc cả hàm (sync hoặc async) trong span(name).
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit_traced(executor, fn, *args, **kwargs):
+    """
+    executor.submit giữ trace của request: thread trong pool chạy trong bản sao context hiện tại.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def render_metrics(extra_lines=()):
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += list(extra_lines)
+    return '\n'.join(lines) + '\n'
@@ -7,7 +7,31 @@ urlpatterns = [
     
     # API Tìm kiếm (đã chạy ổn)
     path('api/search/', views.search_stores_api, name='search_stores_api'),
+
+    # API tìm kiếm hàng loạt nhiều điểm / keyword (gom query Overpass)
+    path('api/search/batch/', views.batch_search_api, name='batch_search_api'),
+
+    # API POI theo khung nhìn bản đồ (cụm ở zoom thấp, điểm phân trang ở zoom cao)
+    path('api/viewport/', views.viewport_api, name='viewport_api'),
+
+    # Tile POI GeoJSON theo lưới XYZ (cache đĩa + ETag)
+    path('tiles/<int:z>/<int:x>/<int:y>.geojson', views.tile_api, name='poi_tile'),
+
+    # API gợi ý vị trí (chỉ mục cục bộ, Nominatim khi không có kết quả)
+    path('api/geocode/', views.geocode_api, name='geocode_api'),
+
+    # Chỉ số Prometheus (độ trễ từng chặng, fallback, cache, circuit breaker)
+    path('metrics', views.metrics_api, name='metrics'),
+
+    # Readiness: chỉ 200 khi model LLM đã được làm nóng
+    path('readyz', views.readiness_api, name='readiness'),
     
     # API Chatbot (BẠN ĐANG THIẾU HOẶC SAI DÒNG NÀY)
     path('api/chat/', views.chat_api, name='chat_api'),
+
+    # API Chatbot async (dùng khi chạy ASGI: uvicorn configs.asgi:application)
+    path('api/chat/async/', views.chat_api_async, name='chat_api_async'),
+
+    # API Chatbot dạng stream (SSE, chỉ dùng trên ASGI)
+    path('api/chat/stream/', views.chat_stream_api, name='chat_stream_api'),
 ]
\ No newline at end of file
@@ -1,30 +1,55 @@
-import requests
 import math
 import random
 import json
-import os
 import logging
-import ollama
-import google.generativeai as genai
+from collections import namedtuple
+from django.conf import settings
+from django.db import close_old_connections
+
+from .cache import DjangoTTLCache, TTLCache
+from .llm_cache import LLM_CACHE
+from .llm_gateway import LLM_GATEWAY, LLMUnavailable, gemini_available
+from .models import PlaceEnrichment
+from .geo import geohash_encode, geohash_decode, haversine_km
+from .overpass import OverpassClient
+from .poi_index import get_poi_index
+from .ranking import rank_elements
+from .records import StoreRecord, intern, shared
+from .tracing import traced
 
 # --- CẤU HÌNH ---
 logger = logging.getLogger('locator')
 
-try:
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-except Exception as e:
-    logger.error(f"Gemini Config Error: {e}")
-
-OVERPASS_SERVERS = [
+OVERPASS_SERVERS = getattr(settings, 'OVERPASS_URLS', None) or [
     "https://overpass.nchc.org.tw/api/interpreter",
-    "https://overpass.kumi.systems/api/interpreter", 
+    "https://overpass.kumi.systems/api/interpreter",
 ]
 
+OVERPASS_CLIENT = OverpassClient(
+    OVERPASS_SERVERS,
+    timeout=getattr(settings, 'OVERPASS_TIMEOUT', 15),
+    hedge_delay=getattr(settings, 'OVERPASS_HEDGE_DELAY', 1.5),
+)
+
+# --- POI CACHE (theo ô geohash) ---
+# Key = (ô geohash, bậc bán kính, keyword). Mỗi entry chứa toàn bộ node quanh tâm ô,
+# nên mọi người dùng trong cùng ô đều dùng chung một lần gọi Overpass.
+POI_CACHE_PRECISION = getattr(settings, 'POI_CACHE_PRECISION', 6)
+POI_CACHE_RADIUS_BUCKETS = getattr(settings, 'POI_CACHE_RADIUS_BUCKETS', (500, 1000, 1500, 3000, 5000))
+POI_CACHE_FETCH_LIMIT = getattr(settings, 'POI_CACHE_FETCH_LIMIT', 400)
+POI_CACHE_TTL = getattr(settings, 'POI_CACHE_TTL', 900)
+if getattr(settings, 'POI_CACHE_BACKEND', 'local') == 'django':
+    # Cache chia sẻ giữa các tiến trình (Redis / file) để warm_cache và mọi worker dùng chung
+    POI_CACHE = DjangoTTLCache(getattr(settings, 'POI_CACHE_ALIAS', 'pois'), ttl=POI_CACHE_TTL, prefix='poi')
+else:
+    POI_CACHE = TTLCache(maxsize=getattr(settings, 'POI_CACHE_MAX_ENTRIES', 2048), ttl=POI_CACHE_TTL)
+KEYWORD_MAX_RESULTS = 15
+
 # --- DATA POOLS (FALLBACK) ---
 REVIEW_TEMPLATES = {
-    'food': ["Đồ ăn ngon, giá ổn.", "Không gian đẹp, check-in tốt.", "Phục vụ hơi chậm xíu.", "Sẽ quay lại lần sau."],
-    'service': ["Dịch vụ chuyên nghiệp.", "Nhân viên nhiệt tình.", "Giá hơi cao nhưng chất lượng tốt."],
-    'fuel': ["Đổ xăng nhanh.", "Trạm rộng rãi.", "Nhân viên thân thiện."]
+    'food': shared(["Đồ ăn ngon, giá ổn.", "Không gian đẹp, check-in tốt.", "Phục vụ hơi chậm xíu.", "Sẽ quay lại lần sau."]),
+    'service': shared(["Dịch vụ chuyên nghiệp.", "Nhân viên nhiệt tình.", "Giá hơi cao nhưng chất lượng tốt."]),
+    'fuel': shared(["Đổ xăng nhanh.", "Trạm rộng rãi.", "Nhân viên thân thiện."])
 }
 
 TAG_MAPPING = {
@@ -38,14 +63,26 @@ TAG_MAPPING = {
     'bank': {'p': ['Giao dịch', 'ATM', 'Tín dụng'], 'd': 'Dịch vụ ngân hàng.', 'type': 'Ngân hàng'},
     'mobile_phone': {'p': ['Sửa màn hình', 'Ép kính', 'Phụ kiện'], 'd': 'Sửa chữa uy tín.', 'type': 'Sửa điện thoại'}
 }
+# Sản phẩm mẫu dùng chung một tuple cho mọi quán cùng loại
+for _template in TAG_MAPPING.values():
+    _template.update({'p': shared(_template['p']), 'd': intern(_template['d']), 'type': intern(_template['type'])})
+
+DEFAULT_TAGS = shared(["Phổ biến"])
+DEFAULT_PRODUCTS = shared(["Sản phẩm dịch vụ"])
+DEFAULT_REVIEWS = shared(["Dịch vụ tốt."])
 
 # --- AI AGENT FUNCTIONS ---
 
-def detect_intent_with_llama(user_message):
-    """
-    Phân tích ý định: Tìm kiếm mới hay Chat thường?
-    """
-    prompt = f"""
+def strip_code_fence(text):
+    return text.replace('```json', '').replace('```', '').strip()
+
+def parse_json_reply(content):
+    start = content.find('{')
+    end = content.rfind('}') + 1
+    return json.loads(content[start:end])
+
+def build_intent_prompt(user_message):
+    return f"""
     You are a Map Assistant. User says: "{user_message}"
     Task: Does the user want to SEARCH for a place type NOT likely in the current list (e.g. "Find gas", "Where is ATM", "Sửa xe")?
     
@@ -55,181 +92,315 @@ def detect_intent_with_llama(user_message):
     
     Reply JSON ONLY.
     """
-    
-    # 1. Thử Ollama
-    try:
-        response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': prompt}])
-        content = response['message']['content']
-        start = content.find('{')
-        end = content.rfind('}') + 1
-        return json.loads(content[start:end])
-    except Exception as e:
-        logger.warning(f"Ollama Intent Error: {e}")
 
-    # 2. Fallback Gemini
+@traced('intent')
+def detect_intent_with_llama(user_message):
+    """
+    Phân tích ý định: Tìm kiếm mới hay Chat thường?
+    """
+    cache_key = LLM_CACHE.key('intent', user_message)
+    cached = LLM_CACHE.get(cache_key)
+    if cached is not None: return dict(cached)
+
+    # Ollama trước, Gemini khi Ollama lỗi / trả về không phải JSON / hàng đợi quá dài
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        return json.loads(response.text.replace('```json', '').replace('```', '').strip())
-    except:
+        intent = LLM_GATEWAY.complete(build_intent_prompt(user_message), parse=parse_json_reply, stage='intent')
+    except LLMUnavailable:
         return {"action": "CHAT"}
+    LLM_CACHE.set(cache_key, intent)
+    return intent
 
-def generate_answer_with_llama(user_message, stores_context):
-    """
-    Trả lời câu hỏi tự nhiên, có cảm xúc và trả về ID quán tốt nhất.
-    """
-    context_list = []
+def build_store_context(stores_context):
     if not stores_context:
-        context_text = "Không tìm thấy địa điểm nào phù hợp."
-    else:
-        # Lấy 5 quán đầu tiên để AI tập trung tư vấn
-        for s in stores_context[:5]:
-            context_list.append(f"ID:{s['id']} | Tên:{s['name']} | Cách:{s['distance']:.2f}km | Loại:{s['type']} | Đặc điểm:{s['description']}")
-        context_text = "\n".join(context_list)
+        return "Không tìm thấy địa điểm nào phù hợp."
+    # Lấy 5 quán đầu tiên để AI tập trung tư vấn
+    context_list = []
+    for s in stores_context[:5]:
+        context_list.append(f"ID:{s.id} | Tên:{s.name} | Cách:{s.distance:.2f}km | Loại:{s.type} | Đặc điểm:{s.description}")
+    return "\n".join(context_list)
 
-    prompt = f"""
+# System prompt cố định (không chứa dữ liệu của request) để mọi lượt chat dùng chung prefix đã cache trong Ollama;
+# dữ liệu quán và câu hỏi đi ở các message sau
+ANSWER_INSTRUCTIONS = """
     Bạn là trợ lý bản đồ thông minh và thân thiện (nói tiếng Việt).
-    
-    DỮ LIỆU CỬA HÀNG XUNG QUANH:
-    {context_text}
-    
-    CÂU HỎI CỦA KHÁCH: "{user_message}"
+    Mỗi lượt bạn nhận DỮ LIỆU CỬA HÀNG XUNG QUANH (khi danh sách thay đổi) và CÂU HỎI CỦA KHÁCH.
     
     YÊU CẦU:
     1. Trả lời tự nhiên, thân thiện như một người bạn địa phương. Đừng quá máy móc.
-    2. Dựa vào dữ liệu trên, hãy chọn ra 1 quán phù hợp nhất để gợi ý.
+    2. Dựa vào dữ liệu cửa hàng mới nhất, hãy chọn ra 1 quán phù hợp nhất để gợi ý.
     3. Giải thích ngắn gọn tại sao bạn chọn quán đó (ví dụ: gần nhất, review tốt...).
     4. Cuối cùng, hãy mời người dùng bấm vào thẻ bên dưới để xem đường đi.
-    
+    """
+
+ANSWER_SYSTEM_PROMPT = ANSWER_INSTRUCTIONS + """
     OUTPUT FORMAT (JSON ONLY):
-    {{
+    {
         "reply": "Lời chào và câu trả lời tự nhiên của bạn...",
         "best_store_id": "ID_CỦA_QUÁN_BẠN_CHỌN" (Hoặc null nếu không có quán nào phù hợp)
-    }}
+    }
     """
-    
-    try:
-        # Ưu tiên Ollama
-        response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': prompt}])
-        content = response['message']['content']
-    except:
-        # Fallback Gemini
-        try:
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(prompt)
-            content = response.text
-        except:
-            return {"reply": "Hệ thống AI đang bận, bạn xem danh sách bên dưới nhé.", "best_store_id": None}
 
+STREAM_BEST_ID_MARKER = "BEST_ID:"
+
+# Chế độ stream: lời thoại dạng văn bản thường (đẩy ra từng token), ID quán ở dòng cuối
+STREAM_ANSWER_SYSTEM_PROMPT = ANSWER_INSTRUCTIONS + f"""
+    OUTPUT FORMAT: Viết câu trả lời dạng văn bản thường (KHÔNG dùng JSON).
+    Dòng cuối cùng ghi đúng dạng: {STREAM_BEST_ID_MARKER} <ID_CỦA_QUÁN_BẠN_CHỌN> (hoặc {STREAM_BEST_ID_MARKER} null nếu không có quán nào phù hợp)
+    """
+
+def build_answer_prompt(user_message, stores_context, conversation=None, stream=False):
+    """
+    list message cho bước trả lời: system prompt cố định, dữ liệu quán, (lịch sử hội thoại), câu hỏi mới.
+    """
+    system = {'role': 'system', 'content': STREAM_ANSWER_SYSTEM_PROMPT if stream else ANSWER_SYSTEM_PROMPT}
+    context = {'role': 'user', 'content': f"DỮ LIỆU CỬA HÀNG XUNG QUANH:\n{build_store_context(stores_context)}"}
+    question = {'role': 'user', 'content': f'CÂU HỎI CỦA KHÁCH: "{user_message}"'}
+    if conversation is None:
+        return [system, context, question]
+    return conversation.messages(system, context, question)
+
+def record_answer(conversation, user_message, stores_context, content):
+    """
+    Ghi lượt vừa trả lời vào hội thoại (cùng dạng message với build_answer_prompt).
+    """
+    messages = build_answer_prompt(user_message, stores_context)
+    conversation.record(messages[1], messages[2], content)
+
+def busy_answer():
+    return {"reply": "Hệ thống AI đang bận, bạn xem danh sách bên dưới nhé.", "best_store_id": None}
+
+def template_answer(stores_context):
+    """
+    Câu trả lời mẫu không cần LLM: gợi ý quán gần nhất (AI trả sai định dạng, hoặc hệ thống quá tải).
+    """
+    if not stores_context: return busy_answer()
+    nearest = min(stores_context, key=lambda s: s.distance if s.distance is not None else float('inf'))
+    return {
+        "reply": "Mình tìm thấy địa điểm này gần bạn nhất, bạn xem thử nhé.",
+        "best_store_id": nearest.id
+    }
+
+def parse_answer(content, stores_context):
     # Parse JSON từ AI
     try:
-        start = content.find('{')
-        end = content.rfind('}') + 1
-        return json.loads(content[start:end])
+        return parse_json_reply(content)
     except:
-        # Nếu AI không trả JSON chuẩn, fallback lấy quán đầu tiên
-        first_id = stores_context[0]['id'] if stores_context else None
-        return {
-            "reply": "Mình tìm thấy địa điểm này gần bạn nhất, bạn xem thử nhé.",
-            "best_store_id": first_id
-        }
-
-def search_specific_stores(lat, lng, keyword, radius=3000):
-    try: lat, lng = float(lat), float(lng)
-    except: return []
+        # Nếu AI không trả JSON chuẩn, fallback gợi ý quán gần nhất
+        return template_answer(stores_context)
 
-    query = f"""
-        [out:json][timeout:15];
-        (
-          node["shop"~"{keyword}",i](around:{radius},{lat},{lng});
-          node["amenity"~"{keyword}",i](around:{radius},{lat},{lng});
-          node["name"~"{keyword}",i](around:{radius},{lat},{lng});
-        );
-        out 15;
+@traced('answer')
+def generate_answer_with_llama(user_message, stores_context, conversation=None):
     """
-    
-    data = fetch_overpass_data(query)
-    if not data or 'elements' not in data: return []
-    
-    elements = data.get('elements', [])
+    Trả lời câu hỏi tự nhiên, có cảm xúc và trả về ID quán tốt nhất.
+    conversation (locator/conversation.py): lượt hỏi tiếp gửi kèm lịch sử và được ghi lại vào hội thoại.
+    """
+    # Câu trả lời cache chỉ đúng cho câu hỏi đầu (chưa có lịch sử)
+    cacheable = conversation is None or conversation.empty
+    cache_key = LLM_CACHE.key('answer', user_message, stores_context)
+    cached = LLM_CACHE.get(cache_key) if cacheable else None
+    if cached is not None:
+        if conversation is not None:
+            record_answer(conversation, user_message, stores_context, json.dumps(cached, ensure_ascii=False))
+            conversation.save()
+        return dict(cached)
+
+    try:
+        content = LLM_GATEWAY.complete(build_answer_prompt(user_message, stores_context, conversation), stage='answer')
+    except LLMUnavailable:
+        return busy_answer()
+
+    answer = parse_answer(content, stores_context)
+    if cacheable: LLM_CACHE.set(cache_key, answer)
+    if conversation is not None:
+        record_answer(conversation, user_message, stores_context, content)
+        conversation.save()
+    return answer
+
+def build_keyword_stores(hits, keyword, max_results=KEYWORD_MAX_RESULTS):
     raw_stores = []
-    
-    for item in elements:
+
+    for distance, item in hits[:max_results]:
         item_lat = item.get('lat')
         item_lon = item.get('lon')
         name = item.get('tags', {}).get('name')
-        if not item_lat or not item_lon or not name: continue
 
         # Dùng keyword làm key để sinh dữ liệu giả lập chính xác
         meta = generate_smart_metadata(name, keyword)
         tags = item.get('tags', {})
 
-        raw_stores.append({
-            'id': str(item.get('id')),
-            'name': name,
-            'type': meta['type_display'],
-            'category_key': keyword,
-            'lat': item_lat,
-            'lng': item_lon,
-            'distance': calculate_distance(lat, lng, item_lat, item_lon),
-            'address': tags.get('addr:street') or "Đang cập nhật địa chỉ",
-            'rating': meta['rating'],
-            'reviews_count': meta['reviews_count'],
-            'open_hour': meta['open_hour'],
-            'products': meta['products'],
-            'description': meta['description'],
-            'tags': meta['tags'],
-            'review_list': meta['review_list']
-        })
-            
-    sorted_stores = sorted(raw_stores, key=lambda x: x['distance'])
-    return enrich_data_with_ai(sorted_stores)
-
-# --- CORE LOGIC ---
+        raw_stores.append(StoreRecord(
+            id=str(item.get('id')),
+            name=name,
+            type=meta['type_display'],
+            category_key=intern(keyword),
+            lat=item_lat,
+            lng=item_lon,
+            distance=distance,
+            address=tags.get('addr:street') or "Đang cập nhật địa chỉ",
+            rating=meta['rating'],
+            reviews_count=meta['reviews_count'],
+            open_hour=meta['open_hour'],
+            products=meta['products'],
+            description=meta['description'],
+            tags=meta['tags'],
+            review_list=meta['review_list']
+        ))
+    return raw_stores
 
-def get_nearby_stores(lat, lng, radius=1500, max_results=12):
+def search_specific_stores(lat, lng, keyword, radius=3000, enrich=True):
     try: lat, lng = float(lat), float(lng)
     except: return []
 
-    query = f"""
-        [out:json][timeout:15];
-        (
-          node["shop"](around:{radius},{lat},{lng});
-          node["amenity"~"cafe|restaurant|fast_food|bar|pub|fuel|bank|pharmacy"](around:{radius},{lat},{lng});
-        );
-        out {max_results};
-    """
-    
-    data = fetch_overpass_data(query)
-    if not data or 'elements' not in data:
-        return generate_mock_data(lat, lng)
-        
-    elements = data.get('elements', [])
+    hits = find_nearby_elements(lat, lng, radius, keyword, limit=KEYWORD_MAX_RESULTS)
+    if not hits: return []
+    stores = build_keyword_stores(hits, keyword)
+    return enrich_data_with_ai(stores) if enrich else stores
+
+# --- CORE LOGIC ---
+
+def build_nearby_stores(hits, max_results=12):
     raw_stores = []
-    
-    for item in elements:
+
+    for distance, item in hits[:max_results]:
         item_lat = item.get('lat')
         item_lon = item.get('lon')
         tags = item.get('tags', {})
         name = tags.get('name')
-        if not item_lat or not item_lon or not name: continue
 
         category_key = tags.get('shop') or tags.get('amenity') or 'unknown'
         meta = generate_smart_metadata(name, category_key)
 
-        raw_stores.append({
-            'id': str(item.get('id')), 'name': name, 'type': meta['type_display'], 'category_key': category_key,
-            'lat': item_lat, 'lng': item_lon, 'distance': calculate_distance(lat, lng, item_lat, item_lon),
-            'address': tags.get('addr:street') or "Đang cập nhật địa chỉ",
-            'rating': meta['rating'], 'reviews_count': meta['reviews_count'], 'open_hour': meta['open_hour'],
-            'products': meta['products'], 'description': meta['description'], 'tags': meta['tags'], 'review_list': meta['review_list']
-        })
-            
-    sorted_stores = sorted(raw_stores, key=lambda x: x['distance'])
-    return enrich_data_with_ai(sorted_stores, limit=8)
+        raw_stores.append(StoreRecord(
+            id=str(item.get('id')), name=name, type=meta['type_display'], category_key=intern(category_key),
+            lat=item_lat, lng=item_lon, distance=distance,
+            address=tags.get('addr:street') or "Đang cập nhật địa chỉ",
+            rating=meta['rating'], reviews_count=meta['reviews_count'], open_hour=meta['open_hour'],
+            products=meta['products'], description=meta['description'], tags=meta['tags'], review_list=meta['review_list']
+        ))
+    return raw_stores
+
+def get_nearby_stores(lat, lng, radius=1500, max_results=12, enrich=True):
+    try: lat, lng = float(lat), float(lng)
+    except: return []
+
+    hits = find_nearby_elements(lat, lng, radius, limit=max_results)
+    if hits is None:
+        return generate_mock_data(lat, lng)
+    stores = build_nearby_stores(hits, max_results)
+    return enrich_data_with_ai(stores, limit=8) if enrich else stores
+
+def overpass_clauses(lat, lng, radius, keyword=None):
+    if keyword:
+        return f"""
+          node["shop"~"{keyword}",i](around:{radius},{lat},{lng});
+          node["amenity"~"{keyword}",i](around:{radius},{lat},{lng});
+          node["name"~"{keyword}",i](around:{radius},{lat},{lng});"""
+    return f"""
+          node["shop"](around:{radius},{lat},{lng});
+          node["amenity"~"cafe|restaurant|fast_food|bar|pub|fuel|bank|pharmacy"](around:{radius},{lat},{lng});"""
+
+def build_overpass_query(lat, lng, radius, keyword=None, limit=POI_CACHE_FETCH_LIMIT, timeout=15):
+    return build_overpass_union_query([(lat, lng, radius)], keyword, limit, timeout)
+
+def build_overpass_union_query(circles, keyword=None, limit=POI_CACHE_FETCH_LIMIT, timeout=15):
+    """
+    Một query Overpass cho nhiều vòng tròn (lat, lng, bán kính m) cùng keyword. Mỗi vòng có lệnh out riêng với
+    `limit` của nó, để một vòng dày đặc không chiếm hết giới hạn của các vòng khác; node ở chỗ giao nhau có thể lặp lại.
+    """
+    body = ''.join(f"""
+        ({overpass_clauses(lat, lng, radius, keyword)}
+        );
+        out {limit};""" for lat, lng, radius in circles)
+    return f"""
+        [out:json][timeout:{timeout}];{body}
+    """
+
+def build_overpass_bbox_query(south, west, north, east, limit=None):
+    bbox = f"{south},{west},{north},{east}"
+    return f"""
+        [out:json][timeout:60];
+        (
+          node["shop"]({bbox});
+          node["amenity"~"cafe|restaurant|fast_food|bar|pub|fuel|bank|pharmacy"]({bbox});
+        );
+        out{f' {limit}' if limit else ''};
+    """
+
+def fetch_elements_in_bbox(south, west, north, east):
+    """
+    Mọi POI có tên trong bounding box: từ chỉ mục cục bộ nếu phủ trọn vùng, không thì hỏi Overpass.
+    Trả về None nếu Overpass lỗi.
+    """
+    index = get_poi_index()
+    if index and index.covers(south, west) and index.covers(north, east):
+        return index.query_around_bbox(south, west, north, east)
+    data = fetch_overpass_data(build_overpass_bbox_query(south, west, north, east))
+    if not data or 'elements' not in data: return None
+    return named_elements(data)
+
+def radius_bucket(radius):
+    for bucket in POI_CACHE_RADIUS_BUCKETS:
+        if radius <= bucket: return bucket
+    return int(math.ceil(radius / 1000.0)) * 1000
+
+TileMiss = namedtuple('TileMiss', 'key query lat lng radius keyword limit')
+
+def lookup_nearby_elements(lat, lng, radius, keyword=None, limit=None):
+    """
+    Tra chỉ mục POI cục bộ rồi cache ô geohash, không gọi mạng.
+    Trả về (hits, None) nếu đã có dữ liệu, hoặc (None, TileMiss) chứa query Overpass cần gửi.
+    """
+    index = get_poi_index()
+    if index and index.covers(lat, lng):
+        return rank_elements(lat, lng, radius, index.query_around(lat, lng, radius, keyword), limit, keyword), None
+
+    miss = tile_request(lat, lng, radius, keyword, limit)
+    elements = POI_CACHE.get(miss.key)
+    if elements is not None:
+        return rank_elements(lat, lng, radius, elements, limit, keyword), None
+    return None, miss
+
+def tile_request(lat, lng, radius, keyword=None, limit=None):
+    """
+    Key cache ô geohash chứa (lat, lng) và query Overpass để lấp ô đó (dùng chung cho request và warm_cache).
+    """
+    cell = geohash_encode(lat, lng, POI_CACHE_PRECISION)
+    bucket = radius_bucket(radius)
+    key = (cell, bucket, (keyword or '*').lower())
+    query = build_overpass_query(*tile_circle(key), keyword)
+    return TileMiss(key, query, lat, lng, radius, keyword, limit)
+
+def tile_circle(key):
+    """
+    (lat, lng, bán kính m) mà query của ô phủ: quanh tâm ô, bán kính nới thêm nửa đường chéo ô để phủ mọi điểm trong ô.
+    """
+    cell, bucket = key[0], key[1]
+    c_lat, c_lng, half_lat, half_lng = geohash_decode(cell)
+    margin = haversine_km(c_lat, c_lng, c_lat + half_lat, c_lng + half_lng) * 1000
+    return c_lat, c_lng, int(bucket + margin)
+
+def named_elements(data):
+    return [e for e in data['elements'] if e.get('lat') and e.get('lon') and e.get('tags', {}).get('name')]
+
+def fill_tile(miss, data):
+    if not data or 'elements' not in data: return None
+    elements = named_elements(data)
+    POI_CACHE.set(miss.key, elements)
+    return rank_elements(miss.lat, miss.lng, miss.radius, elements, miss.limit, miss.keyword)
+
+def find_nearby_elements(lat, lng, radius, keyword=None, limit=None):
+    """
+    Lấy node OSM quanh (lat, lng): ưu tiên chỉ mục POI cục bộ, sau đó cache ô geohash, cuối cùng mới gọi Overpass.
+    Trả về list (khoảng cách km, element) đã lọc theo bán kính và sắp xếp theo tọa độ chính xác,
+    Có limit thì chỉ giữ limit ứng viên tốt nhất (xem ranking.rank_elements); None nếu không gọi được Overpass.
+    """
+    hits, miss = lookup_nearby_elements(lat, lng, radius, keyword, limit)
+    if miss:
+        hits = fill_tile(miss, fetch_overpass_data(miss.query))
+    return hits
 
 def generate_smart_metadata(name, category_key):
-    meta = {'rating': round(random.uniform(4.0, 5.0), 1), 'reviews_count': random.randint(10, 150), 'tags': ["Phổ biến"]}
+    meta = {'rating': round(random.uniform(4.0, 5.0), 1), 'reviews_count': random.randint(10, 150), 'tags': DEFAULT_TAGS}
     
     if 'mobile' in category_key or 'phone' in category_key: template = TAG_MAPPING.get('mobile_phone')
     elif 'fuel' in category_key or 'gas' in category_key: template = TAG_MAPPING.get('fuel')
@@ -237,54 +408,89 @@ def generate_smart_metadata(name, category_key):
 
     if template:
         meta.update({'products': template['p'], 'description': template['d'], 'type_display': template['type']})
-        if category_key in ['cafe', 'bar']: meta['open_hour'] = "07:00 - 23:00"
-        elif category_key in ['convenience', 'fuel']: meta['open_hour'] = "24/7"
-        else: meta['open_hour'] = "08:00 - 21:00"
+        if category_key in ['cafe', 'bar']: meta['open_hour'] = intern("07:00 - 23:00")
+        elif category_key in ['convenience', 'fuel']: meta['open_hour'] = intern("24/7")
+        else: meta['open_hour'] = intern("08:00 - 21:00")
         pool = 'fuel' if 'fuel' in category_key else ('food' if 'cafe' in category_key else 'service')
-        meta['review_list'] = random.sample(REVIEW_TEMPLATES.get(pool, REVIEW_TEMPLATES['service']), 2)
+        meta['review_list'] = tuple(random.sample(REVIEW_TEMPLATES.get(pool, REVIEW_TEMPLATES['service']), 2))
     else:
-        meta.update({'products': ["Sản phẩm dịch vụ"], 'description': f"Địa điểm {name}.", 'type_display': "Cửa hàng", 'open_hour': "08:00 - 21:00", 'review_list': ["Dịch vụ tốt."]})
+        meta.update({'products': DEFAULT_PRODUCTS, 'description': f"Địa điểm {name}.", 'type_display': intern("Cửa hàng"), 'open_hour': intern("08:00 - 21:00"), 'review_list': DEFAULT_REVIEWS})
     return meta
 
-def enrich_data_with_ai(stores, limit=8):
-    if not stores or not os.getenv("GEMINI_API_KEY"): return stores
-    try:
-        mini_list = [{"id": s['id'], "n": s['name'], "cat": s['category_key']} for s in stores[:limit]]
-        prompt = f"""
+def build_enrich_prompt(stores, limit=8):
+    mini_list = [{"id": s.id, "n": s.name, "cat": s.category_key} for s in stores[:limit]]
+    return f"""
         Generate JSON data. Input: {json.dumps(mini_list)}
         Rules: IF 'fuel' -> products=fuel types.
         Output JSON Key=ID: {{ "r": 4.5, "rv": 50, "o": "07:00-22:00", "p": ["Item1", "Item2"], "d": "Desc", "rv_txt": ["Review1", "Review2"] }}
         JSON Only.
         """
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        ai_data = json.loads(response.text.replace('```json', '').replace('```', '').strip())
-        for s in stores:
-            if str(s['id']) in ai_data:
-                d = ai_data[str(s['id'])]
-                s.update({'rating': d.get('r', s['rating']), 'reviews_count': d.get('rv', s['reviews_count']), 'open_hour': d.get('o', s['open_hour']), 'products': d.get('p', s['products']), 'description': d.get('d', s['description']), 'review_list': d.get('rv_txt', s['review_list'])})
-    except: pass
+
+def parse_enrichment(text):
+    return json.loads(strip_code_fence(text))
+
+def apply_enrichment(stores, ai_data):
+    for s in stores:
+        if s.id in ai_data:
+            d = ai_data[s.id]
+            s.rating, s.reviews_count, s.open_hour = d.get('r', s.rating), d.get('rv', s.reviews_count), d.get('o', s.open_hour)
+            s.products, s.description, s.review_list = d.get('p', s.products), d.get('d', s.description), d.get('rv_txt', s.review_list)
+    return stores
+
+def osm_ids(stores):
+    # Bỏ qua dữ liệu giả lập (id "mock_*")
+    return [int(s.id) for s in stores if s.id.isdigit()]
+
+def apply_stored_enrichment(stores, records):
+    """
+    Áp dữ liệu đã lưu lên các quán; trả về các quán OSM chưa có dữ liệu.
+    """
+    by_id = {str(r.osm_id): r for r in records}
+    missing = []
+    for s in stores:
+        record = by_id.get(s.id)
+        if record: record.apply_to(s)
+        elif s.id.isdigit(): missing.append(s)
+    return missing
+
+def enrichment_records(stores, ai_data):
+    return [PlaceEnrichment.from_store(s) for s in stores if s.id in ai_data]
+
+def save_enrichment_kwargs():
+    return {'update_conflicts': True, 'unique_fields': ['osm_id'], 'update_fields': list(PlaceEnrichment.ENRICHED_FIELDS) + ['name', 'category_key', 'updated_at']}
+
+def run_closing_connections(fn, *args, **kwargs):
+    """
+    Chạy fn trong thread của pool (sống suốt tiến trình): đóng kết nối DB cũ trước và sau như một request của Django,
+    để mỗi thread không giữ kết nối riêng mãi mãi.
+    """
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+@traced('enrich')
+def enrich_data_with_ai(stores, limit=8):
+    """
+    Làm giàu `limit` quán đầu: đọc PlaceEnrichment theo lô, chỉ gửi các ID còn thiếu lên Gemini (một lần gọi)
+    rồi ghi kết quả lại để lần sau không phải gọi nữa.
+    """
+    if not stores: return stores
+    targets = stores[:limit]
+    try:
+        missing = apply_stored_enrichment(targets, PlaceEnrichment.objects.filter(osm_id__in=osm_ids(targets)))
+        if missing and gemini_available():
+            ai_data = LLM_GATEWAY.complete(build_enrich_prompt(missing, len(missing)), parse=parse_enrichment,
+                                           providers=('gemini',), stage='enrich')
+            apply_enrichment(missing, ai_data)
+            PlaceEnrichment.objects.bulk_create(enrichment_records(missing, ai_data), **save_enrichment_kwargs())
+    except Exception as e:
+        logger.warning(f"Enrichment Error: {e}")
     return stores
 
 def fetch_overpass_data(query):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': 'https://www.google.com/'
-    }
-    
-    for url in OVERPASS_SERVERS:
-        try:
-            logger.debug(f"Connecting to: {url}")
-            r = requests.get(url, params={'data': query}, headers=headers, timeout=15)
-            
-            if r.status_code == 200:
-                ctype = r.headers.get('Content-Type', '').lower()
-                if 'json' in ctype:
-                    return r.json()
-        except Exception: 
-            continue
-            
-    return None
+    return OVERPASS_CLIENT.fetch(query)
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     try:
@@ -302,10 +508,11 @@ def generate_mock_data(lat, lng):
     for i, (name, stype) in enumerate(bases):
         key = 'fuel' if 'xăng' in stype else ('cafe' if 'Cafe' in stype else 'restaurant')
         meta = generate_smart_metadata(name, key)
-        results.append({
-            'id': f"mock_{i}", 'name': name, 'type': stype, 'category_key': key,
-            'lat': lat + 0.001*(i+1), 'lng': lng + 0.001*(i+1),
-            'distance': 0.1 * (i+1), 'address': "Vị trí giả lập (Mất kết nối API)",
-            **meta 
-        })
-    return sorted(results, key=lambda x: x['distance'])
\ No newline at end of file
+        results.append(StoreRecord(
+            id=f"mock_{i}", name=name, type=stype, category_key=key,
+            lat=lat + 0.001*(i+1), lng=lng + 0.001*(i+1),
+            distance=0.1 * (i+1), address="Vị trí giả lập (Mất kết nối API)",
+            rating=meta['rating'], reviews_count=meta['reviews_count'], open_hour=meta['open_hour'],
+            products=meta['products'], description=meta['description'], tags=meta['tags'], review_list=meta['review_list']
+        ))
+    return sorted(results, key=lambda x: x.distance)
\ No newline at end of file
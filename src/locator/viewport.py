@@ -0,0 +1,143 @@
+"""
+POI theo khung nhìn bản đồ: zoom thấp trả về cụm gom theo lưới (tính ở server), zoom cao trả về từng điểm
+có phân trang bằng cursor. Dữ liệu lấy từ chỉ mục POI cục bộ; không có thì hỏi Overpass theo ô lưới cố định
+(cache từng ô) để kéo bản đồ qua lại không sinh thêm request.
+"""
+import base64
+import math
+
+from django.conf import settings
+
+from .poi_index import get_poi_index
+from .utils import POI_CACHE, build_overpass_bbox_query, fetch_overpass_data
+
+VIEWPORT_TILE_DEG = getattr(settings, 'VIEWPORT_TILE_DEG', 0.01)
+VIEWPORT_MAX_SPAN_DEG = getattr(settings, 'VIEWPORT_MAX_SPAN_DEG', 0.3)
+VIEWPORT_CLUSTER_MAX_ZOOM = getattr(settings, 'VIEWPORT_CLUSTER_MAX_ZOOM', 16)
+VIEWPORT_CLUSTER_PX = getattr(settings, 'VIEWPORT_CLUSTER_PX', 60)
+VIEWPORT_PAGE_SIZE = getattr(settings, 'VIEWPORT_PAGE_SIZE', 300)
+
+
+class ViewportTooLarge(ValueError):
+    pass
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor: return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii'))
+    except ValueError:
+        raise ValueError("cursor không hợp lệ")
+
+
+def tile_range(south, west, north, east):
+    size = VIEWPORT_TILE_DEG
+    return (range(math.floor(south / size), math.floor(north / size) + 1),
+            range(math.floor(west / size), math.floor(east / size) + 1))
+
+
+def fetch_viewport_elements(south, west, north, east):
+    """
+    Element OSM trong bbox. Trả về None nếu Overpass lỗi, raise ViewportTooLarge nếu vùng quá rộng
+    (cả khi có chỉ mục cục bộ: bbox cả thành phố sẽ kéo toàn bộ POI vào bộ nhớ chỉ để gom cụm).
+    """
+    if north - south > VIEWPORT_MAX_SPAN_DEG or east - west > VIEWPORT_MAX_SPAN_DEG:
+        raise ViewportTooLarge("Vùng quá rộng, hãy phóng to bản đồ.")
+    index = get_poi_index()
+    if index and index.covers(south, west) and index.covers(north, east):
+        return index.query_around_bbox(south, west, north, east)
+
+    rows, cols = tile_range(south, west, north, east)
+    tiles = {(i, j): POI_CACHE.get(('viewport', i, j)) for i in rows for j in cols}
+    missing = [key for key, elements in tiles.items() if elements is None]
+    if missing:
+        # Một query Overpass cho hình chữ nhật bao các ô còn thiếu, rồi chia lại theo ô
+        size = VIEWPORT_TILE_DEG
+        i0, i1 = min(i for i, _ in missing), max(i for i, _ in missing)
+        j0, j1 = min(j for _, j in missing), max(j for _, j in missing)
+        data = fetch_overpass_data(build_overpass_bbox_query(i0 * size, j0 * size, (i1 + 1) * size, (j1 + 1) * size))
+        if not data or 'elements' not in data: return None
+        fetched = {key: [] for key in missing}
+        for e in data['elements']:
+            if not (e.get('lat') and e.get('lon') and e.get('tags', {}).get('name')): continue
+            key = (math.floor(e['lat'] / size), math.floor(e['lon'] / size))
+            if key in fetched: fetched[key].append(e)
+        for key, elements in fetched.items():
+            POI_CACHE.set(('viewport',) + key, elements)
+        tiles.update(fetched)
+
+    return [e for elements in tiles.values() for e in elements
+            if south <= e['lat'] <= north and west <= e['lon'] <= east]
+
+
+def point_payload(e):
+    tags = e.get('tags', {})
+    return {'id': str(e['id']), 'name': tags.get('name'), 'lat': e['lat'], 'lng': e['lon'],
+            'category_key': tags.get('shop') or tags.get('amenity') or 'unknown'}
+
+
+def cluster_cell_deg(zoom, lat):
+    # Cạnh ô lưới ~VIEWPORT_CLUSTER_PX pixel ở mức zoom hiện tại (Web Mercator, 256px/tile)
+    lng_deg = VIEWPORT_CLUSTER_PX * 360.0 / (256 * 2 ** zoom)
+    return lng_deg * math.cos(math.radians(lat)), lng_deg
+
+
+def grid_cluster(elements, zoom, lat):
+    """
+    Gom element theo ô lưới pixel: mỗi cụm có số lượng, tâm (trung bình tọa độ), bbox và loại phổ biến nhất.
+    Ô chỉ có một điểm thì trả về như điểm đơn.
+    """
+    lat_deg, lng_deg = cluster_cell_deg(zoom, lat)
+    cells = {}
+    for e in elements:
+        cells.setdefault((math.floor(e['lat'] / lat_deg), math.floor(e['lon'] / lng_deg)), []).append(e)
+
+    clusters, points = [], []
+    for members in cells.values():
+        if len(members) == 1:
+            points.append(point_payload(members[0]))
+            continue
+        lats = [e['lat'] for e in members]
+        lngs = [e['lon'] for e in members]
+        counts = {}
+        for e in members:
+            key = e.get('tags', {}).get('shop') or e.get('tags', {}).get('amenity') or 'unknown'
+            counts[key] = counts.get(key, 0) + 1
+        clusters.append({
+            'count': len(members),
+            'lat': sum(lats) / len(lats), 'lng': sum(lngs) / len(lngs),
+            'bbox': [min(lats), min(lngs), max(lats), max(lngs)],
+            'top_category': max(counts, key=counts.get),
+        })
+    clusters.sort(key=lambda c: -c['count'])
+    return clusters, points
+
+
+def viewport_payload(south, west, north, east, zoom, cursor=None, page_size=VIEWPORT_PAGE_SIZE):
+    """
+    zoom < VIEWPORT_CLUSTER_MAX_ZOOM: {'mode': 'clusters', 'clusters', 'points', 'total'}.
+    Ngược lại: {'mode': 'points', 'points', 'total', 'next_cursor'} với điểm sắp theo id, trang sau bắt đầu sau cursor.
+    """
+    elements = fetch_viewport_elements(south, west, north, east)
+    if elements is None: return None
+
+    if zoom < VIEWPORT_CLUSTER_MAX_ZOOM:
+        clusters, points = grid_cluster(elements, zoom, (south + north) / 2)
+        return {'mode': 'clusters', 'clusters': clusters, 'points': points, 'total': len(elements)}
+
+    after = decode_cursor(cursor)
+    ordered = sorted(elements, key=lambda e: int(e['id']))
+    if after is not None:
+        ordered = [e for e in ordered if int(e['id']) > after]
+    page = ordered[:page_size]
+    has_more = len(ordered) > page_size
+    return {
+        'mode': 'points',
+        'points': [point_payload(e) for e in page],
+        'total': len(elements),
+        'next_cursor': encode_cursor(page[-1]['id']) if has_more else None,
+    }
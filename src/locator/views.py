@@ -1,15 +1,49 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from .utils import get_nearby_stores, detect_intent_with_llama, search_specific_stores, generate_answer_with_llama
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from .utils import get_nearby_stores, template_answer
+from .async_utils import aenrich_data_with_ai, astream_answer_with_llama
+from .pipeline import run_chat_turn, arun_chat_turn, aresolve_turn
+from .result_store import save_results, load_results, asave_results, aload_results
+from .records import dumps, json_response
+from .viewport import viewport_payload
+from .tiles import TILE_CACHE_TTL, TILE_MIN_ZOOM, ensure_tile
+from .geocoder import geocode
+from . import metrics, warmup
+from .batch import batch_search, parse_queries
+from .admission import TEMPLATE_REPLY, admit
+from .conversation import Conversation
+import asyncio
 import json
 import logging
 
 logger = logging.getLogger('locator')
 
 def index(request):
-    return render(request, 'locator/index.html')
+    # Chạy trên ASGI thì frontend dùng endpoint chat async + stream (WSGI sẽ gom cả stream lại mới gửi)
+    is_asgi = isinstance(request, ASGIRequest)
+    return render(request, 'locator/index.html', {
+        'chat_url': reverse('chat_api_async' if is_asgi else 'chat_api'),
+        'chat_stream_url': reverse('chat_stream_api') if is_asgi else '',
+        'viewport_url': reverse('viewport_api'),
+        'tile_url': reverse('poi_tile', kwargs={'z': 0, 'x': 0, 'y': 0}).replace('0/0/0', '{z}/{x}/{y}'),
+        'tile_min_zoom': TILE_MIN_ZOOM,
+        'geocode_url': reverse('geocode_api'),
+    })
 
+def find_store(stores, store_id):
+    if not store_id: return None
+    for s in stores:
+        if s.id == store_id:
+            return s
+    return None
+
+@admit('search')
 def search_stores_api(request):
     try:
         lat = request.GET.get('lat')
@@ -18,20 +52,122 @@ def search_stores_api(request):
         if not lat or not lng:
             return JsonResponse({'status': 'error', 'message': 'Thiếu tọa độ'}, status=400)
 
-        # 1. Search Default
-        stores = get_nearby_stores(lat, lng)
-        
-        # 2. Save Session
-        request.session['current_stores'] = stores
-        request.session['user_location'] = {'lat': float(lat), 'lng': float(lng)}
-        
-        return JsonResponse({'status': 'success', 'stores': stores})
+        # 1. Search Default (quá tải thì bỏ làm giàu dữ liệu)
+        stores = get_nearby_stores(lat, lng, enrich=request.admission.enrich)
+        user_loc = {'lat': float(lat), 'lng': float(lng)}
+
+        # 2. Save Session (chỉ giữ result_id, danh sách quán nằm trong kho kết quả)
+        result_id = save_results(stores)
+        request.session['result_id'] = result_id
+        request.session['user_location'] = user_loc
+
+        # Cùng tập kết quả với người khác -> trả về bản đang dùng chung để chat khớp với danh sách hiển thị
+        return json_response({'status': 'success', 'stores': load_results(result_id, user_loc) or stores})
 
     except Exception as e:
         logger.error(f"Search API Error: {e}")
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 @csrf_exempt
+@admit('search')
+def batch_search_api(request):
+    """
+    POST {"queries": [{"lat", "lng", "keyword"?, "radius"?, "limit"?}, ...]}
+    -> {"results": [{"query", "stores"[, "error"]}, ...]} theo đúng thứ tự queries. Không ghi session.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Chỉ hỗ trợ POST'}, status=405)
+    try:
+        queries = parse_queries(json.loads(request.body).get('queries'))
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    try:
+        results = batch_search(queries, enrich=request.admission.enrich)
+    except Exception as e:
+        logger.error(f"Batch Search API Error: {e}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+    return json_response({
+        'status': 'success',
+        'results': [{'query': q._asdict(), **r} for q, r in zip(queries, results)],
+    })
+
+def viewport_api(request):
+    """
+    POI trong khung nhìn: ?south=&west=&north=&east=&zoom=[&cursor=]
+    Zoom thấp trả về cụm, zoom cao trả về từng điểm theo trang (next_cursor).
+    """
+    try:
+        south, west, north, east = (float(request.GET[k]) for k in ('south', 'west', 'north', 'east'))
+        zoom = int(request.GET.get('zoom', 14))
+    except (KeyError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Thiếu hoặc sai tham số khung nhìn'}, status=400)
+    if south >= north or west >= east:
+        return JsonResponse({'status': 'error', 'message': 'Khung nhìn không hợp lệ'}, status=400)
+
+    try:
+        payload = viewport_payload(south, west, north, east, zoom, request.GET.get('cursor'))
+    except ValueError as e:
+        # Cursor sai hoặc vùng quá rộng (ViewportTooLarge)
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if payload is None:
+        return JsonResponse({'status': 'error', 'message': 'Không lấy được dữ liệu bản đồ'}, status=502)
+    return json_response({'status': 'success', **payload})
+
+def tile_api(request, z, x, y):
+    """
+    Tile POI GeoJSON /tiles/<z>/<x>/<y>.geojson, cache trên đĩa; hỗ trợ If-None-Match / If-Modified-Since (304).
+    """
+    try:
+        tile = ensure_tile(z, x, y)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+    if tile is None:
+        return JsonResponse({'status': 'error', 'message': 'Không lấy được dữ liệu bản đồ'}, status=502)
+
+    path, etag, mtime = tile
+    response = get_conditional_response(request, etag=etag, last_modified=int(mtime))
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type='application/geo+json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    patch_cache_control(response, public=True, max_age=TILE_CACHE_TTL)
+    return response
+
+def geocode_api(request):
+    """
+    Gợi ý vị trí khi gõ: ?q=&limit= -> [{display_name, lat, lon, kind, source}].
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 5)), 1), 10)
+    except ValueError:
+        limit = 5
+    if len(query) < 2:
+        return json_response({'status': 'success', 'results': []})
+    return json_response({'status': 'success', 'results': geocode(query, limit)})
+
+def metrics_api(request):
+    """
+    Chỉ số dạng Prometheus. METRICS_ALLOWED_IPS (nếu đặt) giới hạn IP được scrape.
+    """
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponse(status=404)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def readiness_api(request):
+    """
+    Readiness probe cho load balancer: 200 khi model LLM đã nạp xong (locator/warmup.py), 503 khi đang làm nóng.
+    """
+    ready, state = warmup.readiness()
+    response = JsonResponse({'status': 'ready' if ready else 'warming', **state}, status=200 if ready else 503)
+    # Probe gọi liên tục khi đang làm nóng: không để django.request ghi mỗi lần 503 thành log ERROR
+    response._has_been_logged = True
+    return response
+
+@csrf_exempt
+@admit('chat')
 def chat_api(request):
     if request.method == 'POST':
         try:
@@ -39,39 +175,23 @@ def chat_api(request):
             user_msg = data.get('message', '')
             
             # Load Context
-            current_stores = request.session.get('current_stores', [])
             user_loc = request.session.get('user_location')
+            current_stores = load_results(request.session.get('result_id'), user_loc)
+
+            # 1. DETECT INTENT -> 2. SEARCH NEW (If needed) -> 3. GENERATE ANSWER (JSON {reply, best_store_id})
+            conversation = Conversation.for_session(request.session)
+            action_type, current_stores, ai_result = run_chat_turn(user_msg, current_stores, user_loc, request.admission.level, conversation)
+            if action_type == "update_map":
+                request.session['result_id'] = save_results(current_stores, replace=True)
 
-            # 1. DETECT INTENT
-            intent = detect_intent_with_llama(user_msg)
-            action_type = "chat"
-            
-            # 2. SEARCH NEW (If needed)
-            if intent.get('action') == 'SEARCH' and user_loc:
-                keyword = intent.get('keyword')
-                new_stores = search_specific_stores(user_loc['lat'], user_loc['lng'], keyword)
-                
-                if new_stores:
-                    request.session['current_stores'] = new_stores
-                    current_stores = new_stores
-                    action_type = "update_map"
-            
-            # 3. GENERATE ANSWER (Returns JSON {reply, best_store_id})
-            ai_result = generate_answer_with_llama(user_msg, current_stores)
-            
             # Extract Data
             reply_text = ai_result.get('reply', 'Hệ thống bận.')
             best_store_id = ai_result.get('best_store_id')
 
             # Find Best Store Object
-            suggested_store = None
-            if best_store_id:
-                for s in current_stores:
-                    if s['id'] == best_store_id:
-                        suggested_store = s
-                        break
-            
-            return JsonResponse({
+            suggested_store = find_store(current_stores, best_store_id)
+
+            return json_response({
                 'status': 'success', 
                 'reply': reply_text,
                 'action': action_type,
@@ -83,4 +203,114 @@ def chat_api(request):
             logger.error(f"Chat API Error: {e}")
             return JsonResponse({'status': 'error', 'message': "Lỗi xử lý chat."}, status=500)
             
-    return JsonResponse({'status': 'error'}, status=405)
\ No newline at end of file
+    return JsonResponse({'status': 'error'}, status=405)
+
+@csrf_exempt
+@admit('chat')
+async def chat_api_async(request):
+    """
+    Bản async của chat_api cho ASGI: mỗi lượt chat chờ LLM/Overpass mà không giữ thread worker.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    try:
+        data = json.loads(request.body)
+        user_msg = data.get('message', '')
+
+        user_loc = await request.session.aget('user_location')
+        current_stores = await aload_results(await request.session.aget('result_id'), user_loc)
+
+        conversation = await Conversation.afor_session(request.session)
+        action_type, current_stores, ai_result = await arun_chat_turn(user_msg, current_stores, user_loc, request.admission.level, conversation)
+        if action_type == "update_map":
+            await request.session.aset('result_id', await asave_results(current_stores, replace=True))
+
+        return json_response({
+            'status': 'success',
+            'reply': ai_result.get('reply', 'Hệ thống bận.'),
+            'action': action_type,
+            'new_data': current_stores,
+            'suggested_store': find_store(current_stores, ai_result.get('best_store_id'))
+        })
+
+    except Exception as e:
+        logger.error(f"Async Chat API Error: {e}")
+        return JsonResponse({'status': 'error', 'message': "Lỗi xử lý chat."}, status=500)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+@csrf_exempt
+@admit('chat')
+async def chat_stream_api(request):
+    """
+    Chat dạng Server-Sent Events: `stores` ngay khi tìm kiếm xong, `token` theo từng đoạn câu trả lời,
+    cuối cùng `done` kèm best_store_id (và danh sách đã làm giàu nếu có tìm kiếm mới).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    try:
+        user_msg = json.loads(request.body).get('message', '')
+    except (ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': "Dữ liệu không hợp lệ."}, status=400)
+
+    user_loc = await request.session.aget('user_location')
+    current_stores = await aload_results(await request.session.aget('result_id'), user_loc)
+    # Trước khi gửi header: conversation_id mới phải vào được cookie session
+    conversation = await Conversation.afor_session(request.session)
+
+    # Intent + tìm kiếm chạy trước khi gửi header để result_id mới vào được cookie session;
+    # sự kiện đầu tiên của stream chính là danh sách quán nên không làm chậm byte đầu tiên.
+    ticket = request.admission
+    try:
+        action_type, stores = await aresolve_turn(user_msg, current_stores, user_loc, ticket.level)
+    except Exception as e:
+        logger.error(f"Chat Stream Error: {e}")
+        return JsonResponse({'status': 'error', 'message': "Lỗi xử lý chat."}, status=500)
+    if action_type == "update_map":
+        await request.session.aset('result_id', await asave_results(stores))
+
+    async def events():
+        nonlocal stores
+        try:
+            enrichment = None
+            answer_context = stores
+            if action_type == "update_map":
+                yield sse_event('stores', {'action': action_type, 'stores': stores})
+                if ticket.enrich:
+                    # Làm giàu chạy song song với stream câu trả lời (câu trả lời dùng bản chụp)
+                    answer_context = [s.copy() for s in stores]
+                    enrichment = asyncio.create_task(aenrich_data_with_ai(stores))
+
+            best_store_id = None
+            if ticket.level >= TEMPLATE_REPLY:
+                answer = template_answer(stores)
+                yield sse_event('token', {'text': answer['reply']})
+                best_store_id = answer['best_store_id']
+            else:
+                async for kind, value in astream_answer_with_llama(user_msg, answer_context, conversation):
+                    if kind == 'token':
+                        yield sse_event('token', {'text': value})
+                    else:
+                        best_store_id = value
+
+            if enrichment:
+                # Cùng tập ID -> cùng result_id, chỉ cần ghi đè nội dung trong kho kết quả
+                stores = await enrichment
+                await asave_results(stores, replace=True)
+
+            yield sse_event('done', {
+                'action': action_type,
+                'best_store_id': best_store_id,
+                'suggested_store': find_store(stores, best_store_id),
+                'new_data': stores if enrichment else None,
+            })
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}")
+            yield sse_event('error', {'message': "Lỗi xử lý chat."})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
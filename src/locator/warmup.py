@@ -0,0 +1,126 @@
+"""
+Làm nóng model khi tiến trình phục vụ request khởi động (LocatorConfig.ready): tạo sẵn client Ollama/Gemini,
+nạp và ghim llama3 trong Ollama (keep_alive), chạy một prompt mồi. Sau đó định kỳ kiểm tra model còn được nạp
+(Ollama khởi động lại thì nạp lại). /readyz chỉ trả 200 khi các model đã nóng.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .llm_gateway import OLLAMA_KEEP_ALIVE, OLLAMA_MODEL, OLLAMA_OPTIONS, gemini_available, gemini_model, ollama_client
+
+logger = logging.getLogger('locator')
+
+# 'pending' -> 'ready' | 'error'; 'disabled' = không dùng (không có key / tắt làm nóng)
+STATE = {'ollama': 'disabled', 'gemini': 'disabled'}
+_errors = {}
+_lock = threading.Lock()
+_started = False
+
+READY_STATES = ('ready', 'disabled')
+
+
+def _set(name, status, error=None):
+    with _lock:
+        STATE[name] = status
+        if error: _errors[name] = str(error)
+        else: _errors.pop(name, None)
+
+
+# Chương trình chạy server; tiến trình khác (pytest, celery, shell, cron...) không làm nóng
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi')
+
+
+def program_name(argv):
+    # "python -m gunicorn" có argv[0] là .../gunicorn/__main__.py
+    path = argv[0] if argv else ''
+    name = os.path.basename(path)
+    if name == '__main__.py': name = os.path.basename(os.path.dirname(path))
+    return name.split('.')[0]
+
+
+def serving_process():
+    """
+    True nếu tiến trình này sẽ phục vụ request: SERVER_PROGRAMS, hoặc manage.py runserver (với autoreloader thì chỉ
+    tiến trình con RUN_MAIN). Server khác (mod_wsgi...) đặt biến môi trường LOCATOR_SERVING=1.
+    """
+    if os.environ.get('LOCATOR_SERVING') == '1':
+        return True
+    argv = sys.argv
+    name = program_name(argv)
+    if name == 'manage':
+        return len(argv) > 1 and argv[1] == 'runserver' and ('--noreload' in argv or os.environ.get('RUN_MAIN') == 'true')
+    return name in SERVER_PROGRAMS
+
+
+def warm_ollama():
+    from .utils import build_answer_prompt, build_intent_prompt
+    client = ollama_client()
+    # messages rỗng = chỉ nạp model (cùng num_ctx với lệnh gọi thật); rồi chạy prompt intent thật (ngắn),
+    # cuối cùng là system prompt trả lời để prefix dùng chung của mọi lượt chat có sẵn trong KV cache
+    client.chat(model=OLLAMA_MODEL, messages=[], keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS)
+    client.chat(model=OLLAMA_MODEL, messages=[{'role': 'user', 'content': build_intent_prompt("xin chào")}],
+                keep_alive=OLLAMA_KEEP_ALIVE, options={**OLLAMA_OPTIONS, 'num_predict': 8})
+    client.chat(model=OLLAMA_MODEL, messages=build_answer_prompt("xin chào", []),
+                keep_alive=OLLAMA_KEEP_ALIVE, options={**OLLAMA_OPTIONS, 'num_predict': 1})
+
+
+def ollama_loaded():
+    models = ollama_client().ps().get('models') or []
+    return any((m.get('model') or m.get('name') or '').split(':')[0] == OLLAMA_MODEL for m in models)
+
+
+def warm_gemini():
+    # Chỉ dựng sẵn client; không bắn prompt mồi lên Gemini (tính phí, không có model cần nạp)
+    if not gemini_available(): return 'disabled'
+    gemini_model()
+    return 'ready'
+
+
+def run(interval, max_backoff=60):
+    try:
+        _set('gemini', warm_gemini())
+    except Exception as e:
+        _set('gemini', 'error', e)
+
+    backoff = 2
+    while True:
+        try:
+            if STATE['ollama'] != 'ready' or not ollama_loaded():
+                _set('ollama', 'pending')
+                started = time.monotonic()
+                warm_ollama()
+                _set('ollama', 'ready')
+                logger.info(f"Ollama {OLLAMA_MODEL} warmed up in {time.monotonic() - started:.1f}s")
+            backoff = 2
+            time.sleep(interval)
+        except Exception as e:
+            _set('ollama', 'error', e)
+            logger.warning(f"Ollama Warm-up Error: {e} (retry in {backoff}s)")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+def start():
+    """
+    Chạy làm nóng ở thread nền (một lần mỗi tiến trình), không chặn việc khởi động worker.
+    """
+    global _started
+    with _lock:
+        if _started: return
+        _started = True
+    STATE['ollama'] = 'pending'
+    STATE['gemini'] = 'pending'
+    threading.Thread(target=run, args=(getattr(settings, 'LLM_WARMUP_CHECK_INTERVAL', 300),),
+                     daemon=True, name='llm-warmup').start()
+
+
+def readiness():
+    with _lock:
+        models = dict(STATE)
+        errors = dict(_errors)
+    return all(status in READY_STATES for status in models.values()), {'models': models, 'errors': errors}
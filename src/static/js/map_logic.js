@@ -15,8 +15,10 @@ document.addEventListener('DOMContentLoaded', function() {
     const chatInput = document.getElementById('chat-input-text');
     const sendBtn = document.getElementById('btn-chat-send');
 
-    const redIcon = L.icon({ iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-red.png', shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png', iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41] });
-    const blueIcon = L.icon({ iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-blue.png', shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png', iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41] });
+    // URL icon do template cấp (file tự host sau khi build static, chưa build thì là URL gốc)
+    const markerData = document.getElementById('osm-map').dataset;
+    const redIcon = L.icon({ iconUrl: markerData.markerRedUrl, shadowUrl: markerData.markerShadowUrl, iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41] });
+    const blueIcon = L.icon({ iconUrl: markerData.markerBlueUrl, shadowUrl: markerData.markerShadowUrl, iconSize: [25, 41], iconAnchor: [12, 41], popupAnchor: [1, -34], shadowSize: [41, 41] });
 
     // --- CHATBOT LOGIC (QUAN TRỌNG) ---
     async function handleSendMessage() {
@@ -29,7 +31,12 @@ document.addEventListener('DOMContentLoaded', function() {
         const loadingId = appendMessage("AI đang tìm kiếm...", 'bot', true);
 
         try {
-            const response = await fetch('/api/chat/', {
+            if (chatPanel.dataset.chatStreamUrl && window.ReadableStream) {
+                await handleSendMessageStream(message, loadingId);
+                return;
+            }
+
+            const response = await fetch(chatPanel.dataset.chatUrl || '/api/chat/', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify({ message: message })
@@ -61,6 +68,65 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // --- CHAT STREAM (SSE qua fetch POST, chỉ bật khi server chạy ASGI) ---
+    async function handleSendMessageStream(message, loadingId) {
+        const response = await fetch(chatPanel.dataset.chatStreamUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+            body: JSON.stringify({ message: message })
+        });
+        if (!response.ok || !response.body) throw new Error('Stream không khả dụng');
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const removeLoading = () => { const el = document.getElementById(loadingId); if (el) el.remove(); };
+        let buffer = '', replyDiv = null, replyText = '';
+
+        const handleEvent = (event, payload) => {
+            if (event === 'stores') {
+                // 1. Danh sách quán tới trước câu trả lời
+                removeLoading();
+                if (payload.stores && payload.stores.length > 0) {
+                    renderStoreList(payload.stores);
+                    map.flyTo([payload.stores[0].lat, payload.stores[0].lng], 15, { animate: true });
+                }
+            } else if (event === 'token') {
+                // 2. Câu trả lời hiện dần theo từng đoạn
+                removeLoading();
+                if (!replyDiv) { appendMessage('', 'bot'); replyDiv = chatPanel.lastElementChild; }
+                replyText += payload.text;
+                replyDiv.innerHTML = replyText.replace(/\n/g, "<br>");
+                chatPanel.scrollTop = chatPanel.scrollHeight;
+            } else if (event === 'done') {
+                // 3. Dữ liệu đã làm giàu + thẻ gợi ý
+                removeLoading();
+                if (payload.new_data) payload.new_data.forEach(s => { storeDataCache[s.id] = s; });
+                if (payload.suggested_store) appendStoreCard(payload.suggested_store);
+            } else if (event === 'error') {
+                removeLoading();
+                appendMessage("Lỗi: " + payload.message, 'bot');
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) >= 0) {
+                const raw = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                let event = 'message', data = '';
+                raw.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                handleEvent(event, data ? JSON.parse(data) : {});
+            }
+        }
+        removeLoading();
+    }
+
     function appendStoreCard(store) {
         // Cache lại store để click
         storeDataCache[store.id] = store;
@@ -121,6 +187,88 @@ document.addEventListener('DOMContentLoaded', function() {
     if (sendBtn) sendBtn.addEventListener('click', handleSendMessage);
     if (chatInput) chatInput.addEventListener('keypress', (e) => { if (e.key === 'Enter') handleSendMessage(); });
 
+    // --- KHUNG NHÌN: cụm POI ở zoom thấp, từng điểm (phân trang) ở zoom cao ---
+    const mapEl = document.getElementById('osm-map');
+    const viewportUrl = mapEl.dataset.viewportUrl;
+    const tileUrl = mapEl.dataset.tileUrl;
+    const tileMinZoom = parseInt(mapEl.dataset.tileMinZoom || '99', 10);
+    const viewportLayer = L.layerGroup().addTo(map);
+    const VIEWPORT_MAX_PAGES = 5;
+    const viewportDot = L.divIcon({className: 'custom-icon', html: `<div style='background:#8b949e;width:8px;height:8px;border-radius:50%;border:1px solid white;'></div>`, iconSize: [8, 8]});
+    let viewportTimer = null, viewportSeq = 0;
+
+    function clusterIcon(count) {
+        const size = count < 10 ? 28 : (count < 100 ? 36 : 44);
+        return L.divIcon({className: 'custom-icon', html: `<div style='background:rgba(255,123,84,0.85);color:#fff;width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;border:2px solid white;text-align:center;font-size:12px;font-weight:600;'>${count}</div>`, iconSize: [size, size]});
+    }
+    // Tên POI là dữ liệu OSM do người dùng sửa được: gán bằng textContent, không ghép vào HTML
+    function namePopup(name) {
+        const b = document.createElement('b');
+        b.textContent = name || '';
+        return b;
+    }
+    function renderViewportData(data) {
+        (data.clusters || []).forEach(c => {
+            L.marker([c.lat, c.lng], {icon: clusterIcon(c.count)})
+                .on('click', () => map.fitBounds([[c.bbox[0], c.bbox[1]], [c.bbox[2], c.bbox[3]]], { padding: [30, 30] }))
+                .addTo(viewportLayer);
+        });
+        (data.points || []).forEach(p => L.marker([p.lat, p.lng], {icon: viewportDot}).bindPopup(namePopup(p.name)).addTo(viewportLayer));
+    }
+    async function loadViewport() {
+        if (!viewportUrl) return;
+        const seq = ++viewportSeq;
+        // Zoom cao: điểm lấy từ lớp tile POI (cache theo tile), lớp cụm không cần nữa
+        if (tileUrl && map.getZoom() >= tileMinZoom) { viewportLayer.clearLayers(); return; }
+        const b = map.getBounds();
+        const params = new URLSearchParams({ south: b.getSouth().toFixed(5), west: b.getWest().toFixed(5), north: b.getNorth().toFixed(5), east: b.getEast().toFixed(5), zoom: map.getZoom() });
+        let cursor = null, page = 0;
+        try {
+            do {
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch(`${viewportUrl}?${params}`);
+                const data = await response.json();
+                if (seq !== viewportSeq) return; // Bản đồ đã di chuyển tiếp, bỏ kết quả cũ
+                if (page === 0) viewportLayer.clearLayers();
+                if (data.status !== 'success') return;
+                renderViewportData(data);
+                cursor = data.next_cursor;
+            } while (cursor && ++page < VIEWPORT_MAX_PAGES);
+        } catch (error) { console.warn('Viewport error:', error); }
+    }
+    map.on('moveend', () => { clearTimeout(viewportTimer); viewportTimer = setTimeout(loadViewport, 300); });
+    loadViewport();
+
+    // --- TILE POI (GeoJSON theo lưới XYZ, trình duyệt cache bằng ETag) ---
+    const tileMarkers = {};
+    const PoiTileLayer = L.GridLayer.extend({
+        createTile: function(coords, done) {
+            const tile = document.createElement('div');
+            const key = `${coords.z}/${coords.x}/${coords.y}`;
+            tileMarkers[key] = null;
+            fetch(tileUrl.replace('{z}', coords.z).replace('{x}', coords.x).replace('{y}', coords.y))
+                .then(r => r.json())
+                .then(data => {
+                    if (!(key in tileMarkers)) return; // Tile đã bị gỡ trước khi tải xong
+                    tileMarkers[key] = L.layerGroup((data.features || []).map(f =>
+                        L.marker([f.geometry.coordinates[1], f.geometry.coordinates[0]], {icon: viewportDot}).bindPopup(namePopup(f.properties.name))
+                    )).addTo(map);
+                    done(null, tile);
+                })
+                .catch(err => done(err, tile));
+            return tile;
+        }
+    });
+    if (tileUrl) {
+        const poiTiles = new PoiTileLayer({ minZoom: tileMinZoom, maxZoom: 19 });
+        poiTiles.on('tileunload', (e) => {
+            const key = `${e.coords.z}/${e.coords.x}/${e.coords.y}`;
+            if (tileMarkers[key]) map.removeLayer(tileMarkers[key]);
+            delete tileMarkers[key];
+        });
+        poiTiles.addTo(map);
+    }
+
     // --- (CÁC HÀM CŨ GIỮ NGUYÊN) ---
     async function fetchStoresFromBackend(lat, lng) {
         currentUserLat = lat; currentUserLng = lng; 
@@ -212,18 +360,19 @@ document.addEventListener('DOMContentLoaded', function() {
         clearTimeout(debounceTimer);
         if (query.length < 2) return;
         debounceTimer = setTimeout(async () => {
-            const url = `https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(query)}&countrycodes=vn&limit=5`;
+            const url = `${input.dataset.geocodeUrl}?q=${encodeURIComponent(query)}&limit=5`;
             try {
-                const res = await fetch(url); const data = await res.json(); resultsList.innerHTML = '';
+                const res = await fetch(url); const body = await res.json(); resultsList.innerHTML = '';
+                const data = body.results || [];
                 if (data.length === 0) return;
                 data.forEach(place => {
-                    const li = document.createElement('li'); li.innerHTML = `<i class="fas fa-map-marker-alt"></i> ${place.display_name}`;
+                    const li = document.createElement('li'); li.innerHTML = '<i class="fas fa-map-marker-alt"></i> '; li.append(place.display_name);
                     li.addEventListener('click', () => { updateUserLocation(parseFloat(place.lat), parseFloat(place.lon), "Vị trí chọn"); input.value = place.display_name; resultsList.style.display = 'none'; });
                     resultsList.appendChild(li);
                 });
                 resultsList.style.display = 'block';
             } catch (err) { console.error(err); }
-        }, 500);
+        }, 150); // Gợi ý từ server cục bộ nên debounce ngắn hơn
     });
     document.addEventListener('click', (e) => { if (!document.querySelector('.search-container').contains(e.target)) resultsList.style.display = 'none'; });
 });
\ No newline at end of file